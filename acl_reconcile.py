@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+"""
+Bring the access rules of a shared endpoint to the state described in a
+file, instead of adding rules one at a time.
+
+The endpoint's rules are listed once and compared with the desired rules.
+Rules that are missing are created, rules whose permissions differ are
+updated, and rules that aren't wanted are deleted. The changes are always
+printed, and only applied with --yes, MAX_CONCURRENT_CHANGES at a time, so
+managing thousands of rules takes one list call plus one call per actual
+change. Without --yes nothing is changed.
+
+The desired state is read from a JSON (or, with PyYAML installed, YAML)
+file:
+
+{
+    "endpoint": "<shared endpoint UUID>",
+    "paths": ["/share-data-demo/"],
+    "rules": [
+        {
+            "path": "/share-data-demo/godata/",
+            "principal_type": "identity",
+            "principal": "c02d881a-d274-11e5-bdf5-d3a88fb071ca",
+            "permissions": "r"
+        },
+        {
+            "path": "/share-data-demo/godata/",
+            "username": "johndoe@uchicago.edu",
+            "permissions": "rw"
+        },
+        {
+            "path": "/share-data-demo/",
+            "principal_type": "all_authenticated_users",
+            "permissions": "r"
+        }
+    ]
+}
+
+A rule names its principal either with "principal_type" and "principal"
+(not needed for "all_authenticated_users" and "anonymous"), or with an
+identity "username", resolved through identity_cache.py. Only rules on
+"paths" or beneath them are managed; rules elsewhere, such as the rules
+giving this script's own identity access, are left alone, and the file may
+not list any. "paths" is required, unless --all-paths is given to manage
+every rule on the endpoint.
+--endpoint overrides "endpoint".
+
+Authorization is shared with share_data.py, see that script for details.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import globus_sdk
+from globus_sdk.exc import TransferAPIError
+
+from config_file import load_config
+from identity_cache import resolve_usernames
+from globus_session import setup_client
+from path_trie import split_path
+from share_data import (get_authorizer, eprint, APP_AUTHENTICATORS,
+                        AUTHENTICATION)
+
+# Creates, updates and deletes in flight at the same time
+MAX_CONCURRENT_CHANGES = 8
+
+PERMISSIONS = ('r', 'rw')
+PRINCIPAL_TYPES = ('identity', 'group', 'all_authenticated_users',
+                   'anonymous')
+# Principal types that apply to everyone, and take no principal
+PUBLIC_PRINCIPAL_TYPES = ('all_authenticated_users', 'anonymous')
+
+
+def normalize_path(path):
+    """Access rules are on directories, written with a trailing slash."""
+    return '/' + ''.join(part + '/' for part in split_path(path))
+
+
+def load_desired_state(filepath):
+    """Load and validate the desired state from a JSON or YAML file."""
+    state = load_config(filepath)
+
+    for number, rule in enumerate(state.get('rules', []), 1):
+        problem = None
+        if not rule.get('path', '').startswith('/'):
+            problem = 'needs an absolute path'
+        elif rule.get('permissions') not in PERMISSIONS:
+            problem = 'permissions must be one of {}'.format(
+                ', '.join(PERMISSIONS))
+        elif rule.get('username'):
+            if rule.get('principal_type', 'identity') != 'identity':
+                problem = 'a username is always an identity'
+        elif rule.get('principal_type') not in PRINCIPAL_TYPES:
+            problem = 'principal_type must be one of {}'.format(
+                ', '.join(PRINCIPAL_TYPES))
+        elif rule['principal_type'] not in PUBLIC_PRINCIPAL_TYPES and \
+                not rule.get('principal'):
+            problem = 'needs a principal or a username'
+        if problem:
+            eprint('Rule {} {}'.format(number, problem))
+            sys.exit(1)
+    return state
+
+
+def rule_key(principal_type, principal, path):
+    """What identifies a rule: only one rule per principal and path."""
+    if principal_type in PUBLIC_PRINCIPAL_TYPES:
+        principal = ''
+    return principal_type, principal or '', normalize_path(path)
+
+
+def desired_rules(rules, identities):
+    """Return {rule key: permissions} for the rules of the desired state,
+    with usernames replaced by identity IDs from identities."""
+    desired = {}
+    for rule in rules:
+        if rule.get('username'):
+            key = rule_key('identity', identities[rule['username'].lower()],
+                           rule['path'])
+        else:
+            key = rule_key(rule['principal_type'], rule.get('principal'),
+                           rule['path'])
+        if desired.get(key, rule['permissions']) != rule['permissions']:
+            eprint('Conflicting permissions for {} {} on {}'.format(*key))
+            sys.exit(1)
+        desired[key] = rule['permissions']
+    return desired
+
+
+def is_managed(path, paths):
+    parts = split_path(path)
+    return any(parts[:len(managed)] == managed
+               for managed in (split_path(managed) for managed in paths))
+
+
+def plan_changes(current, desired, paths, delete=True):
+    """Diff the endpoint's current rules against desired ({rule key:
+    permissions}). Returns (rule key, permissions) pairs to create, (rule,
+    permissions) pairs to update, and rules to delete."""
+    updates, deletes = [], []
+    seen = set()
+    for rule in current:
+        # The endpoint owner's own access has no ID and can't be changed
+        if rule.get('id') is None or not is_managed(rule['path'], paths):
+            continue
+        key = rule_key(rule['principal_type'], rule.get('principal'),
+                       rule['path'])
+        # Rules the state doesn't want, and duplicates of ones it does
+        if key in seen or key not in desired:
+            if delete:
+                deletes.append(rule)
+            continue
+        seen.add(key)
+        if rule['permissions'] != desired[key]:
+            updates.append((rule, desired[key]))
+    creates = [(key, desired[key]) for key in sorted(desired)
+               if key not in seen]
+    return creates, updates, deletes
+
+
+def describe(principal_type, principal, path):
+    return '{} {}{}'.format(path, principal_type,
+                            ' ' + principal if principal else '')
+
+
+def print_changes(creates, updates, deletes):
+    for key, permissions in creates:
+        print('+ {}: {}'.format(describe(*key), permissions))
+    for rule, permissions in updates:
+        print('~ {}: {} -> {}'.format(
+            describe(rule['principal_type'], rule.get('principal'),
+                     rule['path']), rule['permissions'], permissions))
+    for rule in deletes:
+        print('- {}: {}'.format(
+            describe(rule['principal_type'], rule.get('principal'),
+                     rule['path']), rule['permissions']))
+    print('{} to create, {} to update, {} to delete'.format(
+        len(creates), len(updates), len(deletes)))
+
+
+def create_rule(tc, endpoint, key, permissions):
+    principal_type, principal, path = key
+    try:
+        tc.add_endpoint_acl_rule(endpoint, {
+            'DATA_TYPE': 'access',
+            'principal_type': principal_type,
+            'principal': principal,
+            'path': path,
+            'permissions': permissions,
+        })
+    except TransferAPIError as e:
+        # A create retried after it went through answers "Exists"
+        if e.code != u'Exists':
+            raise
+
+
+def update_rule(tc, endpoint, rule, permissions):
+    tc.update_endpoint_acl_rule(endpoint, rule['id'], {
+        'DATA_TYPE': 'access',
+        'permissions': permissions,
+    })
+
+
+def delete_rule(tc, endpoint, rule):
+    tc.delete_endpoint_acl_rule(endpoint, rule['id'])
+
+
+def apply_changes(tc, endpoint, creates, updates, deletes,
+                  max_concurrent=MAX_CONCURRENT_CHANGES):
+    """Make the changes, max_concurrent at a time, and return the number
+    that failed. Deletes go first, so a principal moved to another path
+    never has two rules at once."""
+    def attempt(change, *change_args):
+        try:
+            change(tc, endpoint, *change_args)
+        except TransferAPIError as e:
+            return e
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+        for changes in ([(delete_rule, rule) for rule in deletes],
+                        [(update_rule, rule, permissions)
+                         for rule, permissions in updates],
+                        [(create_rule, key, permissions)
+                         for key, permissions in creates]):
+            futures = [pool.submit(attempt, *change) for change in changes]
+            for change, future in zip(changes, futures):
+                error = future.result()
+                if error is not None:
+                    failed += 1
+                    eprint('Failed to {} rule: {}'.format(
+                        change[0].__name__.split('_')[0], error))
+    return failed
+
+
+def reconcile(args):
+    state = load_desired_state(args.desired_state)
+    endpoint = args.endpoint or state.get('endpoint')
+    if not endpoint:
+        eprint('No endpoint, set "endpoint" in {} or use --endpoint'.format(
+            args.desired_state))
+        sys.exit(1)
+    rules = state.get('rules', [])
+    paths = ['/'] if args.all_paths else state.get('paths')
+    if not paths:
+        eprint('No paths to manage, set "paths" in {} or use --all-paths to '
+               'manage every rule on the endpoint'.format(args.desired_state))
+        sys.exit(1)
+    # they would never be compared with the endpoint's rules
+    outside = [number for number, rule in enumerate(rules, 1)
+               if not is_managed(rule['path'], paths)]
+    for number in outside:
+        eprint('Rule {} is outside "paths", add its path to "paths" or use '
+               '--all-paths'.format(number))
+    if outside:
+        sys.exit(1)
+
+    authorizer = get_authorizer(args)
+
+    # look up every username that isn't cached at once
+    usernames = [rule['username'] for rule in rules if rule.get('username')]
+    identities = {}
+    if usernames:
+        ac = setup_client(globus_sdk.AuthClient(authorizer=authorizer))
+        identities = resolve_usernames(ac, usernames)
+        unknown = sorted(set(username for username in usernames
+                             if identities[username.lower()] is None))
+        if unknown:
+            eprint('No such identity usernames: {}'.format(
+                ', '.join(unknown)))
+            sys.exit(1)
+    desired = desired_rules(rules, identities)
+
+    tc = setup_client(globus_sdk.TransferClient(authorizer=authorizer))
+    try:
+        current = list(tc.endpoint_acl_list(endpoint))
+    except TransferAPIError as e:
+        eprint(e)
+        sys.exit(1)
+
+    creates, updates, deletes = plan_changes(current, desired, paths,
+                                             delete=not args.no_delete)
+    print_changes(creates, updates, deletes)
+    if not (creates or updates or deletes):
+        return
+    if not args.yes:
+        print('Nothing changed, run again with --yes to apply these changes')
+        return
+    if apply_changes(tc, endpoint, creates, updates, deletes,
+                     args.max_concurrent):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Make the access rules of a shared endpoint match a '
+        'desired state file, creating, updating and deleting only the rules '
+        'that differ.')
+    parser.add_argument(
+        'desired_state',
+        help='JSON or YAML file listing the access rules, see the top of '
+        'this script')
+    parser.add_argument(
+        '--endpoint',
+        help='Shared endpoint UUID, instead of "endpoint" in the file')
+    parser.add_argument(
+        '--yes', action='store_true',
+        help='Apply the changes, instead of only printing them')
+    parser.add_argument(
+        '--all-paths', action='store_true',
+        help='Manage every rule on the endpoint, instead of the rules on '
+        '"paths" in the file')
+    parser.add_argument(
+        '--no-delete', action='store_true',
+        help='Create and update rules, but keep rules missing from the file')
+    parser.add_argument(
+        '--max-concurrent', type=int, default=MAX_CONCURRENT_CHANGES,
+        help='Changes made at the same time (default: %(default)s)')
+    parser.add_argument('--auth', choices=APP_AUTHENTICATORS,
+                        default=AUTHENTICATION)
+    parser.add_argument('--client-secret')
+    args = parser.parse_args()
+
+    reconcile(args)
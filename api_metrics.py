@@ -0,0 +1,226 @@
+"""
+Count and time every Globus API call a script makes, per operation and per
+endpoint, and write the numbers out when the script exits.
+
+Set the GLOBUS_METRICS_DIR environment variable to a directory to turn this
+on. At exit, each script writes <script>.json and a <script>.prom file in
+the Prometheus text format, ready for node_exporter's textfile collector.
+Both files are replaced atomically, with atomic_file.py. When
+GLOBUS_METRICS_DIR is unset, instrumented() hands clients back untouched, so
+nothing is added to any call.
+
+Operations are named after the request, with IDs replaced, e.g.
+"GET operation/endpoint/{id}/ls". For each operation and endpoint the
+metrics hold the number of calls by HTTP status, a latency histogram, the
+number of items listed or submitted, and the number of retries made by
+api_retry.py. The export also has http_pool.py's connection counts: HTTP
+requests sent and connections opened for them, the difference being
+requests that reused a connection.
+"""
+
+import atexit
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+from atomic_file import write_atomic
+from http_pool import connection_stats
+
+METRICS_DIR = os.environ.get('GLOBUS_METRICS_DIR')
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_ID_SEGMENT = re.compile(
+    r'^(?:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+    r'[0-9a-fA-F]{12}|\d+)$')
+_ENDPOINT_PATH = re.compile(r'(?:^|/)endpoint/([^/]+)')
+_DOCUMENT_ENDPOINT_FIELDS = ('endpoint', 'source_endpoint',
+                             'destination_endpoint')
+
+_lock = threading.Lock()
+_metrics = None
+
+
+def operation_name(method_name, path):
+    segments = [segment if not _ID_SEGMENT.match(segment) else '{id}'
+                for segment in path.strip('/').split('/')]
+    return '{} {}'.format(method_name.upper(), '/'.join(segments))
+
+
+def request_endpoints(path, json_body=None):
+    """Return the endpoints a request involves, from its path or, for task
+    submissions, its document."""
+    endpoints = set(_ENDPOINT_PATH.findall(path))
+    if isinstance(json_body, dict):
+        for field in _DOCUMENT_ENDPOINT_FIELDS:
+            if json_body.get(field):
+                endpoints.add(json_body[field])
+    return sorted(endpoints)
+
+
+def _series(operation, endpoints):
+    global _metrics
+    if _metrics is None:
+        _metrics = {}
+        atexit.register(export)
+    key = (operation, ','.join(endpoints))
+    series = _metrics.get(key)
+    if series is None:
+        series = _metrics[key] = {
+            'calls': {}, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            'seconds': 0.0, 'items': 0, 'retries': 0}
+    return series
+
+
+def record_call(operation, endpoints, status, seconds, items):
+    with _lock:
+        series = _series(operation, endpoints)
+        series['calls'][status] = series['calls'].get(status, 0) + 1
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and \
+                seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+        series['buckets'][bucket] += 1
+        series['seconds'] += seconds
+        series['items'] += items
+
+
+def record_retry(method_name, path, endpoints):
+    """Count a retry made by api_retry.py. Does nothing when disabled."""
+    if METRICS_DIR is None:
+        return
+    with _lock:
+        _series(operation_name(method_name, path), endpoints)['retries'] += 1
+
+
+def _item_count(response, json_body):
+    if isinstance(json_body, dict):
+        return len(json_body.get('DATA', ()))
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict):
+        return len(data.get('DATA', ()))
+    return 0
+
+
+def instrument(method):
+    """Wrap a client's bound get, post, put or delete method so every call is
+    recorded. The result must be bound to the client again."""
+    @functools.wraps(method)
+    def call(client, path, *args, **kwargs):
+        json_body = None
+        if method.__name__ in ('post', 'put'):
+            json_body = kwargs.get('json_body', args[0] if args else None)
+        operation = operation_name(method.__name__, path)
+        endpoints = request_endpoints(path, json_body)
+        start = time.time()
+        try:
+            response = method(path, *args, **kwargs)
+        except Exception as error:
+            record_call(operation, endpoints,
+                        str(getattr(error, 'http_status', 'error')),
+                        time.time() - start, 0)
+            raise
+        record_call(operation, endpoints,
+                    str(getattr(response, 'http_status', 200)),
+                    time.time() - start, _item_count(response, json_body))
+        return response
+    return call
+
+
+def instrumented(client):
+    """Record every request client sends if metrics are enabled, and return
+    it."""
+    if METRICS_DIR is None:
+        return client
+    for name in ('get', 'post', 'put', 'delete'):
+        method = instrument(getattr(client, name))
+        setattr(client, name, types.MethodType(method, client))
+    return client
+
+
+def snapshot():
+    """Return the metrics recorded so far as a list of dicts."""
+    with _lock:
+        return [dict(series, operation=operation, endpoint=endpoint,
+                     calls=dict(series['calls']),
+                     buckets=list(series['buckets']))
+                for (operation, endpoint), series in
+                sorted((_metrics or {}).items())]
+
+
+def _label(value):
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"')
+                         .replace('\n', '\\n'))
+
+
+def prometheus_text(metrics, script, connections):
+    labelled = [('script={},operation={},endpoint={}'.format(
+        _label(script), _label(series['operation']),
+        _label(series['endpoint'])), series) for series in metrics]
+    lines = [
+        '# HELP globus_api_calls_total Globus API requests by HTTP status.',
+        '# TYPE globus_api_calls_total counter',
+    ]
+    for labels, series in labelled:
+        for status, count in sorted(series['calls'].items()):
+            lines.append('globus_api_calls_total{{{},status={}}} {}'.format(
+                labels, _label(status), count))
+    lines += [
+        '# HELP globus_api_call_duration_seconds Globus API request latency.',
+        '# TYPE globus_api_call_duration_seconds histogram',
+    ]
+    for labels, series in labelled:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',),
+                                series['buckets']):
+            cumulative += count
+            lines.append(
+                'globus_api_call_duration_seconds_bucket{{{},le={}}} {}'
+                .format(labels, _label(str(bound)), cumulative))
+        lines.append('globus_api_call_duration_seconds_sum{{{}}} {}'.format(
+            labels, series['seconds']))
+        lines.append('globus_api_call_duration_seconds_count{{{}}} {}'.format(
+            labels, cumulative))
+    for name, key, help_text in (
+            ('globus_api_items_total', 'items',
+             'Items listed or submitted by Globus API requests.'),
+            ('globus_api_retries_total', 'retries',
+             'Globus API requests retried after an error.')):
+        lines += ['# HELP {} {}'.format(name, help_text),
+                  '# TYPE {} counter'.format(name)]
+        for labels, series in labelled:
+            lines.append('{}{{{}}} {}'.format(name, labels, series[key]))
+    for name, key, help_text in (
+            ('globus_http_requests_total', 'requests',
+             'HTTP requests sent through the shared connection pool.'),
+            ('globus_http_connections_total', 'connections',
+             'HTTP connections opened by the shared connection pool.')):
+        lines += ['# HELP {} {}'.format(name, help_text),
+                  '# TYPE {} counter'.format(name),
+                  '{}{{script={}}} {}'.format(name, _label(script),
+                                              connections[key])]
+    return '\n'.join(lines) + '\n'
+
+
+def export(directory=None, script=None):
+    """Write the metrics as JSON and in the Prometheus text format. Called
+    at exit when metrics are enabled."""
+    directory = directory or METRICS_DIR
+    script = script or os.path.splitext(os.path.basename(sys.argv[0]))[0] \
+        or 'python'
+    metrics = snapshot()
+    connections = connection_stats()
+    # readable by node_exporter, which usually runs as another user
+    write_atomic(os.path.join(directory, script + '.json'),
+                 json.dumps({'script': script, 'exported_at': time.time(),
+                             'latency_buckets': LATENCY_BUCKETS,
+                             'connections': connections,
+                             'operations': metrics}, indent=2), mode=0o644)
+    write_atomic(os.path.join(directory, script + '.prom'),
+                 prometheus_text(metrics, script, connections), mode=0o644)
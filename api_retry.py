@@ -0,0 +1,198 @@
+"""
+Retry throttled and transient Globus API errors instead of failing the run.
+
+with_retries(client) wraps the get/post/put/delete methods that every
+globus_sdk client method, including paginated listings, goes through. A call
+that fails with a retryable error (429, 5xx, or a network error) is retried
+up to MAX_ATTEMPTS times with jittered exponential backoff, waiting at least
+as long as the service's Retry-After header asks. Any other error is raised
+at once.
+
+A POST that failed with a 5xx or network error may still have been carried
+out, so it is only sent again when doing it twice is harmless: task
+submissions, whose submission_id makes the service return the first task
+instead of a second one, access rule creates, where the scripts treat an
+"Exists" answer as success, and autoactivation. Other POSTs, like
+operation_mkdir, are only retried after a 429, which means the request was
+refused without being carried out.
+
+Repeated server or network errors against one endpoint trip a circuit
+breaker for that endpoint: for BREAKER_COOLDOWN seconds, calls that involve
+it raise CircuitOpenError straight away, without contacting the service.
+Work on other endpoints carries on at full speed. Throttling (429) is
+service wide, so it is retried but never trips a breaker. CircuitOpenError
+is a TransferAPIError, so the scripts' existing error handling applies to
+it.
+"""
+
+from __future__ import print_function
+
+import functools
+import random
+import sys
+import threading
+import time
+import types
+
+from globus_sdk.exc import GlobusAPIError, NetworkError, TransferAPIError
+
+from api_metrics import record_retry, request_endpoints
+
+MAX_ATTEMPTS = 6
+# Backoff before retry n is random, up to BASE_DELAY * 2 ** n seconds but
+# capped at MAX_DELAY
+BASE_DELAY = 1
+MAX_DELAY = 60
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# POSTs to paths ending in these are safe to send twice
+REPEATABLE_POST_PATHS = ('/access', '/autoactivate')
+
+# Consecutive retryable failures on an endpoint that open its breaker
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 120
+
+
+class CircuitOpenError(TransferAPIError):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+    def __init__(self, endpoint, retry_at):
+        self._underlying_response = None
+        self.http_status = 503
+        self.code = 'CircuitOpen'
+        self.request_id = None
+        self.endpoint = endpoint
+        self.message = ('Too many failures on endpoint {}, not calling it '
+                        'again for {:.0f} seconds'.format(
+                            endpoint, max(0, retry_at - time.time())))
+        Exception.__init__(self, self.http_status, self.code, self.message)
+
+
+class CircuitBreakers(object):
+    """Consecutive failure counts and open breakers, per endpoint."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD,
+                 cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.open_until = {}
+
+    def check(self, endpoints):
+        """Raise CircuitOpenError if any of endpoints has an open breaker."""
+        now = time.time()
+        with self.lock:
+            for endpoint in endpoints:
+                retry_at = self.open_until.get(endpoint)
+                if retry_at is None:
+                    continue
+                if now < retry_at:
+                    raise CircuitOpenError(endpoint, retry_at)
+                # Cooled down: let calls through, but trip again on the
+                # next failure
+                del self.open_until[endpoint]
+                self.failures[endpoint] = self.threshold - 1
+
+    def record_success(self, endpoints):
+        with self.lock:
+            for endpoint in endpoints:
+                self.failures.pop(endpoint, None)
+
+    def record_failure(self, endpoints):
+        with self.lock:
+            for endpoint in endpoints:
+                failures = self.failures.get(endpoint, 0) + 1
+                self.failures[endpoint] = failures
+                if failures >= self.threshold:
+                    self.open_until[endpoint] = time.time() + self.cooldown
+                    print('Circuit breaker opened for endpoint {}'.format(
+                        endpoint), file=sys.stderr)
+
+
+breakers = CircuitBreakers()
+
+
+def is_retryable(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, NetworkError):
+        return True
+    return isinstance(error, GlobusAPIError) and \
+        error.http_status in RETRYABLE_STATUSES
+
+
+def is_repeatable(method_name, path, json_body):
+    """Whether sending the request a second time, after it may already have
+    been carried out, does no harm."""
+    if method_name != 'post':
+        return True
+    if isinstance(json_body, dict) and json_body.get('submission_id'):
+        return True
+    return path.rstrip('/').endswith(REPEATABLE_POST_PATHS)
+
+
+def retry_after(error):
+    """Return the delay in seconds requested by error's Retry-After header,
+    or 0."""
+    response = getattr(error, '_underlying_response', None)
+    if response is None:
+        return 0
+    try:
+        return float(response.headers.get('Retry-After', 0))
+    except ValueError:
+        # An HTTP date; fall back to plain backoff
+        return 0
+
+
+def backoff_delay(attempt, error):
+    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after(error))
+
+
+def retrying(method, max_attempts=MAX_ATTEMPTS, circuit_breakers=breakers):
+    """Wrap a client's bound get, post, put or delete method with retries.
+    The result must be bound to the client again, paginated results use
+    its __self__."""
+    @functools.wraps(method)
+    def call(client, path, *args, **kwargs):
+        json_body = None
+        if method.__name__ in ('post', 'put'):
+            json_body = kwargs.get('json_body', args[0] if args else None)
+        endpoints = request_endpoints(path, json_body)
+        repeatable = is_repeatable(method.__name__, path, json_body)
+        attempt = 0
+        while True:
+            circuit_breakers.check(endpoints)
+            try:
+                result = method(path, *args, **kwargs)
+            except Exception as error:
+                if not is_retryable(error):
+                    raise
+                throttled = getattr(error, 'http_status', None) == 429
+                if not throttled:
+                    circuit_breakers.record_failure(endpoints)
+                    if not repeatable:
+                        raise
+                attempt += 1
+                if attempt >= max_attempts:
+                    raise
+                delay = backoff_delay(attempt, error)
+                record_retry(method.__name__, path, endpoints)
+                print('{} {} failed with {}, retrying in {:.1f}s'.format(
+                    method.__name__.upper(), path,
+                    getattr(error, 'http_status', type(error).__name__),
+                    delay), file=sys.stderr)
+                time.sleep(delay)
+                continue
+            circuit_breakers.record_success(endpoints)
+            return result
+    return call
+
+
+def with_retries(client, max_attempts=MAX_ATTEMPTS):
+    """Make every request client sends retry retryable errors, and return
+    it."""
+    for name in ('get', 'post', 'put', 'delete'):
+        method = retrying(getattr(client, name), max_attempts)
+        setattr(client, name, types.MethodType(method, client))
+    return client
@@ -0,0 +1,80 @@
+"""
+Write the small JSON and text files the scripts keep between runs, safely
+when several scripts run at once.
+
+write_atomic() writes to a temporary file of its own next to the target and
+renames it over the target, so readers see either the old or the new file,
+never half of one, and writers never trip over each other's temporary
+files. update_json() also holds an exclusive lock on a companion
+"<file>.lock" while it reads, changes and writes the file, so changes made
+by scripts running at the same time are all kept. Locking uses fcntl, and
+is skipped where fcntl is not available (Windows); writes are still atomic
+there, but a concurrent change may be lost.
+"""
+
+import contextlib
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@contextlib.contextmanager
+def locked(filepath):
+    """Hold an exclusive lock for filepath until the block exits."""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(filepath + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def write_atomic(filepath, text, mode=None):
+    """Replace filepath with text. mode sets the file's permissions, the
+    default for mkstemp is readable only by its owner."""
+    directory, name = os.path.split(os.path.abspath(filepath))
+    fd, tmp_filepath = tempfile.mkstemp(prefix=name + '.', suffix='.tmp',
+                                        dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        if mode is not None:
+            os.chmod(tmp_filepath, mode)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+
+
+def load_json(filepath, default=None):
+    """Return the JSON in filepath, or default if it is missing or
+    damaged."""
+    if not os.path.exists(filepath):
+        return default
+    try:
+        with open(filepath, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return default
+
+
+def update_json(filepath, update, mode=None):
+    """Call update with the JSON object in filepath (an empty dict if the
+    file is missing or damaged), which it changes in place, and save the
+    result, all under filepath's lock. Returns the saved object."""
+    with locked(filepath):
+        data = load_json(filepath, None)
+        if not isinstance(data, dict):
+            data = {}
+        update(data)
+        write_atomic(filepath, json.dumps(data), mode)
+    return data
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+
+"""
+Submit a transfer of a long list of files, like `globus transfer --batch` in
+the batch transfer recipe (batch.md), without holding the whole list in
+memory.
+
+Source and destination pairs are read line by line from a file, or from
+standard input, in the same format as the CLI:
+
+    run1/watertable.h0.0001.nc watertable.h0.0001.nc
+    --recursive run1/restart/ restart/
+
+Paths are relative to the source and destination paths given on the command
+line. Blank lines and lines starting with # are ignored.
+
+Each line is checked as it is read. Lines that can't be parsed, or have ".."
+in a path, are reported and skipped. So is a second line copying to the same
+destination: the same pair again is only counted, while a different source
+is reported as a collision. Destinations seen so far are kept in a
+temporary SQLite file as digests, so memory use does not grow with the
+number of lines.
+
+Pairs are submitted in batches of at most MAX_BATCH_ITEMS items and about
+MAX_BATCH_BYTES of JSON each, so a million files make a handful of tasks
+rather than one document the Transfer API would refuse. Each batch's
+submission_id is saved in BATCH_STATE_FILE before the batch is submitted.
+Running the same command again after a failure or interruption reuses the
+same submission_ids, so batches that were already accepted are reported and
+not submitted twice. Once every batch of the list has been submitted, its
+batches are dropped from BATCH_STATE_FILE, so the same list run again later
+is transferred again.
+
+Authorization is shared with globus_folder_sync.py, see that script for
+details.
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import posixpath
+import shlex
+import sqlite3
+import sys
+import tempfile
+
+from globus_sdk import TransferData
+from globus_sdk.exc import TransferAPIError
+
+from atomic_file import write_atomic
+from globus_folder_sync import get_transfer_tokens, setup_transfer_client
+
+BATCH_STATE_FILE = 'batch-transfer-state.json'
+
+# Items per transfer task
+MAX_BATCH_ITEMS = 50000
+# Rough size of a task's JSON document, kept well under what the Transfer
+# API accepts in one request
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+
+TRANSFER_LABEL = 'Batch Transfer Example'
+
+# Memory SQLite may use for the destinations seen, in KiB
+INDEX_CACHE_KB = 8 * 1024
+
+# Skipped lines reported one by one, the rest are only counted
+MAX_REPORTED_PROBLEMS = 10
+
+# JSON of an item, apart from its paths
+ITEM_OVERHEAD = len(json.dumps({'DATA_TYPE': 'transfer_item',
+                                'source_path': '', 'destination_path': '',
+                                'recursive': False})) + 2
+
+
+def eprint(*args, **kwargs):
+    """Same as print, but to standard error"""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def parse_endpoint_path(value):
+    """Split ENDPOINT_ID[:PATH], as the CLI writes it."""
+    endpoint, _, path = value.partition(':')
+    return endpoint, path or '/~/'
+
+
+def parse_line(line, source_base, destination_base):
+    """Return (source path, destination path, recursive) for a line of the
+    batch, None for a line to ignore, or raise ValueError."""
+    # shlex is slow, and only needed for quoted paths and comments
+    if any(character in line for character in '"\'\\#'):
+        words = shlex.split(line, comments=True)
+    else:
+        words = line.split()
+    if not words:
+        return None
+    recursive = words[0] in ('--recursive', '-r')
+    if recursive:
+        words = words[1:]
+    if len(words) != 2:
+        raise ValueError('expected a source and a destination path')
+    paths = []
+    for base, path in zip((source_base, destination_base), words):
+        if '..' in path.split('/'):
+            raise ValueError('".." in {}'.format(path))
+        joined = posixpath.normpath(posixpath.join(base, path))
+        if path.endswith('/') and joined != '/':
+            joined += '/'
+        paths.append(joined)
+    return paths[0], paths[1], recursive
+
+
+class DestinationIndex(object):
+    """The destinations of the pairs read so far, on disk."""
+
+    def __init__(self):
+        fd, self.filepath = tempfile.mkstemp(prefix='batch-transfer-',
+                                             suffix='.db')
+        os.close(fd)
+        self.connection = sqlite3.connect(self.filepath)
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('PRAGMA cache_size = -{}'.format(
+            INDEX_CACHE_KB))
+        self.connection.execute(
+            'CREATE TABLE destinations (destination INTEGER PRIMARY KEY, '
+            'source INTEGER NOT NULL)')
+
+    def add(self, source, destination):
+        """Return 'new' the first time destination is added, then
+        'duplicate' for the same source or 'collision' for another one."""
+        source_digest = digest(source)
+        destination_digest = digest(destination)
+        cursor = self.connection.execute(
+            'INSERT OR IGNORE INTO destinations VALUES (?, ?)',
+            (destination_digest, source_digest))
+        if cursor.rowcount:
+            return 'new'
+        first_source, = self.connection.execute(
+            'SELECT source FROM destinations WHERE destination = ?',
+            (destination_digest,)).fetchone()
+        if first_source == source_digest:
+            return 'duplicate'
+        return 'collision'
+
+    def close(self):
+        self.connection.close()
+        os.remove(self.filepath)
+
+
+def digest(path):
+    """A 64 bit digest of path, which as an SQLite integer key is much
+    quicker to insert than the path itself. Two of a million paths sharing
+    one is about a one in ten million chance."""
+    return int.from_bytes(hashlib.blake2b(path.encode('utf-8'),
+                                          digest_size=8).digest(),
+                          'big', signed=True)
+
+
+def read_batches(lines, source_base, destination_base, problems,
+                 max_items=MAX_BATCH_ITEMS, max_bytes=MAX_BATCH_BYTES):
+    """Yield lists of at most max_items (source, destination, recursive)
+    items, about max_bytes of JSON each, from lines. Skipped lines are
+    counted in problems, by reason."""
+    index = DestinationIndex()
+    batch, batch_bytes = [], 0
+    try:
+        for number, line in enumerate(lines, 1):
+            try:
+                item = parse_line(line, source_base, destination_base)
+            except ValueError as e:
+                report(problems, 'invalid', 'Line {}: {}'.format(number, e))
+                continue
+            if item is None:
+                continue
+            source, destination, _ = item
+            added = index.add(source, destination)
+            if added == 'duplicate':
+                problems['duplicate'] = problems.get('duplicate', 0) + 1
+                continue
+            if added == 'collision':
+                report(problems, 'collision',
+                       'Line {}: an earlier line already copies another file '
+                       'to {}, skipping {}'.format(number, destination,
+                                                   source))
+                continue
+            size = ITEM_OVERHEAD + len(json.dumps(source)) + \
+                len(json.dumps(destination))
+            if batch and (len(batch) >= max_items or
+                          batch_bytes + size > max_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(item)
+            batch_bytes += size
+        if batch:
+            yield batch
+    finally:
+        index.close()
+
+
+def report(problems, reason, message):
+    problems[reason] = problems.get(reason, 0) + 1
+    if sum(problems.values()) - problems.get('duplicate', 0) <= \
+            MAX_REPORTED_PROBLEMS:
+        eprint(message)
+
+
+def batch_fingerprint(batch, settings):
+    """Identifies a batch across runs: the same items with the same
+    settings always get the same fingerprint."""
+    fingerprint = hashlib.sha256(json.dumps(settings, sort_keys=True)
+                                 .encode('utf-8'))
+    for source, destination, recursive in batch:
+        fingerprint.update(u'{}\0{}\0{}\n'.format(source, destination,
+                                                  int(recursive))
+                           .encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def load_state(filepath=BATCH_STATE_FILE):
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath, 'r') as f:
+        return json.load(f).get('batches', {})
+
+
+def save_state(batches, filepath=BATCH_STATE_FILE):
+    if not batches:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return
+    write_atomic(filepath, json.dumps({'batches': batches}, indent=2))
+
+
+def submit_batch(transfer_client, batch, settings, state):
+    """Submit batch with the submission_id saved for it, getting and saving
+    one first if it is new. Returns the fingerprint of the batch, its task
+    ID, and whether an earlier run had already submitted it."""
+    fingerprint = batch_fingerprint(batch, settings)
+    saved = state.setdefault(fingerprint, {})
+    if saved.get('task_id'):
+        return fingerprint, saved['task_id'], True
+    if not saved.get('submission_id'):
+        # saved before submitting, so a retry can't make a second task
+        saved['submission_id'] = \
+            transfer_client.get_submission_id()['value']
+        save_state(state)
+
+    tdata = TransferData(transfer_client, settings['source_endpoint'],
+                         settings['destination_endpoint'],
+                         label=settings['label'],
+                         submission_id=saved['submission_id'],
+                         sync_level=settings['sync_level'])
+    for source, destination, recursive in batch:
+        tdata.add_item(source, destination, recursive=recursive)
+    # A submission_id that was already accepted returns that task again
+    result = transfer_client.submit_transfer(tdata)
+    saved['task_id'] = result['task_id']
+    save_state(state)
+    return fingerprint, saved['task_id'], result['code'] == 'Duplicate'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Transfer a list of files read from a file or standard '
+        'input, in as few tasks as fit, without reading it all into memory.')
+    parser.add_argument('source', metavar='SOURCE_ENDPOINT_ID[:PATH]')
+    parser.add_argument('destination',
+                        metavar='DESTINATION_ENDPOINT_ID[:PATH]')
+    parser.add_argument('--batch', default='-',
+                        help='File of source and destination paths, one '
+                        'pair per line (default: standard input)')
+    parser.add_argument('--label', default=TRANSFER_LABEL)
+    parser.add_argument('--sync-level',
+                        choices=('exists', 'size', 'mtime', 'checksum'))
+    parser.add_argument('--max-items', type=int, default=MAX_BATCH_ITEMS,
+                        help='Items per task (default: %(default)s)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Check the list and print the tasks it would '
+                        'make, without logging in or submitting')
+    args = parser.parse_args()
+
+    source_endpoint, source_base = parse_endpoint_path(args.source)
+    destination_endpoint, destination_base = \
+        parse_endpoint_path(args.destination)
+    settings = {'source_endpoint': source_endpoint,
+                'destination_endpoint': destination_endpoint,
+                'label': args.label, 'sync_level': args.sync_level}
+
+    transfer_client = None
+    if not args.dry_run:
+        transfer_client = setup_transfer_client(
+            get_transfer_tokens(), [source_endpoint, destination_endpoint])
+    state = load_state()
+
+    lines = sys.stdin if args.batch == '-' else open(args.batch, 'r')
+    problems = {}
+    items = 0
+    submitted = []
+    try:
+        for number, batch in enumerate(read_batches(
+                lines, source_base, destination_base, problems,
+                max_items=args.max_items), 1):
+            items += len(batch)
+            if args.dry_run:
+                print('Batch {}: {} items'.format(number, len(batch)))
+                continue
+            try:
+                fingerprint, task_id, resumed = submit_batch(
+                    transfer_client, batch, settings, state)
+            except TransferAPIError as e:
+                eprint('Batch {} of {} items failed: {}'.format(
+                    number, len(batch), e))
+                eprint('Run the same command again to retry, batches '
+                       'already submitted are skipped')
+                sys.exit(1)
+            submitted.append(fingerprint)
+            print('Batch {}: {} items{}\n\ttask_id: {}'.format(
+                number, len(batch),
+                ', already submitted by an earlier run, skipped' if resumed
+                else '', task_id))
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+    if not args.dry_run:
+        # The whole list is submitted, nothing is left to resume
+        for fingerprint in submitted:
+            state.pop(fingerprint, None)
+        save_state(state)
+
+    print('{} items {}'.format(items, 'to transfer' if args.dry_run
+                               else 'submitted'))
+    if problems.get('duplicate'):
+        print('{} duplicate lines skipped'.format(problems['duplicate']))
+    skipped = problems.get('invalid', 0) + problems.get('collision', 0)
+    if skipped:
+        eprint('{} invalid lines and {} colliding destinations skipped'
+               .format(problems.get('invalid', 0),
+                       problems.get('collision', 0)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
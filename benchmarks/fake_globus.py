@@ -0,0 +1,581 @@
+#!/usr/bin/env python
+
+"""
+A local, in-memory stand-in for the parts of the Globus Transfer and Auth
+APIs that the example scripts use, for benchmarking them offline.
+
+Every endpoint holds the same synthetic tree under TREE_ROOT, where the
+scripts' tutorial defaults point, plus any directories created with mkdir.
+The tree, the access rules on the source endpoint and the history of
+completed tasks are generated from a Workload, so runs are repeatable:
+
+  * tree_depth levels of directories, each with tree_fanout subdirectories
+    and files_per_dir files.
+  * acl_count access rules, spread over the directories of the tree.
+  * task_count completed transfers from whichever endpoint
+    endpoint_manager_task_list is filtered on. Even-numbered tasks transfer
+    a whole directory, odd-numbered ones half of the files in it.
+
+Each request is delayed by latency seconds, and a throttle_rate fraction of
+requests is refused with a 429 and "Retry-After: 0". Submitted tasks
+succeed task_duration seconds after submission, but delete tasks remove
+what they name straight away.
+
+Run as a script to serve on a fixed port:
+
+    ./fake_globus.py --port 8000
+
+then point the Globus SDK at it with an environment in ~/.globus.cfg:
+
+    [environment benchmark]
+    auth_service = http://127.0.0.1:8000/
+    transfer_service = http://127.0.0.1:8000/
+
+and GLOBUS_SDK_ENVIRONMENT=benchmark. run_benchmarks.py does all of this
+itself.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from six.moves.urllib.parse import urlparse, parse_qs
+
+TREE_ROOT = '/share/godata/'
+LAST_MODIFIED = '2020-01-01 00:00:00+00:00'
+# Page size of listings paged by marker or last_key when no limit is given
+DEFAULT_PAGE_SIZE = 1000
+
+Workload = namedtuple('Workload', [
+    'tree_depth', 'tree_fanout', 'files_per_dir', 'acl_count', 'task_count',
+    'latency', 'throttle_rate', 'task_duration', 'seed'])
+Workload.__new__.__defaults__ = (3, 4, 25, 50, 20, 0.0, 0.0, 0.0, 0)
+
+_DIRECTORY_NAME = re.compile(r'^dir(\d{3})$')
+_IDENTITY_NAMESPACE = uuid.UUID('6ba7b811-9dad-11d1-80b4-00c04fd430c8')
+
+
+class APIError(Exception):
+
+    def __init__(self, status, code, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def split_path(path):
+    return [part for part in path.split('/') if part and part != '.']
+
+
+def join_path(parts):
+    return '/' + ''.join(part + '/' for part in parts)
+
+
+def directory_name(index):
+    return 'dir{:03d}'.format(index)
+
+
+def file_name(index):
+    return 'file{:04d}.dat'.format(index)
+
+
+def file_size(index):
+    return 1024 * (index + 1)
+
+
+def identity_id(username):
+    return str(uuid.uuid5(_IDENTITY_NAMESPACE, username))
+
+
+class SyntheticTree(object):
+    """The directory tree generated for a Workload. Nothing is stored, every
+    listing is computed from its path."""
+
+    def __init__(self, workload, root=TREE_ROOT):
+        self.workload = workload
+        self.root = split_path(root)
+
+    def relative(self, path):
+        """Return the parts of path below the root, or None if path is not
+        a directory of the tree."""
+        parts = split_path(path)
+        if parts[:len(self.root)] != self.root:
+            return None
+        relative = parts[len(self.root):]
+        if len(relative) > self.workload.tree_depth:
+            return None
+        for part in relative:
+            match = _DIRECTORY_NAME.match(part)
+            if match is None or \
+                    int(match.group(1)) >= self.workload.tree_fanout:
+                return None
+        return relative
+
+    def listing(self, relative):
+        entries = []
+        if len(relative) < self.workload.tree_depth:
+            entries += [{'name': directory_name(index), 'type': 'dir',
+                         'size': 4096}
+                        for index in range(self.workload.tree_fanout)]
+        entries += [{'name': file_name(index), 'type': 'file',
+                     'size': file_size(index)}
+                    for index in range(self.workload.files_per_dir)]
+        return entries
+
+    def directories(self, relative=()):
+        """Yield the relative parts of every directory beneath relative,
+        breadth first."""
+        level = [list(relative)]
+        while level:
+            next_level = []
+            for parts in level:
+                yield parts
+                if len(parts) < self.workload.tree_depth:
+                    next_level += [parts + [directory_name(index)]
+                                   for index in
+                                   range(self.workload.tree_fanout)]
+            level = next_level
+
+    def files(self, relative, fraction=1.0):
+        """Yield the path of every file beneath relative, or, with a
+        fraction below 1, of only that fraction of the files directly in
+        relative."""
+        if fraction < 1:
+            count = max(1, int(self.workload.files_per_dir * fraction))
+            for index in range(count):
+                yield join_path(self.root + list(relative)) + file_name(index)
+            return
+        for parts in self.directories(relative):
+            base = join_path(self.root + parts)
+            for index in range(self.workload.files_per_dir):
+                yield base + file_name(index)
+
+
+class FakeGlobus(object):
+    """State and request handling of the fake service. Safe to use from the
+    server's request threads."""
+
+    def __init__(self, workload=Workload()):
+        self.workload = workload
+        self.tree = SyntheticTree(workload)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop everything created by earlier requests and generate the
+        workload's access rules and task history again."""
+        with self.lock:
+            self.random = random.Random(self.workload.seed)
+            self.created = {}
+            self.deleted = {}
+            self.tasks = {}
+            self.submissions = {}
+            self.acls = {}
+            self.requests = 0
+            self.throttled = 0
+            # Directories below the top of the tree, the ones rules and
+            # tasks are spread over
+            directories = [parts for parts in self.tree.directories()
+                           if parts] or [[]]
+            for number in range(self.workload.acl_count):
+                parts = directories[number % len(directories)]
+                rule_id = str(number + 1)
+                self.acls[rule_id] = {
+                    'DATA_TYPE': 'access', 'id': rule_id,
+                    'path': join_path(self.tree.root + parts),
+                    'principal_type': 'identity',
+                    'principal': identity_id('user{}@example.org'.format(
+                        number)),
+                    'permissions': 'r'}
+            self.history = []
+            for number in range(self.workload.task_count):
+                self.history.append({
+                    'task_id': str(uuid.UUID(int=number + 1)),
+                    'type': 'TRANSFER', 'status': 'SUCCEEDED',
+                    'owner_string': 'user{}@example.org'.format(number),
+                    'source_host_path': None,
+                    'completion_time': datetime.utcnow().strftime(
+                        '%Y-%m-%dT%H:%M:%S+00:00'),
+                    'directory': directories[number % len(directories)],
+                    'fraction': 1.0 if number % 2 == 0 else 0.5})
+
+    def handle(self, method, url, body):
+        """Return (status, headers, document) for one request."""
+        with self.lock:
+            self.requests += 1
+            request_id = 'fake{}'.format(self.requests)
+            throttled = self.random.random() < self.workload.throttle_rate
+            if throttled:
+                self.throttled += 1
+        if self.workload.latency:
+            time.sleep(self.workload.latency)
+        if throttled:
+            return 429, {'Retry-After': '0'}, {
+                'code': 'RequestsThrottled',
+                'message': 'Too many requests, slow down',
+                'request_id': request_id}
+        parsed = urlparse(url)
+        params = {key: values[-1]
+                  for key, values in parse_qs(parsed.query).items()}
+        try:
+            return 200, {}, self.route(method, split_path(parsed.path),
+                                       params, body)
+        except APIError as error:
+            return error.status, {}, {'code': error.code,
+                                      'message': error.message,
+                                      'request_id': request_id,
+                                      'resource': parsed.path}
+
+    def route(self, method, parts, params, body):
+        if parts[:1] == ['v2']:
+            return self.route_auth(method, parts[1:], params, body)
+        if parts[:1] != ['v0.10']:
+            raise APIError(404, 'NotFound', 'No such API')
+        parts = parts[1:]
+        if parts[:1] == ['endpoint_manager']:
+            manager = True
+            parts = parts[1:]
+        else:
+            manager = False
+        route = (method,) + tuple(part if index % 2 == 0 else '{id}'
+                                  for index, part in enumerate(parts))
+        ids = parts[1::2]
+        with self.lock:
+            if parts[:2] == ['operation', 'endpoint'] and len(parts) == 4:
+                if parts[3] == 'ls' and method == 'GET':
+                    return self.ls(parts[2], params)
+                if parts[3] == 'mkdir' and method == 'POST':
+                    return self.mkdir(parts[2], body['path'])
+            if route == ('POST', 'endpoint', '{id}', 'autoactivate'):
+                return {'DATA_TYPE': 'activation_result',
+                        'code': 'AlreadyActivated', 'expires_in': -1,
+                        'message': 'Endpoint already activated'}
+            if route == ('GET', 'endpoint', '{id}', 'access_list'):
+                # Not paged, every rule is returned at once
+                return {'DATA_TYPE': 'access_list',
+                        'DATA': list(self.acls.values())}
+            if route == ('POST', 'endpoint', '{id}', 'access'):
+                return self.add_acl(body)
+            if route == ('PUT', 'endpoint', '{id}', 'access', '{id}'):
+                return self.update_acl(ids[1], body)
+            if route == ('DELETE', 'endpoint', '{id}', 'access', '{id}'):
+                return self.delete_acl(ids[1])
+            if route == ('GET', 'submission_id'):
+                return {'value': str(uuid.uuid4())}
+            if route in (('POST', 'transfer'), ('POST', 'delete')):
+                return self.submit(body)
+            if route == ('GET', 'task', '{id}'):
+                return self.task(ids[0])
+            if route == ('GET', 'task_list'):
+                return self.task_list(params, manager)
+            if route == ('GET', 'task', '{id}', 'successful_transfers'):
+                return self.successful_transfers(ids[0], params)
+        raise APIError(404, 'NotFound', 'No such API')
+
+    def route_auth(self, method, parts, params, body):
+        if method == 'POST' and parts == ['oauth2', 'token']:
+            return {'access_token': 'benchmark-transfer-token',
+                    'scope': 'urn:globus:auth:scope:transfer.api.globus.org'
+                             ':all',
+                    'resource_server': 'transfer.api.globus.org',
+                    'expires_in': 172800, 'token_type': 'Bearer',
+                    'other_tokens': []}
+        if method == 'GET' and parts == ['api', 'identities']:
+            if params.get('usernames'):
+                usernames = params['usernames'].split(',')
+            else:
+                usernames = [identity for identity in
+                             params.get('ids', '').split(',') if identity]
+            return {'identities': [{
+                'id': identity_id(username), 'username': username,
+                'name': None, 'email': username, 'status': 'used',
+                'identity_provider': identity_id('example.org'),
+                'organization': None} for username in usernames]}
+        raise APIError(404, 'NotFound', 'No such API')
+
+    def page(self, items, params, data_type):
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        return {'DATA_TYPE': data_type, 'offset': offset, 'limit': limit,
+                'total': len(items), 'DATA': items[offset:offset + limit]}
+
+    def in_tree(self, endpoint, parts):
+        """Return True if parts is a directory of the tree that has not been
+        deleted from endpoint."""
+        if self.tree.relative(join_path(parts)) is None:
+            return False
+        deleted = self.deleted.get(endpoint, ())
+        return not any(tuple(parts[:length]) in deleted
+                       for length in range(1, len(parts) + 1))
+
+    def ls(self, endpoint, params):
+        path = params.get('path', '/~/')
+        parts = split_path(path)
+        if self.in_tree(endpoint, parts):
+            deleted = self.deleted.get(endpoint, ())
+            entries = [entry for entry in
+                       self.tree.listing(self.tree.relative(path))
+                       if tuple(parts + [entry['name']]) not in deleted]
+        elif parts == self.tree.root[:len(parts)]:
+            # Above the tree, on the way down to it
+            entries = [{'name': self.tree.root[len(parts)], 'type': 'dir',
+                        'size': 4096}]
+        elif tuple(parts) in self.created.get(endpoint, ()) or \
+                parts in ([], ['~']):
+            entries = []
+        else:
+            raise APIError(404, 'ClientError.NotFound',
+                           "Directory '{}' not found".format(path))
+        created = self.created.get(endpoint, set())
+        entries += [{'name': other[-1], 'type': 'dir', 'size': 4096}
+                    for other in sorted(created)
+                    if list(other[:-1]) == parts]
+        for entry in entries:
+            entry.update({'DATA_TYPE': 'file',
+                          'last_modified': LAST_MODIFIED,
+                          'permissions': '0755' if entry['type'] == 'dir'
+                          else '0644'})
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100000))
+        return {'DATA_TYPE': 'file_list', 'endpoint': endpoint,
+                'path': join_path(parts), 'offset': offset, 'limit': limit,
+                'total': len(entries), 'DATA': entries[offset:offset + limit]}
+
+    def mkdir(self, endpoint, path):
+        parts = tuple(split_path(path))
+        created = self.created.setdefault(endpoint, set())
+        if parts in created or self.in_tree(endpoint, list(parts)):
+            raise APIError(502, 'ExternalError.MkdirFailed.Exists',
+                           "Path '{}' already exists".format(path))
+        created.add(parts)
+        return {'DATA_TYPE': 'mkdir_result', 'code': 'DirectoryCreated',
+                'message': 'The directory was created successfully'}
+
+    def add_acl(self, rule):
+        for existing in self.acls.values():
+            if (existing['principal'], existing['path']) == \
+                    (rule['principal'], rule['path']):
+                raise APIError(409, 'Exists', 'Access rule already exists')
+        rule_id = str(max([int(key) for key in self.acls] or [0]) + 1)
+        self.acls[rule_id] = dict(rule, id=rule_id)
+        return {'DATA_TYPE': 'access_create_result', 'code': 'Created',
+                'access_id': int(rule_id),
+                'message': 'Access rule created successfully.'}
+
+    def update_acl(self, rule_id, rule):
+        if rule_id not in self.acls:
+            raise APIError(404, 'AccessRuleNotFound',
+                           'No access rule {}'.format(rule_id))
+        self.acls[rule_id]['permissions'] = rule['permissions']
+        return {'DATA_TYPE': 'result', 'code': 'Updated',
+                'message': 'Access rule updated successfully'}
+
+    def delete_acl(self, rule_id):
+        if self.acls.pop(rule_id, None) is None:
+            raise APIError(404, 'AccessRuleNotFound',
+                           'No access rule {}'.format(rule_id))
+        return {'DATA_TYPE': 'result', 'code': 'Deleted',
+                'message': 'Access rule deleted successfully'}
+
+    def submit(self, document):
+        submission_id = document.get('submission_id')
+        if submission_id in self.submissions:
+            # The same submission again returns the task it made
+            return {'DATA_TYPE': '{}_result'.format(document['DATA_TYPE']),
+                    'task_id': self.submissions[submission_id],
+                    'submission_id': submission_id, 'code': 'Duplicate',
+                    'message': 'A transfer with id {} was already submitted'
+                               .format(submission_id)}
+        task_id = str(uuid.uuid4())
+        if submission_id:
+            self.submissions[submission_id] = task_id
+        items = len(document.get('DATA', ()))
+        if document['DATA_TYPE'] == 'delete':
+            # Deleted at once, whatever the task_duration
+            endpoint = document['endpoint']
+            deleted = self.deleted.setdefault(endpoint, set())
+            for item in document['DATA']:
+                parts = tuple(split_path(item['path']))
+                deleted.add(parts)
+                self.created[endpoint] = set(
+                    other for other in self.created.get(endpoint, ())
+                    if other[:len(parts)] != parts)
+        self.tasks[task_id] = {
+            'DATA_TYPE': 'task', 'task_id': task_id,
+            'type': document['DATA_TYPE'].upper(),
+            'label': document.get('label'),
+            'source_endpoint_id': document.get('source_endpoint',
+                                               document.get('endpoint')),
+            'destination_endpoint_id': document.get('destination_endpoint'),
+            'submitted_at': time.time(), 'files': items,
+            'bytes_transferred': 0}
+        return {'DATA_TYPE': '{}_result'.format(document['DATA_TYPE']),
+                'task_id': task_id,
+                'submission_id': document.get('submission_id'),
+                'code': 'Accepted', 'message': 'The task was accepted',
+                'request_id': task_id[:8]}
+
+    def task(self, task_id):
+        task = self.tasks.get(task_id)
+        if task is None:
+            raise APIError(404, 'TaskNotFound',
+                           'Task {} not found'.format(task_id))
+        task = dict(task)
+        submitted_at = task.pop('submitted_at')
+        done = time.time() >= submitted_at + self.workload.task_duration
+        task.update({'status': 'SUCCEEDED' if done else 'ACTIVE',
+                     'files_transferred': task['files'] if done else 0,
+                     'subtasks_total': task['files'],
+                     'subtasks_succeeded': task['files'] if done else 0})
+        return task
+
+    def task_list(self, params, manager):
+        if not manager:
+            return self.page([self.task(task_id) for task_id in
+                              sorted(self.tasks)], params, 'task_list')
+        # endpoint_manager_task_list: completed transfers from the endpoint
+        # being filtered on, paged with last_key
+        endpoint = params.get('filter_endpoint')
+        start = int(params.get('last_key', 0))
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+        tasks = []
+        for task in self.history[start:start + limit]:
+            task = dict(task, source_endpoint_id=endpoint,
+                        source_endpoint=endpoint,
+                        destination_endpoint=identity_id('destination'))
+            del task['directory'], task['fraction']
+            tasks.append(task)
+        end = start + len(tasks)
+        return {'DATA_TYPE': 'task_list', 'DATA': tasks,
+                'has_next_page': end < len(self.history),
+                'last_key': str(end)}
+
+    def successful_transfers(self, task_id, params):
+        for task in self.history:
+            if task['task_id'] == task_id:
+                break
+        else:
+            raise APIError(404, 'TaskNotFound',
+                           'Task {} not found'.format(task_id))
+        start = int(params.get('marker') or 0)
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+        paths = self.tree.files(task['directory'], task['fraction'])
+        transfers = []
+        for index, path in enumerate(paths):
+            if index >= start + limit:
+                break
+            if index >= start:
+                transfers.append({'DATA_TYPE': 'successful_transfer',
+                                  'source_path': path,
+                                  'destination_path': path})
+        end = start + len(transfers)
+        more = end == start + limit
+        return {'DATA_TYPE': 'successful_transfers', 'DATA': transfers,
+                'marker': start, 'next_marker': end if more else None}
+
+
+class FakeGlobusHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send responses at once rather than waiting on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if body and self.headers.get('Content-Type', '').startswith(
+                'application/json'):
+            body = json.loads(body.decode('utf-8'))
+        status, headers, document = self.server.globus.handle(
+            self.command, self.path, body)
+        document = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(document)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(document)
+
+    do_GET = do_POST = do_PUT = do_DELETE = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGlobusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, globus, port=0):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port),
+                                     FakeGlobusHandler)
+        self.globus = globus
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server_address[1])
+
+
+def start_server(globus, port=0):
+    """Serve globus on a background thread, and return the server."""
+    server = FakeGlobusServer(globus, port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def add_workload_arguments(parser):
+    defaults = Workload()
+    parser.add_argument('--tree-depth', type=int,
+                        default=defaults.tree_depth)
+    parser.add_argument('--tree-fanout', type=int,
+                        default=defaults.tree_fanout)
+    parser.add_argument('--files-per-dir', type=int,
+                        default=defaults.files_per_dir)
+    parser.add_argument('--acl-count', type=int, default=defaults.acl_count)
+    parser.add_argument('--task-count', type=int,
+                        default=defaults.task_count)
+    parser.add_argument('--latency', type=float, default=defaults.latency,
+                        help='Seconds added to every request')
+    parser.add_argument('--throttle-rate', type=float,
+                        default=defaults.throttle_rate,
+                        help='Fraction of requests refused with a 429')
+    parser.add_argument('--task-duration', type=float,
+                        default=defaults.task_duration,
+                        help='Seconds submitted tasks stay ACTIVE')
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+
+
+def workload_from_args(args):
+    return Workload(**{field: getattr(args, field)
+                       for field in Workload._fields})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve a fake Globus Transfer and Auth API.')
+    parser.add_argument('--port', type=int, default=8000)
+    add_workload_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeGlobusServer(FakeGlobus(workload_from_args(args)),
+                              args.port)
+    print('Serving a fake Globus API at {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
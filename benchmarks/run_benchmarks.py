@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the example scripts end to end against a local fake Globus
+service (see fake_globus.py), without touching production endpoints.
+
+Each run starts the script in a fresh process and working directory, with
+the Globus SDK pointed at the fake service and api_metrics.py enabled, and
+records:
+
+  * wall time, including interpreter start up, as a cron job would see it
+  * API calls made, by operation, including retried ones, and the 429s and
+    retries among them
+  * peak resident memory of the process
+
+    ./run_benchmarks.py --repeat 5 --output before.json
+    ./run_benchmarks.py --repeat 5 --baseline before.json
+
+The second command prints how each number changed since the first. The
+size of the synthetic endpoints, latency and 429 rate are set with the
+options listed by --help.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_globus import (FakeGlobus, start_server, add_workload_arguments,
+                         workload_from_args, directory_name, TREE_ROOT)
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SHARED_ENDPOINT = 'a1b2c3d4-0000-4000-8000-000000000001'
+SHARE_GROUP = 'a1b2c3d4-0000-4000-8000-000000000002'
+SHARE_USER = 'a1b2c3d4-0000-4000-8000-000000000003'
+SOURCE_ENDPOINT = 'ddb59aef-6d04-11e5-ba46-22000b92c6ec'
+
+
+def share_manifest(globus):
+    """A share_data manifest sharing every second level directory of the
+    tree in place, with a user and a group."""
+    workload = globus.workload
+    shares = []
+    for first in range(workload.tree_fanout):
+        parent = TREE_ROOT + directory_name(first) + '/'
+        for second in range(workload.tree_fanout):
+            shares.append({'source_path': parent + directory_name(second),
+                           'destination_path': parent,
+                           'user_uuids': [SHARE_USER],
+                           'group_uuids': [SHARE_GROUP]})
+    return {'shares': shares}
+
+
+def acl_desired_state(globus):
+    """An acl_reconcile.py desired state for the fake's access rules:
+    keeping half of them, making a quarter writable, dropping the rest and
+    adding as many new rules as were dropped."""
+    rules = []
+    for number, rule in enumerate(sorted(globus.acls.values(),
+                                         key=lambda rule: int(rule['id']))):
+        if number % 4 == 3:
+            rules.append({'path': rule['path'], 'principal_type': 'group',
+                          'principal': SHARE_GROUP, 'permissions': 'r'})
+            continue
+        rules.append({'path': rule['path'],
+                      'principal_type': rule['principal_type'],
+                      'principal': rule['principal'],
+                      'permissions': 'rw' if number % 4 == 2 else 'r'})
+    return {'endpoint': SHARED_ENDPOINT, 'paths': [TREE_ROOT],
+            'rules': rules}
+
+
+def batch_file(globus):
+    """A batch_transfer.py list of every file in the tree, copied into one
+    directory, with every tenth line repeated."""
+    lines = []
+    for number, path in enumerate(globus.tree.files([])):
+        relative = path[len(TREE_ROOT):]
+        line = '{} {}\n'.format(relative, relative.replace('/', '_'))
+        lines.append(line * (2 if number % 10 == 0 else 1))
+    return ''.join(lines)
+
+
+# Name: what workload.py runs, and any files to write for it (given the
+# FakeGlobus, after reset). Scripts use their own endpoint and path
+# constants, which the fake service serves.
+WORKLOADS = [
+    ('folder_sync', {'module': 'globus_folder_sync'}),
+    ('folder_sync_sharded', {'module': 'globus_folder_sync',
+                             'settings': {'SYNC_SHARDS': 4}}),
+    ('folder_sync_manifest', {'module': 'globus_folder_sync',
+                              'settings': {'USE_MANIFEST': True}}),
+    ('share_data', {'module': 'share_data', 'argv': [
+        '--shared-endpoint', SHARED_ENDPOINT,
+        '--source-path', '/share/godata', '--destination-path', '/',
+        '--user-uuid', SHARE_USER, '--group-uuid', SHARE_GROUP,
+        '--auth', 'client-credentials', '--client-secret', 'benchmark']}),
+    ('share_data_update', {'module': 'share_data', 'argv': [
+        '--shared-endpoint', SHARED_ENDPOINT,
+        '--source-path', '/share/godata', '--destination-path', '/share/',
+        '--user-uuid', SHARE_USER, '--update',
+        '--auth', 'client-credentials', '--client-secret', 'benchmark']}),
+    ('share_data_manifest', {'module': 'share_data', 'argv': [
+        '--shared-endpoint', SHARED_ENDPOINT, '--manifest', 'shares.json',
+        '--delete', '--auth', 'client-credentials',
+        '--client-secret', 'benchmark'],
+        'files': {'shares.json': share_manifest}}),
+    ('acl_reconcile', {'module': 'acl_reconcile', 'argv': [
+        'acls.json', '--yes', '--auth', 'client-credentials',
+        '--client-secret', 'benchmark'],
+        'files': {'acls.json': acl_desired_state}}),
+    ('batch_transfer', {'module': 'batch_transfer', 'argv': [
+        SOURCE_ENDPOINT + ':' + TREE_ROOT, SHARED_ENDPOINT + ':/aggregate/',
+        '--batch', 'files.txt', '--max-items', '1000'],
+        'files': {'files.txt': batch_file}}),
+    ('cleanup_cache', {'module': 'cleanup_cache'}),
+]
+
+SDK_CONFIG = """[environment benchmark]
+auth_service = {url}
+transfer_service = {url}
+"""
+
+
+def peak_rss_mb(rusage):
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    divisor = 1024.0 * 1024 if sys.platform == 'darwin' else 1024.0
+    return rusage.ru_maxrss / divisor
+
+
+def exit_code(status):
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return -os.WTERMSIG(status)
+
+
+def run_once(server, spec):
+    """Run spec in a new process against server, and return its
+    measurements."""
+    server.globus.reset()
+    workdir = tempfile.mkdtemp(prefix='globus-benchmark-')
+    metrics_dir = os.path.join(workdir, 'metrics')
+    os.mkdir(metrics_dir)
+    with open(os.path.join(workdir, '.globus.cfg'), 'w') as f:
+        f.write(SDK_CONFIG.format(url=server.url))
+    spec = dict(spec)
+    for filename, content in spec.pop('files', {}).items():
+        content = content(server.globus)
+        with open(os.path.join(workdir, filename), 'w') as f:
+            if isinstance(content, str):
+                f.write(content)
+            else:
+                json.dump(content, f)
+    env = dict(os.environ, HOME=workdir, GLOBUS_SDK_ENVIRONMENT='benchmark',
+               GLOBUS_METRICS_DIR=metrics_dir)
+    log_filepath = os.path.join(workdir, 'output.log')
+    with open(log_filepath, 'w') as log:
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(BENCHMARK_DIR, 'workload.py'),
+             json.dumps(spec)],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = exit_code(status)
+        wall = time.time() - start
+
+    calls, operations = {}, {}
+    retries = items = connections = 0
+    for filename in os.listdir(metrics_dir):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(metrics_dir, filename)) as f:
+            metrics = json.load(f)
+        for series in metrics['operations']:
+            count = sum(series['calls'].values())
+            operations[series['operation']] = \
+                operations.get(series['operation'], 0) + count
+            for status_code, number in series['calls'].items():
+                calls[status_code] = calls.get(status_code, 0) + number
+            retries += series['retries']
+            items += series['items']
+        connections += metrics['connections']['connections']
+
+    result = {'wall_seconds': wall, 'exit_code': process.returncode,
+              'peak_rss_mb': peak_rss_mb(rusage),
+              'api_calls': sum(calls.values()),
+              'throttled': calls.get('429', 0), 'retries': retries,
+              'items': items, 'connections': connections,
+              'operations': operations}
+    if process.returncode == 0:
+        shutil.rmtree(workdir)
+    else:
+        with open(log_filepath) as f:
+            output = f.read().splitlines()
+        print('  exited with {}, output kept in {}:'.format(
+            process.returncode, workdir), file=sys.stderr)
+        for line in output[-10:]:
+            print('    ' + line, file=sys.stderr)
+    return result
+
+
+def summarize(runs):
+    walls = sorted(run['wall_seconds'] for run in runs)
+    last = runs[-1]
+    return {'runs': len(runs), 'wall_seconds': walls[len(walls) // 2],
+            'min_wall_seconds': walls[0],
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            'api_calls': last['api_calls'], 'throttled': last['throttled'],
+            'retries': last['retries'], 'items': last['items'],
+            'connections': last['connections'],
+            'exit_codes': sorted(set(run['exit_code'] for run in runs)),
+            'operations': last['operations']}
+
+
+def change(value, baseline):
+    if not baseline:
+        return ''
+    return ' ({:+.0%})'.format(float(value) / baseline - 1)
+
+
+def print_report(results, baseline=None):
+    print('{:<22} {:>9} {:>9} {:>6} {:>8} {:>9}'.format(
+        'workload', 'wall s', 'API calls', '429s', 'retries', 'peak MB'))
+    for name, summary in results.items():
+        before = (baseline or {}).get(name, {})
+        print('{:<22} {:>9.3f} {:>9} {:>6} {:>8} {:>9.1f}{}'.format(
+            name, summary['wall_seconds'], summary['api_calls'],
+            summary['throttled'], summary['retries'],
+            summary['peak_rss_mb'],
+            '' if summary['exit_codes'] == [0] else '  exit {}'.format(
+                summary['exit_codes'])))
+        if before:
+            print('{:<22} {:>9} {:>9} {:>6} {:>8} {:>9}'.format(
+                '  vs baseline',
+                change(summary['wall_seconds'], before['wall_seconds']),
+                change(summary['api_calls'], before['api_calls']), '', '',
+                change(summary['peak_rss_mb'], before['peak_rss_mb'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the example scripts against a local fake '
+        'Globus service.')
+    parser.add_argument('--workloads', nargs='+',
+                        choices=[name for name, _ in WORKLOADS],
+                        default=[name for name, _ in WORKLOADS])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each workload, the median wall time '
+                        'is reported')
+    parser.add_argument('--output', help='Save the results as JSON')
+    parser.add_argument('--baseline',
+                        help='Compare against results saved with --output')
+    add_workload_arguments(parser)
+    args = parser.parse_args()
+
+    workload = workload_from_args(args)
+    server = start_server(FakeGlobus(workload))
+    results = {}
+    for name, spec in WORKLOADS:
+        if name not in args.workloads:
+            continue
+        print('Running {} x{}'.format(name, args.repeat), file=sys.stderr)
+        results[name] = summarize([run_once(server, spec)
+                                   for _ in range(args.repeat)])
+    server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'workload': dict(workload._asdict()),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Run one example script inside a benchmark child process. Started by
+run_benchmarks.py as:
+
+    python workload.py '<spec>'
+
+where spec is JSON with the script's module name, module level settings to
+override before its main() runs, and optionally the command line arguments
+to run it with as __main__ instead.
+
+Native App login needs a browser, so the Native App token helpers in
+globus_session.py are replaced with a token the fake service accepts.
+Everything else, including Client Credential grants, goes to the fake
+service through the scripts' own code.
+"""
+
+import json
+import os
+import random
+import runpy
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import globus_session
+from globus_sdk import AccessTokenAuthorizer
+
+BENCHMARK_TOKENS = {
+    'transfer.api.globus.org': {
+        'access_token': 'benchmark-transfer-token',
+        'refresh_token': 'benchmark-refresh-token',
+        'expires_at_seconds': int(time.time()) + 172800,
+    },
+}
+
+
+def native_app_tokens(client_id, app_name, scopes):
+    return BENCHMARK_TOKENS
+
+
+def native_app_authorizer(client_id, app_name, tokens):
+    return AccessTokenAuthorizer(tokens['access_token'])
+
+
+def run(spec):
+    # Keep retry backoff repeatable between runs
+    random.seed(0)
+    globus_session.native_app_tokens = native_app_tokens
+    globus_session.native_app_authorizer = native_app_authorizer
+    if spec.get('argv'):
+        sys.argv = [spec['module'] + '.py'] + spec['argv']
+        runpy.run_path(os.path.join(REPO_DIR, spec['module'] + '.py'),
+                       run_name='__main__')
+        return
+    sys.argv = [spec['module'] + '.py']
+    module = __import__(spec['module'])
+    for name, value in spec.get('settings', {}).items():
+        setattr(module, name, value)
+    module.main()
+
+
+if __name__ == '__main__':
+    run(json.loads(sys.argv[1]))
@@ -5,8 +5,8 @@ Delete data on your shared endpoint if someone has copied it. This script
 will wait for a transfer to complete before deleting data. Ensure you have
 an app setup on developers.globus.org (See below for instructions).
 
-*WARNING*: This script is greedy in how it deletes folders. If someone
-cherry-picks files, it will delete the whole directory!
+A directory is only deleted as a whole if every file in it was transferred.
+If someone cherry-picks files, only those files are deleted.
 
 Confidential App [Client Credentials Grant] on developers.globus.org:
     * "Redirect URLs" -- Set to "https://example.com/oauth_callback/".
@@ -26,14 +26,26 @@ Endpoint 1: http://bit.ly/2rzWx0Z
 
 from __future__ import print_function
 
+import json
+import os
 import sys
+from collections import deque
+from sys import intern
+from concurrent.futures import ThreadPoolExecutor
 import globus_sdk
 from globus_sdk import (TransferClient,
                         AccessTokenAuthorizer)
-from globus_sdk.exc import TransferAPIError
+from globus_sdk.exc import GlobusError, TransferAPIError
 from datetime import datetime
 from datetime import timedelta
-from os.path import commonprefix, dirname
+
+from atomic_file import write_atomic
+from endpoint_lister import list_directory
+from globus_session import (autoactivate_endpoints,
+                            client_credentials_tokens, setup_client)
+from path_trie import PathTrie, split_path
+from submission_queue import (submit_or_enqueue, client_user,
+                              release_command, PRIORITY_BULK)
 
 # Must add the client ID as an Access Manager to the
 # shared endpoint.
@@ -45,19 +57,95 @@ CLIENT_SECRET = 'MWhHZgWo+Z2u2hLB1808dos3qDKw5Q4W3cFhRMTqHYs='
 # Source endpoint. *MUST* be a shared endpoint.
 SOURCE_ENDPOINT_ID = '3886dc9c-3eff-11e7-bd15-22000b9a448b'
 
+# Where cleanup progress is kept between runs: the completion time up to which
+# all tasks have been handled (the high-water mark), the IDs of tasks
+# handled near that mark, and the tasks and access rule deletions to try
+# again.
+STATE_FILE = 'cleanup-state.json'
+# How far back to look for completed transfers on the very first run
+INITIAL_LOOKBACK = timedelta(hours=24)
+# Each run re-queries this far behind the high-water mark, in case the service
+# records a completion slightly late. Tasks already handled are skipped.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# Runs a task whose listing, deletion or access rule removal keeps failing is
+# tried in before it is given up on. Failed tasks are retried by ID, so they
+# never hold the high-water mark back.
+MAX_TASK_ATTEMPTS = 5
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Number of successful transfer listings fetched concurrently. Listings are
+# still handed to the deletion stage in task order.
+MAX_CONCURRENT_LISTINGS = 8
+
+# Deletions from all tasks in a run are merged and submitted in batches of at
+# most this many items, one delete task per batch.
+DELETE_BATCH_SIZE = 10000
+# Transfer limits task labels to 128 characters
+MAX_LABEL_LENGTH = 128
+
+# Queue delete tasks in the local submission queue (see submission_queue.py)
+# instead of submitting them straight away, so cleanups wait their turn
+# behind other scripts when the service is busy.
+USE_SUBMISSION_QUEUE = False
+
 
 def do_client_authentication(client_id, client_secret):
     """
-    Does a client authentication and returns a globus transfer token.
+    Does a client authentication and returns a globus transfer token. The
+    token is reused from earlier runs until it is close to expiry.
     """
-    client = globus_sdk.ConfidentialAppAuthClient(
-        client_id,
-        client_secret,
-    )
-    token_response = client.oauth2_client_credentials_tokens()
-    return (token_response.by_resource_server
-            ['transfer.api.globus.org']['access_token']
-            )
+    tokens = client_credentials_tokens(client_id, client_secret)
+    return tokens['transfer.api.globus.org']['access_token']
+
+
+def load_state(filepath):
+    """Load the cleanup high-water mark, the handled task IDs, and the
+    tasks and access rule deletions to retry."""
+    if not os.path.exists(filepath):
+        return {'completion_time': None, 'handled': {}, 'retry': {},
+                'acl_retry': {}}
+    with open(filepath, 'r') as f:
+        state = json.load(f)
+    state.setdefault('completion_time', None)
+    state.setdefault('handled', {})
+    state.setdefault('retry', {})
+    state.setdefault('acl_retry', {})
+    return state
+
+
+def save_state(filepath, state):
+    """Save cleanup progress. The file is replaced atomically, so a run killed
+    mid-write leaves the previous state intact."""
+    write_atomic(filepath, json.dumps(state))
+
+
+def prune_handled(state, watermark):
+    """Forget handled tasks that completed before the overlap window of the
+    new high-water mark; later queries will never return them again."""
+    horizon = (watermark - WATERMARK_OVERLAP).strftime(TIME_FORMAT)
+    state['handled'] = {
+        task_id: completion_time
+        for task_id, completion_time in state['handled'].items()
+        if completion_time[:len(horizon)] >= horizon
+    }
+
+
+def iter_completed_tasks(tc, completion_range):
+    """Yield every successful task in completion_range, one page at a time.
+    The service paginates with a last_key marker, so only the pages actually
+    consumed are fetched."""
+    task_fields = "task_id,source_endpoint,destination_endpoint," \
+                  "source_host_path,owner_string,source_endpoint_id,type," \
+                  "completion_time"
+    tasks = tc.endpoint_manager_task_list(
+                num_results=None,
+                filter_status="SUCCEEDED",
+                filter_endpoint=SOURCE_ENDPOINT_ID,
+                filter_completion_time=completion_range,
+                fields=task_fields)
+    for task in tasks:
+        yield task.data
 
 
 def task_delete_conditions_satisfied(task):
@@ -67,119 +155,492 @@ def task_delete_conditions_satisfied(task):
         task["source_endpoint_id"] == SOURCE_ENDPOINT_ID
 
 
-def select_dir_to_delete(transfer_client, task):
-    """Find the common directory under which all the files live. If one exists,
-    it will be deleted recursively, even if not all files under it were
-    transferred. If there is no common directory, each file that was
-    transferred will be deleted"""
+class TransferredDirectory(object):
+    __slots__ = ('children', 'file_count', 'digest')
+
+    def __init__(self):
+        self.children = {}
+        self.file_count = 0
+        self.digest = 0
+
+
+def names_digest(names):
+    """An order independent digest of a set of file names."""
+    digest = 0
+    for name in names:
+        digest = (digest + hash(name)) & 0xFFFFFFFFFFFFFFFF
+    return digest
+
+
+class TransferredTree(object):
+    """A compact summary of the files a task transferred. Only directories
+    are stored, each with the number of files transferred from it and a
+    digest of their names, so memory grows with the number of directories
+    touched rather than the number of files, and directory names are
+    interned and shared between paths."""
+
+    def __init__(self):
+        self.root = TransferredDirectory()
+        self.file_count = 0
+        self.directory_count = 0
+
+    def add(self, path):
+        parts = split_path(path)
+        node = self.root
+        for part in parts[:-1]:
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[intern(part)] = TransferredDirectory()
+                self.directory_count += 1
+            node = child
+        node.file_count += 1
+        node.digest = (node.digest + names_digest(parts[-1:])) & \
+            0xFFFFFFFFFFFFFFFF
+        self.file_count += 1
+
+
+def iter_successful_transfers(transfer_client, task):
+    """Yield the source path of every file successfully transferred by the
+    task, one page at a time, following the listing's pagination markers to
+    the end."""
     successful_file_transfers = \
         transfer_client.endpoint_manager_task_successful_transfers(
-            task["task_id"]
+            task["task_id"], num_results=None
         )
+    for globr in successful_file_transfers:
+        yield globr["source_path"]
+
+
+def summarize_successful_transfers(transfer_client, task):
+    """Fold the task's successful transfers into a TransferredTree as they
+    stream in, without keeping the individual paths."""
+    tree = TransferredTree()
+    for path in iter_successful_transfers(transfer_client, task):
+        tree.add(path)
+    return tree
+
+
+def iter_task_summaries(transfer_client, tasks,
+                        max_workers=MAX_CONCURRENT_LISTINGS):
+    """Fetch and summarize the successful transfer listings of tasks on a
+    bounded pool of worker threads. Yields (task, tree, error) tuples in the
+    same order as tasks, each as soon as it is available, so callers can
+    start deleting while later listings are still being fetched. A failed
+    listing is reported through error and does not affect the other
+    tasks."""
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for task in tasks:
+            pending.append((task, executor.submit(
+                summarize_successful_transfers, transfer_client, task)))
+            # Don't read ahead further than the pool can work on
+            if len(pending) > max_workers:
+                yield _listing_result(*pending.popleft())
+        while pending:
+            yield _listing_result(*pending.popleft())
+
+
+def _listing_result(task, future):
+    try:
+        return task, future.result(), None
+    except GlobusError as error:
+        return task, None, error
+
+
+class ListingCache(object):
+    """Summaries of directory listings on the source endpoint, each fetched
+    at most once per run and shared by every task. Only the names of
+    subdirectories are kept; files are reduced to a count and a names_digest,
+    so they can be compared against a TransferredDirectory."""
+
+    def __init__(self, tc):
+        self.tc = tc
+        self.listings = {}
+
+    def summary(self, path):
+        """Return a dict with the 'file_count', 'digest' and 'dirs' of path,
+        or None if the directory no longer exists. Any other listing error is
+        raised, and not cached, so the task is retried rather than
+        skipped."""
+        path = '/' + ''.join(part + '/' for part in split_path(path))
+        if path not in self.listings:
+            dirs, files = set(), []
+            try:
+                for entry in list_directory(self.tc, SOURCE_ENDPOINT_ID,
+                                            path):
+                    if entry["type"] == 'dir':
+                        dirs.add(entry["name"])
+                    else:
+                        files.append(entry["name"])
+            except TransferAPIError as tapie:
+                if tapie.code != 'ClientError.NotFound':
+                    raise
+                print('Directory {} no longer present on source '
+                      'endpoint, there is nothing to delete\n'.format(path))
+                self.listings[path] = None
+                return None
+            self.listings[path] = {'file_count': len(files),
+                                   'digest': names_digest(files),
+                                   'dirs': dirs}
+        return self.listings[path]
+
+
+def select_dir_to_delete(task, tree, listing_cache):
+    """Find the smallest set of directories whose entire contents were
+    transferred, so they can be deleted recursively, plus the directories
+    holding transferred files that aren't covered by any of those; their
+    transferred files are deleted one by one. The root of the endpoint is
+    never deleted as a whole.
+
+    Directories that no longer exist are skipped. Any other error listing
+    them is raised, so the task can be retried."""
     print("Transfer Task({}): {} -> {}\n was submitted by {}\n".
           format(task["task_id"], task["source_endpoint"],
                  task["destination_endpoint"],
                  task["owner_string"]))
-
-    files_list = [
-        globr["source_path"] for globr in successful_file_transfers]
-    print("files list is ", files_list)
-
-    common_dir = dirname(commonprefix(files_list))
-    return files_list, common_dir
-
-
-def delete_dir_and_acls(tc, task, files_list, common_dir):
-    """Given a task, delete all files and ACLs associated with it. If a
-    common directory exists between files, recursively delete that.
-    Otherwise, delete each file individually. (See select_dir_to_delete above)
-
-    Aborts deletion if an exception is thrown, either due to insufficient
-    read access or if the files don't exist anymore."""
-    try:
-        tc.operation_ls(SOURCE_ENDPOINT_ID, path=common_dir)
-    except globus_sdk.exc.TransferAPIError as tapie:
-        if tapie.code == 'ClientError.NotFound':
-            print('Directory {} no longer present on source endpoint, '
-                  'there is nothing to delete\n'.format(common_dir))
-            return
-        else:
-            print("Could not delete directory '{}': {}".format(
-                common_dir, tapie.message)
-            )
-            return
-    if files_list:
-        if common_dir:
-            ddata = globus_sdk.DeleteData(
-                tc, SOURCE_ENDPOINT_ID,
-                label="deletion of {}".format(task["task_id"]),
-                submission_id=None, recursive=True, deadline=None)
-            ddata.add_item(common_dir)
-        else:
-            ddata = globus_sdk.DeleteData(
-                tc, SOURCE_ENDPOINT_ID,
-                label="deletion of {}".format(task["task_id"]),
-                submission_id=None, recursive=False, deadline=None)
-            # If any of the paths are directories, recursive must be set True
-            # on the top level DeleteData
-            for path in files_list:
-                ddata.add_item(path)
-        tc.submit_delete(ddata)
-        print("Job to delete data has been submitted")
-
-        try:
-            acl_list = tc.endpoint_manager_acl_list(SOURCE_ENDPOINT_ID)
-        except:
-            print("Couldn't get acl list for endpoint ", SOURCE_ENDPOINT_ID)
+    print("{} files transferred from {} directories".format(
+        tree.file_count, tree.directory_count))
+
+    directories, partial_directories = [], []
+
+    def fully_transferred(node, parts):
+        """Collect the cover beneath node, and return True if everything in
+        the directory node was transferred, in which case the caller covers
+        it instead."""
+        listing = listing_cache.summary('/'.join(parts))
+        if listing is None:
+            return False
+        complete = {}
+        for name, child in sorted(node.children.items()):
+            complete[name] = name in listing['dirs'] and \
+                fully_transferred(child, parts + [name])
+        if parts and all(complete.values()) and \
+                set(complete) == listing['dirs'] and \
+                node.file_count == listing['file_count'] and \
+                node.digest == listing['digest']:
+            return True
+        for name in sorted(complete):
+            if complete[name]:
+                directories.append('/' + '/'.join(parts + [name]))
+        if node.file_count:
+            partial_directories.append('/' + '/'.join(parts))
+        return False
+
+    fully_transferred(tree.root, [])
+    return directories, partial_directories
+
+
+class AclIndex(object):
+    """The endpoint's access rules indexed by path, so the rules at or below a
+    deleted directory can be found without another list call. The rule list
+    is only fetched the first time it's needed, then shared by the rest of
+    the run. If fetching it fails, TransferAPIError is raised and the next
+    call tries again."""
+
+    def __init__(self, tc):
+        self.tc = tc
+        self.rules = None
+
+    def rules_at_or_below(self, path):
+        if self.rules is None:
+            rules = PathTrie()
+            for rule in self.tc.endpoint_manager_acl_list(
+                    SOURCE_ENDPOINT_ID):
+                rules.add(rule["path"], rule)
+            self.rules = rules
+        return self.rules.values_at_or_below(path)
+
+    def remove(self, rule):
+        self.rules.remove(rule["path"], rule)
+
+
+class DeletionPlanner(object):
+    """Collect deletion targets from every task in a run. A path already
+    covered by a recursive delete of one of its ancestors is not added again,
+    and adding a recursive delete absorbs any targets beneath it, so the
+    number of items submitted grows with the number of distinct directories
+    rather than the number of tasks. Directories already submitted for
+    recursive deletion in this run are remembered, so later tasks don't
+    delete their contents again."""
+
+    def __init__(self):
+        self.targets = PathTrie()
+        self.submitted = PathTrie()
+
+    def __len__(self):
+        return len(self.targets)
+
+    def clear(self):
+        self.targets = PathTrie()
+
+    def mark_submitted(self, batch):
+        if batch['recursive']:
+            for target in batch['targets']:
+                self.submitted.add(target['path'], target)
+
+    def add(self, task_id, path, recursive):
+        if self.submitted.values_at_or_above(path):
             return
-
-        acldict = {i["path"]: i["id"] for i in acl_list}
-
-        aclid = ""
-
+        for target in self.targets.values_at_or_above(path):
+            covered = target['recursive'] or \
+                split_path(target['path']) == split_path(path)
+            if covered and (target['recursive'] or not recursive):
+                target['task_ids'].add(task_id)
+                return
+        task_ids = set([task_id])
+        if recursive:
+            for target in self.targets.values_at_or_below(path):
+                self.targets.remove(target['path'], target)
+                task_ids.update(target['task_ids'])
+        self.targets.add(path, {'path': path, 'recursive': recursive,
+                                'task_ids': task_ids})
+
+    def batches(self, batch_size=DELETE_BATCH_SIZE):
+        """Split the planned targets into batches of at most batch_size
+        items, ordered by path. Recursive and non-recursive targets are never
+        mixed in the same batch."""
+        targets = self.targets.values_at_or_below('/')
+        batches = []
+        for recursive in (True, False):
+            selected = [t for t in targets if t['recursive'] == recursive]
+            for start in range(0, len(selected), batch_size):
+                chunk = selected[start:start + batch_size]
+                task_ids = set()
+                for target in chunk:
+                    task_ids.update(target['task_ids'])
+                batches.append({'recursive': recursive, 'targets': chunk,
+                                'task_ids': task_ids})
+        return batches
+
+
+def batch_label(task_ids):
+    """Label a delete task with as many of its originating task IDs as fit in
+    a Transfer label."""
+    task_ids = sorted(task_ids)
+    for shown in range(len(task_ids), 0, -1):
+        label = "deletion of " + ", ".join(task_ids[:shown])
+        if shown < len(task_ids):
+            label += " and {} more".format(len(task_ids) - shown)
+        if len(label) <= MAX_LABEL_LENGTH:
+            return label
+    return "deletion of {} tasks".format(len(task_ids))
+
+
+def plan_deletion(tc, planner, task, directories, partial_directories,
+                  flush):
+    """Given a task, add the directories to recursively delete and the
+    individual files to delete to the deletion plan. (See
+    select_dir_to_delete above) The files are found by streaming the task's
+    successful transfers a second time, and flush is called whenever the
+    plan holds a full batch, so memory stays flat however many files are
+    involved. Returns the number of files planned."""
+    for path in directories:
+        planner.add(task["task_id"], path, recursive=True)
+    if not partial_directories:
+        return 0
+    partial_directories = set(partial_directories)
+    planned = 0
+    for path in iter_successful_transfers(tc, task):
+        parent = '/' + '/'.join(split_path(path)[:-1])
+        if parent in partial_directories:
+            planner.add(task["task_id"], path, recursive=False)
+            planned += 1
+            if len(planner) >= DELETE_BATCH_SIZE:
+                flush()
+    return planned
+
+
+def delete_acl_rules(tc, acl_index, paths):
+    """Delete the access rules on, or anywhere beneath, each of paths,
+    dropping them from acl_index. Returns the paths whose rules could not
+    all be deleted."""
+    failed = []
+    for index, path in enumerate(paths):
         try:
-            aclid = acldict[common_dir + "/"]
-        except:
-            print("No acl found for directory ",
-                  common_dir + "/")
-            return
-
-        if aclid:
+            rules = acl_index.rules_at_or_below(path)
+        except TransferAPIError as tapie:
+            print("Couldn't get acl list for endpoint {}: {}".format(
+                SOURCE_ENDPOINT_ID, tapie.message))
+            return failed + list(paths[index:])
+        if not rules:
+            print("No acl found for directory ", path.rstrip('/') + "/")
+            continue
+
+        for rule in rules:
             try:
                 tc.delete_endpoint_acl_rule(
-                    SOURCE_ENDPOINT_ID, aclid)
-            except:
-                print("Couldn't delete acl rule ", aclid)
-                return
-            print("Acl deleted for directory ",
-                  common_dir + "/")
+                    SOURCE_ENDPOINT_ID, rule["id"])
+            except TransferAPIError as tapie:
+                print("Couldn't delete acl rule {}: {}".format(
+                    rule["id"], tapie.message))
+                if path not in failed:
+                    failed.append(path)
+                continue
+            acl_index.remove(rule)
+            print("Acl deleted for directory ", rule["path"])
+    return failed
+
+
+def submit_deletion_batch(tc, batch, acl_index):
+    """Submit one batch of planned deletions as a single delete task, then
+    delete the access rules on, or anywhere beneath, each directory deleted
+    recursively. Items that no longer exist are skipped by the service.
+    Returns the directories whose access rules could not all be deleted."""
+    ddata = globus_sdk.DeleteData(
+        tc, SOURCE_ENDPOINT_ID,
+        label=batch_label(batch['task_ids']),
+        submission_id=None, recursive=batch['recursive'], deadline=None,
+        ignore_missing=True)
+    for target in batch['targets']:
+        ddata.add_item(target['path'])
+    if USE_SUBMISSION_QUEUE:
+        task_id = submit_or_enqueue(tc, client_user(CLIENT_ID), ddata,
+                                    priority=PRIORITY_BULK)
+    else:
+        task_id = tc.submit_delete(ddata)["task_id"]
+    if task_id is None:
+        print("Deletion of {} items has been queued for tasks {}, it is "
+              "submitted by the next run or by \"{}\"".format(
+                  len(batch['targets']), ", ".join(sorted(batch['task_ids'])),
+                  release_command(client_user(CLIENT_ID))))
+    else:
+        print("Job {} to delete {} items has been submitted for tasks {}"
+              .format(task_id, len(batch['targets']),
+                      ", ".join(sorted(batch['task_ids']))))
+
+    if not batch['recursive']:
+        return []
+    return delete_acl_rules(tc, acl_index,
+                            [target['path'] for target in batch['targets']])
+
+
+def submit_planned_deletions(tc, planner, acl_index, acl_retry):
+    """Submit everything in the deletion plan and empty it. Returns the IDs
+    of the tasks with paths in a batch that could not be submitted, so the
+    next run tries again. Directories whose access rules could not all be
+    deleted are added to acl_retry, as their data is already gone."""
+    failed_task_ids = set()
+    for batch in planner.batches():
+        try:
+            for path in submit_deletion_batch(tc, batch, acl_index):
+                acl_retry.setdefault(path, 0)
+        except TransferAPIError as tapie:
+            if tapie.code == 'PermissionDenied':
+                raise
+            print("Could not submit deletion for tasks {}: {}\n".format(
+                ", ".join(sorted(batch['task_ids'])), tapie.message))
+            failed_task_ids.update(batch['task_ids'])
+            continue
+        planner.mark_submitted(batch)
+    planner.clear()
+    return failed_task_ids
+
+
+def retry_acl_deletions(tc, acl_index, acl_retry):
+    """Delete the access rules left behind by earlier runs, on the
+    directories in acl_retry ({path: failed attempts}), giving up on a
+    directory after MAX_TASK_ATTEMPTS failed runs."""
+    failed = delete_acl_rules(tc, acl_index, sorted(acl_retry))
+    for path in sorted(acl_retry):
+        if path not in failed:
+            del acl_retry[path]
+            continue
+        acl_retry[path] += 1
+        if acl_retry[path] >= MAX_TASK_ATTEMPTS:
+            print("Giving up on the access rules beneath {} after {} failed "
+                  "attempts, they may need removing by hand".format(
+                      path, acl_retry[path]))
+            del acl_retry[path]
 
 
 def main():
 
-    current_time = datetime.utcnow().replace(microsecond=0).isoformat()
-    last_cleanup_time = datetime.utcnow().replace(microsecond=0)\
-        - timedelta(hours=24)
-    last_cleanup = last_cleanup_time.isoformat()
-    completion_range = last_cleanup+","+current_time
+    now = datetime.utcnow().replace(microsecond=0)
+    state = load_state(STATE_FILE)
+    if state['completion_time']:
+        watermark = datetime.strptime(state['completion_time'], TIME_FORMAT)
+        range_start = watermark - WATERMARK_OVERLAP
+    else:
+        range_start = now - INITIAL_LOOKBACK
+    completion_range = range_start.isoformat() + "," + now.isoformat()
     print("Cleaning up source endpoint {} \nfor outbound transfers completed "
           "in range {}\n ".format(SOURCE_ENDPOINT_ID, completion_range))
 
     transfer_token = do_client_authentication(CLIENT_ID, CLIENT_SECRET)
 
     authorizer = AccessTokenAuthorizer(access_token=transfer_token)
-    tc = TransferClient(authorizer=authorizer)
+    tc = setup_client(TransferClient(authorizer=authorizer))
+
+    # skipped while the cached activation is still good
+    autoactivate_endpoints(tc, [SOURCE_ENDPOINT_ID], client_user(CLIENT_ID))
+    counts = {'found': 0, 'skipped': 0}
+    failed = []
+
+    def tasks_to_clean():
+        # Tasks that failed in earlier runs first, by ID
+        for retry in list(state['retry'].values()):
+            yield retry['task']
+        for task in iter_completed_tasks(tc, completion_range):
+            counts['found'] += 1
+            if task["task_id"] in state['handled'] or \
+                    task["task_id"] in state['retry']:
+                counts['skipped'] += 1
+            elif task_delete_conditions_satisfied(task):
+                yield task
+            else:
+                state['handled'][task["task_id"]] = task["completion_time"]
+
+    planner = DeletionPlanner()
+    listing_cache = ListingCache(tc)
+    acl_index = AclIndex(tc)
+    # Tasks whose deletions are fully planned, handled once they're submitted
+    planned = []
+    failed_task_ids = set()
+
+    def flush():
+        failed_task_ids.update(submit_planned_deletions(
+            tc, planner, acl_index, state['acl_retry']))
+        for task in planned:
+            if task["task_id"] in failed_task_ids:
+                retry = state['retry'].setdefault(
+                    task["task_id"], {'task': task, 'attempts': 0})
+                retry['attempts'] += 1
+                if retry['attempts'] < MAX_TASK_ATTEMPTS:
+                    failed.append(task)
+                    continue
+                print("Giving up on task {} after {} failed attempts, its "
+                      "data and access rules may need removing by hand"
+                      .format(task["task_id"], retry['attempts']))
+            # Record progress as we go, so an interrupted or overlapping
+            # run does not delete this task's data twice
+            state['retry'].pop(task["task_id"], None)
+            state['handled'][task["task_id"]] = task["completion_time"]
+        del planned[:]
+        save_state(STATE_FILE, state)
 
-    # print out a directory listing from an endpoint
-    tc.endpoint_autoactivate(SOURCE_ENDPOINT_ID)
     try:
-        task_fields = "task_id,source_endpoint,destination_endpoint," \
-                      "source_host_path,owner_string,source_endpoint_id,type"
-        tasks = tc.endpoint_manager_task_list(
-                    filter_status="SUCCEEDED",
-                    filter_endpoint=SOURCE_ENDPOINT_ID,
-                    filter_completion_time=completion_range,
-                    fields=task_fields)
+        if state['acl_retry']:
+            retry_acl_deletions(tc, acl_index, state['acl_retry'])
+        summaries = iter_task_summaries(tc, tasks_to_clean())
+        for task, tree, error in summaries:
+            if error is None:
+                try:
+                    directories, partial_directories = select_dir_to_delete(
+                        task, tree, listing_cache)
+                    files = plan_deletion(tc, planner, task, directories,
+                                          partial_directories, flush)
+                    print("{} directories and {} files to delete\n".format(
+                        len(directories), files))
+                except GlobusError as err:
+                    error = err
+            if error is not None:
+                print("Could not list files transferred by task {}: {}\n"
+                      .format(task["task_id"], error))
+                failed_task_ids.add(task["task_id"])
+            planned.append(task)
+            if len(planner) >= DELETE_BATCH_SIZE:
+                flush()
+        flush()
     except TransferAPIError as tapie:
         if tapie.code == 'PermissionDenied':
             print(
@@ -194,22 +655,28 @@ def main():
         # Nothing weird *should* happen here, but if so re-raise so the user
         # can deal with it.
         raise
-    tasklist = tasks.data
-    if not tasklist:
-        print("No transfers from {} found in the last 24 hours, "
+
+    found, skipped = counts['found'], counts['skipped']
+    if not found:
+        print("No transfers from {} found since the last cleanup, "
               "nothing to clean up".format(SOURCE_ENDPOINT_ID))
     else:
-        print("{} total transfers found from {} in the last 24 hours, "
-              "some may not be of type TRANSFER".format(len(tasklist),
-                                                        SOURCE_ENDPOINT_ID))
-    delete_tasks = [task.data
-                    for task in tasklist
-                    if task_delete_conditions_satisfied(task)
-                    ]
-    for task in delete_tasks:
-        files_list, common_dir = select_dir_to_delete(tc, task)
-
-        delete_dir_and_acls(tc, task, files_list, common_dir)
+        print("{} total transfers found from {} since the last cleanup, "
+              "{} already handled by a previous run".format(
+                  found, SOURCE_ENDPOINT_ID, skipped))
+
+    # Every task up to now has been handled or saved for a retry, advance
+    # the high-water mark
+    if failed:
+        print("{} transfers could not be cleaned up and will be retried on "
+              "the next run".format(len(failed)))
+    if state['acl_retry']:
+        print("Access rules beneath {} deleted directories could not be "
+              "deleted and will be retried on the next run".format(
+                  len(state['acl_retry'])))
+    state['completion_time'] = now.strftime(TIME_FORMAT)
+    prune_handled(state, now)
+    save_state(STATE_FILE, state)
 
 
 if __name__ == '__main__':
@@ -15,7 +15,8 @@
 # 
 # Default values are below in CAPS for
 # SOURCE_ENDPOINT, DESTINATION_ENDPOINT, SOURCE_PATH,
-# DESTINATION_PATH, LAST_TRANSFER_ID_FILE, and SYNCTYPE
+# DESTINATION_PATH, TASK_STORE_FILE, SYNC_PAIR_NAME, LAST_TRANSFER_ID_FILE,
+# and SYNCTYPE
 # 
 # Changes these to make this script suit your needs.
 #
@@ -35,9 +36,20 @@ SOURCE_PATH='/share/godata/'
 # The directory will be created if it doesn't exist
 DESTINATION_PATH='/~/sync-demo/'
 
-# Where the ID of the previous transfer (if exists) is stored
+# Where the history of transfers is stored, see task_store.py
+TASK_STORE_FILE='transfer-tasks.db'
+# The name the transfers of this sync are recorded under
+SYNC_PAIR_NAME='cli-sync'
+# Where earlier versions of this script kept the last transfer ID. It is
+# imported into the task store once, so a transfer it names is still waited
+# for.
 LAST_TRANSFER_ID_FILE='last-transfer-id.txt'
 
+# Run task_store.py with the store above
+function task_store () {
+    python "$(dirname "$0")/task_store.py" --store "$TASK_STORE_FILE" "$@"
+}
+
 # Sync options:
 #   exists   Copy files that do not exist at the destination.
 #   size     Copy files if the size of the destination does not match the size of the source.
@@ -92,10 +104,17 @@ function check_last_rc () {
 
 echo "Checking for a previous transfer"
 
-if [ -e "$LAST_TRANSFER_ID_FILE" ]
+last_transfer_id=$(task_store latest "$SYNC_PAIR_NAME" | cut -d' ' -f1)
+if [ -z "$last_transfer_id" ] && [ -s "$LAST_TRANSFER_ID_FILE" ]
 then
     last_transfer_id=$(cat "$LAST_TRANSFER_ID_FILE")
-    last_transfer_status=$(globus task show --format unix --jmespath 'status' $last_transfer_id)
+    echo "Importing transfer $last_transfer_id from $LAST_TRANSFER_ID_FILE"
+    task_store record "$SYNC_PAIR_NAME" "$last_transfer_id"
+fi
+if [ -n "$last_transfer_id" ]
+then
+    last_transfer_status=$(globus task show --format unix --jmespath 'status' "$last_transfer_id")
+    task_store record "$SYNC_PAIR_NAME" "$last_transfer_id" "$last_transfer_status"
     if [ "$last_transfer_status" != "SUCCEEDED" ] && [ "$last_transfer_status" != "FAILED" ]
        then
            abort_message="Last transfer $last_transfer_id status is $last_transfer_status, aborting"
@@ -126,5 +145,5 @@ link="Link:\nhttps://app.globus.org/activity/$globus_output/overview\n"
 check_last_rc "Globus transfer submission failed" "$success_msg\n$link"
 
 # Save ID of new sync transfer
-echo "Saving sync transfer ID to $LAST_TRANSFER_ID_FILE"
-echo $globus_output > "$LAST_TRANSFER_ID_FILE"
+echo "Saving sync transfer ID to $TASK_STORE_FILE"
+task_store record "$SYNC_PAIR_NAME" "$globus_output"
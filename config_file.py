@@ -0,0 +1,28 @@
+"""
+Read the JSON or YAML files that list sync pairs (sync_runner.py), shares
+(share_data.py --manifest) and access rules (acl_reconcile.py).
+
+Files ending in .yml or .yaml are read as YAML, which needs PyYAML; anything
+else is read as JSON, which needs nothing beyond the standard library.
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+
+
+def load_config(filepath):
+    """Return the document in filepath. Exits with a message if it is YAML
+    and PyYAML isn't installed."""
+    with open(filepath, 'r') as f:
+        if filepath.endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except ImportError:
+                print('Reading {} requires PyYAML, install it with '
+                      '"pip install pyyaml"'.format(filepath),
+                      file=sys.stderr)
+                sys.exit(1)
+            return yaml.safe_load(f)
+        return json.load(f)
@@ -0,0 +1,110 @@
+"""
+List directory trees on a Globus endpoint with several operation_ls calls in
+flight at once.
+
+walk() crawls a tree on a bounded pool of worker threads and yields entries
+as they arrive. Workers stop listing when the caller falls behind by more
+than max_pending entries, so a tree with millions of entries is listed in
+parallel without ever being held in memory as a whole. Large directories
+are paged through with offset/limit, see list_directory().
+"""
+
+import threading
+
+from six.moves import queue
+
+from globus_sdk.exc import TransferAPIError
+
+# Entries requested per operation_ls call
+LS_PAGE_SIZE = 100000
+# Concurrent operation_ls calls
+MAX_WORKERS = 8
+# Entries listed ahead of the caller before workers wait for it to catch up
+MAX_PENDING = 10000
+
+_DONE = object()
+
+
+def list_directory(transfer_client, endpoint, path, page_size=LS_PAGE_SIZE):
+    """Yield every entry of one directory, fetching it a page at a time."""
+    offset = 0
+    while True:
+        listing = transfer_client.operation_ls(endpoint, path=path,
+                                               offset=offset,
+                                               limit=page_size)
+        entries = listing['DATA']
+        for entry in entries:
+            yield entry
+        if len(entries) < page_size:
+            return
+        offset += len(entries)
+
+
+def walk(transfer_client, endpoint, path, max_workers=MAX_WORKERS,
+         max_pending=MAX_PENDING, page_size=LS_PAGE_SIZE):
+    """Yield (relative path, entry) for everything beneath path, directories
+    included. Relative paths use "/" separators and have no leading or
+    trailing slash. Entries come in no particular order.
+
+    Subdirectories removed while the walk is running are skipped. Any other
+    error, or path itself not existing, is raised from the generator."""
+    base = path.rstrip('/') + '/'
+    directories = queue.Queue()
+    results = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+    lock = threading.Lock()
+    # Directories queued or being listed; the walk is over when none remain
+    outstanding = [1]
+
+    def put(item):
+        # Block while the caller is behind, unless it has gone away
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def finished_directory():
+        with lock:
+            outstanding[0] -= 1
+            if outstanding[0] == 0:
+                put(_DONE)
+
+    def worker():
+        while not stopped.is_set():
+            try:
+                relative = directories.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                for entry in list_directory(transfer_client, endpoint,
+                                            base + relative, page_size):
+                    name = relative + entry['name']
+                    if entry['type'] == 'dir':
+                        with lock:
+                            outstanding[0] += 1
+                        directories.put(name + '/')
+                    put((name, entry))
+            except TransferAPIError as tapie:
+                if relative == '' or tapie.code != 'ClientError.NotFound':
+                    put(tapie)
+            except Exception as error:
+                put(error)
+            finished_directory()
+
+    directories.put('')
+    threads = [threading.Thread(target=worker) for _ in range(max_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
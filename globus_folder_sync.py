@@ -11,18 +11,21 @@ globus.org/app/transfer?destination_id=ddb59af0-6d04-11e5-ba46-22000b92c6ec
 Authorization only needs to happen once, afterwards tokens are saved to disk
 (MUST BE STORED IN A SECURE LOCATION). Store data is already checked for
 previous transfers, so if this script is run twice in quick succession,
-the second run won't queue a duplicate transfer."""
+the second run won't queue a duplicate transfer.
 
+While the previous transfer is running, the time it is next worth checking
+on is saved too. Runs before then exit straight away, without importing the
+Globus SDK or loading tokens, so the script can be scheduled every minute
+cheaply. The SDK and other heavy modules are imported only by the functions
+that need them."""
+
+import heapq
 import json
 import sys
 import os
-import six
-
-from globus_sdk import (NativeAppAuthClient, TransferClient,
-                        RefreshTokenAuthorizer, TransferData)
-from globus_sdk.exc import GlobusAPIError, TransferAPIError
+import time
 
-from fair_research_login import NativeClient
+from task_store import TaskStore
 
 # Globus Tutorial Endpoint 1
 SOURCE_ENDPOINT = 'ddb59aef-6d04-11e5-ba46-22000b92c6ec'
@@ -44,6 +47,12 @@ TRANSFER_LABEL = 'Folder Sync Example'
 # For more information:
 # https://docs.globus.org/api/auth/developer-guide/#register-app
 CLIENT_ID = '079bdf4e-9666-4816-ac01-7eab9dc82b93'
+# History of the tasks submitted by this script, see task_store.py
+TASK_STORE_FILE = 'transfer-tasks.db'
+# The tasks of this sync are recorded under this name in TASK_STORE_FILE
+SYNC_PAIR_NAME = 'folder-sync'
+# Where earlier versions of this script saved the last task. It is imported
+# into TASK_STORE_FILE once if found.
 DATA_FILE = 'transfer-data.json'
 REDIRECT_URI = 'https://auth.globus.org/v2/web/auth-code'
 SCOPES = ('openid email profile '
@@ -53,12 +62,42 @@ APP_NAME = 'Folder Sync Example App'
 
 # ONLY run new tasks if there was a previous task and it exited with one of the
 # following statuses. This is ignored if there was no previous task.
-# The previous task is queried from the DATA_FILE
+# The previous task is queried from the TASK_STORE_FILE
 PREVIOUS_TASK_RUN_CASES = ['SUCCEEDED', 'FAILED']
 
+# While the previous transfer is running, wait at least this long before
+# checking on it again, doubling the wait after each check that finds it
+# still running, up to MAX_RECHECK_INTERVAL. Runs in between exit at once.
+MIN_RECHECK_INTERVAL = 60
+MAX_RECHECK_INTERVAL = 1800
+
 # Create the destination folder if it does not already exist
 CREATE_DESTINATION_FOLDER = True
 
+# Manifest mode: keep a local listing (path, size, mtime) of both endpoints
+# as of the last successful sync, and only transfer files that changed since
+# then, instead of checksumming the whole tree on every run. Timestamps are
+# preserved so the destination listing stays comparable between runs.
+USE_MANIFEST = False
+MANIFEST_FILE = 'sync-manifest.db'
+# Sync level for the changed files submitted in manifest mode
+MANIFEST_SYNC_LEVEL = 'mtime'
+# Concurrent directory listings when walking a tree in manifest mode
+LISTING_WORKERS = 8
+
+# Split the sync into this many tasks of roughly equal size by distributing
+# the files and directories at the top of SOURCE_PATH between them. Several
+# concurrent tasks can use a fast link better than one. 1 submits a single
+# recursive task. Ignored in manifest mode.
+SYNC_SHARDS = 1
+
+# Queue transfers in the local submission queue (see submission_queue.py)
+# instead of submitting them straight away. A sync still waiting in the queue
+# is replaced by the next run's. Once any script or `submission_queue.py
+# release` has submitted it, the next run records the task in
+# TASK_STORE_FILE and waits for it like any other.
+USE_SUBMISSION_QUEUE = False
+
 
 get_input = getattr(__builtins__, 'raw_input', input)
 
@@ -73,31 +112,49 @@ def load_data_from_file(filepath):
     return tokens
 
 
-def save_data_to_file(filepath, key, data):
-    """Save data to a file"""
+def import_data_file(store):
+    """Record the last task from an old DATA_FILE in store, if there is one
+    and store has nothing for this sync yet."""
+    if store.latest_run(SYNC_PAIR_NAME):
+        return
     try:
-        store = load_data_from_file(filepath)
-    except:
-        store = {}
-    if len(store) > 0:
-        store[key] = data
-    with open(filepath, 'w') as f:
-        json.dump(store, f)
+        data = load_data_from_file(DATA_FILE) or {}
+    except ValueError:
+        return
+    tasks = data.get('shards') or ([data['task']] if data.get('task')
+                                   else [])
+    for task in tasks:
+        store.record_submission(SYNC_PAIR_NAME, task,
+                                run=tasks[0]['task_id'])
 
 
-def setup_transfer_client(transfer_tokens):
+def get_transfer_tokens():
+    """Load saved tokens, or log in to get new ones, and return the tokens
+    for the Transfer service."""
+    from globus_session import native_app_tokens
 
-    authorizer = RefreshTokenAuthorizer(
-        transfer_tokens['refresh_token'],
-        NativeAppAuthClient(client_id=CLIENT_ID),
-        access_token=transfer_tokens['access_token'],
-        expires_at=transfer_tokens['expires_at_seconds'])
+    tokens = native_app_tokens(CLIENT_ID, APP_NAME, SCOPES)
+    return tokens['transfer.api.globus.org']
 
-    transfer_client = TransferClient(authorizer=authorizer)
+
+def setup_transfer_client(transfer_tokens, endpoints=None):
+    """Create a TransferClient and autoactivate each distinct endpoint in
+    endpoints, the source and destination endpoints by default. Endpoints
+    activated by an earlier run are skipped until close to expiry."""
+    from globus_sdk import TransferClient
+    from globus_sdk.exc import GlobusAPIError
+    from globus_session import (native_app_authorizer, autoactivate_endpoints,
+                                setup_client)
+
+    if endpoints is None:
+        endpoints = [SOURCE_ENDPOINT, DESTINATION_ENDPOINT]
+
+    authorizer = native_app_authorizer(CLIENT_ID, APP_NAME, transfer_tokens)
+    transfer_client = setup_client(TransferClient(authorizer=authorizer))
 
     try:
-        transfer_client.endpoint_autoactivate(SOURCE_ENDPOINT)
-        transfer_client.endpoint_autoactivate(DESTINATION_ENDPOINT)
+        autoactivate_endpoints(transfer_client, endpoints,
+                               'native:' + CLIENT_ID)
     except GlobusAPIError as ex:
         if ex.http_status == 401:
             sys.exit('Refresh token has expired. '
@@ -110,6 +167,8 @@ def setup_transfer_client(transfer_tokens):
 
 def check_endpoint_path(transfer_client, endpoint, path):
     """Check the endpoint path exists"""
+    from globus_sdk.exc import TransferAPIError
+
     try:
         transfer_client.operation_ls(endpoint, path=path)
     except TransferAPIError as tapie:
@@ -122,6 +181,8 @@ def check_endpoint_path(transfer_client, endpoint, path):
 
 def create_destination_directory(transfer_client, dest_ep, dest_path):
     """Create the destination path if it does not exist"""
+    from globus_sdk.exc import TransferAPIError
+
     try:
         transfer_client.operation_ls(dest_ep, path=dest_path)
     except TransferAPIError:
@@ -133,40 +194,281 @@ def create_destination_directory(transfer_client, dest_ep, dest_path):
             sys.exit(1)
 
 
-def main():
-    tokens = None
-    client = NativeClient(client_id=CLIENT_ID, app_name=APP_NAME)
+def walk_endpoint(transfer_client, endpoint, path):
+    """Return {relative path: (size, mtime)} for every file beneath path.
+    A path that does not exist yet has no files."""
+    from globus_sdk.exc import TransferAPIError
+    import endpoint_lister
+
+    files = {}
     try:
-        # if we already have tokens, load and use them
-        tokens = client.load_tokens(requested_scopes=SCOPES)
-    except:
-        pass
-
-    if not tokens:
-        # if we need to get tokens, start the Native App authentication process
-        # need to specify that we want refresh tokens
-        tokens = client.login(requested_scopes=SCOPES,
-                              refresh_tokens=True)
-        try:
-            client.save_tokens(tokens)
-        except:
-            pass
+        for name, entry in endpoint_lister.walk(transfer_client, endpoint,
+                                                path,
+                                                max_workers=LISTING_WORKERS):
+            if entry['type'] != 'dir':
+                files[name] = (entry['size'], entry['last_modified'])
+    except TransferAPIError as tapie:
+        if tapie.code == 'ClientError.NotFound':
+            return {}
+        raise
+    return files
+
+
+def update_manifest(transfer_client, manifest):
+    """Settle the listing recorded for the last manifest task once it has
+    finished. A successful task's destination is listed again and recorded
+    as it is, not as the task was expected to leave it. Returns the task
+    status, or None if there was no such task, and that destination listing
+    if one was taken."""
+    task_id = manifest.pending_task_id()
+    if task_id is None:
+        return None, None
+    status = transfer_client.get_task(task_id)['status']
+    destination_files = None
+    if status == 'SUCCEEDED':
+        destination_files = walk_endpoint(transfer_client,
+                                          DESTINATION_ENDPOINT,
+                                          DESTINATION_PATH)
+        manifest.promote_pending(destination_files)
+    elif status == 'FAILED':
+        manifest.discard_pending()
+    return status, destination_files
+
+
+def manifest_transfer_data(transfer_client, manifest, destination_files=None):
+    """Diff both endpoints against the manifest and build a transfer of the
+    files that changed. destination_files is a listing of the destination
+    taken earlier in this run, if there is one. Returns the TransferData, or
+    None if nothing changed, along with the listings to record once it
+    succeeds."""
+    from globus_sdk import TransferData
+    from sync_manifest import changed_files, SOURCE, DESTINATION
+
+    source_files = walk_endpoint(transfer_client, SOURCE_ENDPOINT,
+                                 SOURCE_PATH)
+    if destination_files is None:
+        destination_files = walk_endpoint(transfer_client,
+                                          DESTINATION_ENDPOINT,
+                                          DESTINATION_PATH)
+    if manifest.has_synced():
+        changed = changed_files(source_files, destination_files,
+                                manifest.load(SOURCE),
+                                manifest.load(DESTINATION))
+        print('{} of {} files changed since the last sync'.format(
+            len(changed), len(source_files)))
+        if not changed:
+            return None, source_files, destination_files
+        tdata = TransferData(
+            transfer_client,
+            SOURCE_ENDPOINT,
+            DESTINATION_ENDPOINT,
+            label=TRANSFER_LABEL,
+            sync_level=MANIFEST_SYNC_LEVEL,
+            preserve_timestamp=True
+        )
+        source_base = SOURCE_PATH.rstrip('/') + '/'
+        destination_base = DESTINATION_PATH.rstrip('/') + '/'
+        for path in changed:
+            tdata.add_item(source_base + path, destination_base + path)
+    else:
+        # Nothing to diff against yet, checksum the whole tree once
+        print('No previous sync recorded in {}, syncing everything'.format(
+            MANIFEST_FILE))
+        changed = list(source_files)
+        tdata = TransferData(
+            transfer_client,
+            SOURCE_ENDPOINT,
+            DESTINATION_ENDPOINT,
+            label=TRANSFER_LABEL,
+            sync_level='checksum',
+            preserve_timestamp=True
+        )
+        tdata.add_item(SOURCE_PATH, DESTINATION_PATH, recursive=True)
+
+    expected_destination = dict(destination_files)
+    for path in changed:
+        expected_destination[path] = source_files[path]
+    return tdata, source_files, expected_destination
+
+
+def top_level_sizes(transfer_client, endpoint, path):
+    """Return {name: (is_dir, total bytes)} for each entry directly in
+    path, counting everything beneath directories."""
+    import endpoint_lister
+
+    sizes = {}
+    for name, entry in endpoint_lister.walk(transfer_client, endpoint, path,
+                                            max_workers=LISTING_WORKERS):
+        top, _, rest = name.partition('/')
+        is_dir, size = sizes.get(top, (False, 0))
+        if entry['type'] == 'dir' or rest:
+            is_dir = True
+        if entry['type'] != 'dir':
+            size += entry['size']
+        sizes[top] = (is_dir, size)
+    return sizes
+
+
+def balance_shards(sizes, shard_count):
+    """Partition the entries of sizes into at most shard_count shards with
+    similar total bytes, by placing the largest remaining entry in the
+    emptiest shard. Returns a list of (total bytes, [names])."""
+    shards = [(0, index, []) for index in range(shard_count)]
+    by_size = sorted(sizes, key=lambda name: (-sizes[name][1], name))
+    for name in by_size:
+        total, index, names = heapq.heappop(shards)
+        names.append(name)
+        heapq.heappush(shards, (total + sizes[name][1], index, names))
+    return [(total, names) for total, _, names in sorted(shards) if names]
+
+
+def shard_transfer_data(transfer_client):
+    """Build one TransferData per shard of the source directory."""
+    from globus_sdk import TransferData
+
+    sizes = top_level_sizes(transfer_client, SOURCE_ENDPOINT, SOURCE_PATH)
+    source_base = SOURCE_PATH.rstrip('/') + '/'
+    destination_base = DESTINATION_PATH.rstrip('/') + '/'
+    tdatas = []
+    shards = balance_shards(sizes, SYNC_SHARDS)
+    for number, (total, names) in enumerate(shards, 1):
+        tdata = TransferData(
+            transfer_client,
+            SOURCE_ENDPOINT,
+            DESTINATION_ENDPOINT,
+            label='{} shard {} of {}'.format(TRANSFER_LABEL, number,
+                                             len(shards)),
+            sync_level="checksum"
+        )
+        for name in sorted(names):
+            if sizes[name][0]:
+                tdata.add_item(source_base + name + '/',
+                               destination_base + name + '/',
+                               recursive=True)
+            else:
+                tdata.add_item(source_base + name, destination_base + name)
+        print('Shard {}: {} entries, {} bytes'.format(number, len(names),
+                                                      total))
+        tdatas.append(tdata)
+    return tdatas
+
+
+def record_released_tasks(transfer_client, store):
+    """Record the syncs that were queued by earlier runs and have since
+    been submitted by another release, as one run, so they are waited for
+    instead of submitted again."""
+    from submission_queue import SubmissionQueue, native_user, SUBMITTED
+
+    queue = SubmissionQueue()
+    try:
+        entries = queue.entries(user=native_user(CLIENT_ID), state=SUBMITTED)
+    finally:
+        queue.close()
+    run = None
+    for entry in sorted(entries, key=lambda entry: entry['id']):
+        key = entry['key'] or ''
+        if key != SYNC_PAIR_NAME and \
+                not key.startswith(SYNC_PAIR_NAME + '-shard-'):
+            continue
+        if store.has_task(entry['task_id']):
+            continue
+        run = run or entry['task_id']
+        store.record_submission(
+            SYNC_PAIR_NAME, transfer_client.get_task(entry['task_id']).data,
+            run=run)
+
+
+def check_previous_tasks(transfer_client, store):
+    """Record the status and progress of each task of the previous run, and
+    return True if all of them have finished."""
+    tasks = store.latest_run(SYNC_PAIR_NAME)
+    finished = True
+    for number, previous in enumerate(tasks, 1):
+        task = transfer_client.get_task(previous['task_id']).data
+        store.record_status(task)
+        if len(tasks) > 1:
+            print('Shard {} ({}): {}, {} of {} files, {} bytes'.format(
+                number, task['task_id'], task['status'],
+                task['files_transferred'], task['files'],
+                task['bytes_transferred']))
+        elif task['status'] not in PREVIOUS_TASK_RUN_CASES:
+            print('The last transfer status is {}, skipping run...'.format(
+                task['status']
+            ))
+        if task['status'] not in PREVIOUS_TASK_RUN_CASES:
+            finished = False
+    if len(tasks) > 1 and not finished:
+        print('Not all shards of the last transfer have finished, '
+              'skipping run...')
+    return finished
+
+
+def submit(transfer_client, tdata, key):
+    """Submit tdata, or queue it under key if USE_SUBMISSION_QUEUE is set.
+    Returns the task document, or None if the transfer is still queued."""
+    if not USE_SUBMISSION_QUEUE:
+        return transfer_client.submit_transfer(tdata).data
+    from submission_queue import (submit_or_enqueue, native_user,
+                                  PRIORITY_BULK)
+
+    task_id = submit_or_enqueue(transfer_client, native_user(CLIENT_ID),
+                                tdata, priority=PRIORITY_BULK, key=key)
+    if task_id is None:
+        print('Transfer queued until the service has room for it')
+        return None
+    return transfer_client.get_task(task_id).data
+
+
+def recheck_due(store):
+    """Return True unless the previous transfer was still running when last
+    checked, and it is too soon to check again."""
+    not_before, _ = store.next_poll(SYNC_PAIR_NAME)
+    if not_before is None or time.time() >= not_before:
+        return True
+    print('The last transfer was still running when checked, next check '
+          'after {}, skipping run...'.format(
+              time.strftime('%H:%M:%S', time.localtime(not_before))))
+    return False
+
+
+def postpone_recheck(store, backoff=True):
+    """Skip runs until the previous transfer is due another check, waiting
+    twice as long as last time if backoff is True."""
+    _, interval = store.next_poll(SYNC_PAIR_NAME)
+    if backoff and interval:
+        interval = min(MAX_RECHECK_INTERVAL, interval * 2)
+    else:
+        interval = MIN_RECHECK_INTERVAL
+    store.set_next_poll(SYNC_PAIR_NAME, time.time() + interval, interval)
 
-    transfer = setup_transfer_client(tokens['transfer.api.globus.org'])
 
-    try:
-        data = load_data_from_file(DATA_FILE)
-        if len(data) > 0:
-            task_data = data['task']
-            task = transfer.get_task(task_data['task_id'])
-            if task['status'] not in PREVIOUS_TASK_RUN_CASES:
-                print('The last transfer status is {}, skipping run...'.format(
-                    task['status']
-                ))
-                sys.exit(1)
-    except KeyError:
-        # Ignore if there is no previous task
-        pass
+def main():
+    store = TaskStore(TASK_STORE_FILE)
+    import_data_file(store)
+    if not recheck_due(store):
+        sys.exit(1)
+
+    from globus_sdk import TransferData
+
+    transfer = setup_transfer_client(get_transfer_tokens())
+    if USE_MANIFEST:
+        from sync_manifest import SyncManifest
+        manifest = SyncManifest(MANIFEST_FILE)
+    else:
+        manifest = None
+
+    if USE_SUBMISSION_QUEUE:
+        record_released_tasks(transfer, store)
+    if not check_previous_tasks(transfer, store):
+        postpone_recheck(store)
+        sys.exit(1)
+    destination_files = None
+    if manifest is not None:
+        status, destination_files = update_manifest(transfer, manifest)
+        if status not in PREVIOUS_TASK_RUN_CASES + [None]:
+            print('The last manifest transfer status is {}, skipping run...'
+                  .format(status))
+            sys.exit(1)
 
     check_endpoint_path(transfer, SOURCE_ENDPOINT, SOURCE_PATH)
     if CREATE_DESTINATION_FOLDER:
@@ -175,23 +477,51 @@ def main():
     else:
         check_endpoint_path(transfer, DESTINATION_ENDPOINT, DESTINATION_PATH)
 
-    tdata = TransferData(
-        transfer,
-        SOURCE_ENDPOINT,
-        DESTINATION_ENDPOINT,
-        label=TRANSFER_LABEL,
-        sync_level="checksum"
-    )
-    tdata.add_item(SOURCE_PATH, DESTINATION_PATH, recursive=True)
-
-    task = transfer.submit_transfer(tdata)
-    save_data_to_file(DATA_FILE, 'task', task.data)
+    if manifest is not None:
+        tdata, source_files, expected_destination = \
+            manifest_transfer_data(transfer, manifest, destination_files)
+        if tdata is None:
+            print('Nothing has changed since the last sync, skipping run...')
+            return
+        tdatas = [tdata]
+    elif SYNC_SHARDS > 1:
+        tdatas = shard_transfer_data(transfer)
+    else:
+        tdata = TransferData(
+            transfer,
+            SOURCE_ENDPOINT,
+            DESTINATION_ENDPOINT,
+            label=TRANSFER_LABEL,
+            sync_level="checksum"
+        )
+        tdata.add_item(SOURCE_PATH, DESTINATION_PATH, recursive=True)
+        tdatas = [tdata]
+
+    run = None
+    for number, tdata in enumerate(tdatas, 1):
+        key = SYNC_PAIR_NAME
+        if len(tdatas) > 1:
+            key += '-shard-{}'.format(number)
+        task = submit(transfer, tdata, key)
+        if task is None:
+            continue
+        # Recorded after each submission, so a failure part way through
+        # still leaves the submitted shards tracked
+        run = run or task['task_id']
+        store.record_submission(SYNC_PAIR_NAME, task, run=run)
+    if run is None:
+        return
+    postpone_recheck(store, backoff=False)
+    if manifest is not None:
+        manifest.save_pending(task['task_id'], source_files,
+                              expected_destination)
     print('Transfer has been started from\n  {}:{}\nto\n  {}:{}'.format(
         SOURCE_ENDPOINT,
         SOURCE_PATH,
         DESTINATION_ENDPOINT,
         DESTINATION_PATH
     ))
+    import six
     url_string = 'https://globus.org/app/transfer?' + \
         six.moves.urllib.parse.urlencode({
             'origin_id': SOURCE_ENDPOINT,
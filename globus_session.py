@@ -0,0 +1,151 @@
+"""
+Log in and set up endpoints once, and reuse the results across runs and
+scripts.
+
+Three things are cached on disk between runs:
+
+  * Native App tokens, saved by fair_research_login. Access tokens refreshed
+    during a run are saved back, so the next run doesn't refresh them again.
+  * Client Credential access tokens, kept in SESSION_CACHE_FILE until close
+    to expiry instead of being granted anew on every run.
+  * When each endpoint's activation expires, also kept in SESSION_CACHE_FILE,
+    so endpoints are only autoactivated again close to expiry.
+
+SESSION_CACHE_FILE holds access tokens and MUST BE STORED IN A SECURE
+LOCATION. It is readable only by its owner, and is updated with
+atomic_file.py, so entries saved by scripts running at the same time are
+all kept. Such scripts may each renew the same entry, which costs an extra
+request.
+"""
+
+import time
+
+from globus_sdk import (NativeAppAuthClient, ConfidentialAppAuthClient,
+                        RefreshTokenAuthorizer, AccessTokenAuthorizer)
+
+from atomic_file import load_json, update_json
+from http_pool import pooled
+from api_retry import with_retries
+from api_metrics import instrumented
+
+SESSION_CACHE_FILE = 'globus-session-cache.json'
+
+# Renew cached access tokens this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 300
+# Autoactivate endpoints again this many seconds before activation expires
+ACTIVATION_EXPIRY_MARGIN = 3600
+
+TRANSFER_RESOURCE_SERVER = 'transfer.api.globus.org'
+
+
+def setup_client(client):
+    """Give a globus_sdk client the shared connection pool, retries and
+    metrics, and return it."""
+    return with_retries(instrumented(pooled(client)))
+
+
+def load_cache(filepath=SESSION_CACHE_FILE):
+    # Start over rather than fail on a damaged cache
+    return load_json(filepath, {})
+
+
+def update_cache(section, key, value, filepath=SESSION_CACHE_FILE):
+    """Set one entry of the cache and save it, keeping entries saved by
+    other scripts meanwhile."""
+    def set_entry(cache):
+        cache.setdefault(section, {})[key] = value
+
+    update_json(filepath, set_entry, mode=0o600)
+
+
+def native_app_tokens(client_id, app_name, scopes):
+    """Load saved Native App tokens, or log in to get new ones, and return
+    them keyed by resource server."""
+    from fair_research_login import NativeClient
+
+    tokens = None
+    client = NativeClient(client_id=client_id, app_name=app_name)
+    try:
+        # if we already have tokens, load and use them
+        tokens = client.load_tokens(requested_scopes=scopes)
+    except:
+        pass
+
+    if not tokens:
+        # if we need to get tokens, start the Native App authentication process
+        # need to specify that we want refresh tokens
+        tokens = client.login(requested_scopes=scopes,
+                              refresh_tokens=True)
+        try:
+            client.save_tokens(tokens)
+        except:
+            pass
+    return tokens
+
+
+def native_app_authorizer(client_id, app_name, tokens):
+    """Return a RefreshTokenAuthorizer for one resource server's Native App
+    tokens, which saves the access token whenever it is refreshed."""
+    from fair_research_login import NativeClient
+
+    client = NativeClient(client_id=client_id, app_name=app_name)
+
+    def save_refreshed_tokens(token_response):
+        try:
+            client.save_tokens(token_response.by_resource_server)
+        except:
+            pass
+
+    return RefreshTokenAuthorizer(
+        tokens['refresh_token'],
+        setup_client(NativeAppAuthClient(client_id=client_id)),
+        access_token=tokens['access_token'],
+        expires_at=tokens['expires_at_seconds'],
+        on_refresh=save_refreshed_tokens)
+
+
+def client_credentials_tokens(client_id, client_secret,
+                              filepath=SESSION_CACHE_FILE):
+    """Return the Client Credential tokens for client_id keyed by resource
+    server, granting new ones only if the cached ones are about to
+    expire."""
+    cached = load_cache(filepath).get('client_credentials', {}).get(client_id)
+    if cached and all(
+            tokens['expires_at_seconds'] > time.time() + TOKEN_EXPIRY_MARGIN
+            for tokens in cached.values()):
+        return cached
+
+    client = setup_client(ConfidentialAppAuthClient(
+        client_id=client_id, client_secret=client_secret))
+    tokens = client.oauth2_client_credentials_tokens().by_resource_server
+    update_cache('client_credentials', client_id, tokens, filepath)
+    return tokens
+
+
+def confidential_app_authorizer(client_id, client_secret,
+                                resource_server=TRANSFER_RESOURCE_SERVER,
+                                filepath=SESSION_CACHE_FILE):
+    tokens = client_credentials_tokens(client_id, client_secret, filepath)
+    return AccessTokenAuthorizer(tokens[resource_server]['access_token'])
+
+
+def autoactivate_endpoints(transfer_client, endpoints, user,
+                           filepath=SESSION_CACHE_FILE):
+    """Autoactivate each distinct endpoint in endpoints for user (any string
+    naming the identity behind transfer_client), skipping endpoints whose
+    cached activation is not about to expire."""
+    activations = load_cache(filepath).get('activations', {})
+    for endpoint in sorted(set(endpoints)):
+        key = '{}:{}'.format(user, endpoint)
+        expires_at = activations.get(key, 0)
+        if expires_at is None or \
+                expires_at > time.time() + ACTIVATION_EXPIRY_MARGIN:
+            continue
+        result = transfer_client.endpoint_autoactivate(endpoint)
+        if result['code'] == 'AutoActivationFailed':
+            continue
+        expires_in = result.get('expires_in', 0)
+        # An expires_in of -1 means the activation never expires
+        update_cache('activations', key,
+                     None if expires_in == -1 else time.time() + expires_in,
+                     filepath)
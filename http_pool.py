@@ -0,0 +1,70 @@
+"""
+One pooled, keep-alive HTTP session shared by every Globus client in a
+process.
+
+Each globus_sdk client normally creates its own requests.Session, so a
+script with a TransferClient and an auth client, or several threads listing
+and submitting at once, keeps separate connection pools. Each pool only
+holds a few connections. Under concurrency, connections beyond that are
+opened, used once and thrown away, and each one costs a TCP and TLS
+handshake. pooled() points clients at a single session instead. The session
+keeps up to POOL_MAXSIZE connections open per host. When that many are in
+use, threads wait for a free one rather than opening a new connection.
+
+connection_stats() reports how many requests went over a reused connection
+rather than a new one.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Hosts to keep connection pools for (Auth and Transfer, with room to spare)
+POOL_CONNECTIONS = 4
+# Open connections kept per host. Keep this at least as large as the number
+# of threads making requests at once.
+POOL_MAXSIZE = 16
+
+_lock = threading.Lock()
+_session = None
+
+
+def shared_session(pool_connections=POOL_CONNECTIONS,
+                   pool_maxsize=POOL_MAXSIZE):
+    """Return the process-wide session, creating it on first use. The pool
+    sizes only apply to that first call."""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections,
+                                  pool_maxsize=pool_maxsize, pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def pooled(client):
+    """Make a globus_sdk client send its requests through the shared
+    session, and return it."""
+    client._session = shared_session()
+    return client
+
+
+def connection_stats():
+    """Return a dict with the number of 'requests' sent through the shared
+    session, the 'connections' opened for them, and the number of requests
+    'reused' an open connection."""
+    requests_sent = connections = 0
+    if _session is not None:
+        adapters = set(_session.adapters.values())
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+    return {'requests': requests_sent, 'connections': connections,
+            'reused': requests_sent - connections}
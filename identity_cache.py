@@ -0,0 +1,81 @@
+"""
+Turn identity usernames (or emails used as usernames) into identity IDs for
+access rules, remembering the answers between runs.
+
+Resolved usernames are kept in IDENTITY_CACHE_FILE for IDENTITY_TTL seconds,
+and usernames Globus Auth doesn't know for UNKNOWN_IDENTITY_TTL seconds, so
+a mistyped name isn't looked up again on every run but a newly created
+identity is found soon after. Usernames missing from the cache are looked
+up together, IDENTITY_BATCH_SIZE per get_identities call, so sharing with
+collaborators seen before needs no Auth request at all.
+
+Usernames are case insensitive and are cached lowercased. The cache file is
+updated with atomic_file.py, under a lock, so entries added by scripts
+running at the same time are all kept.
+"""
+
+import time
+
+from atomic_file import load_json, update_json
+
+IDENTITY_CACHE_FILE = 'identity-cache.json'
+
+# Seconds a resolved username is trusted before it is looked up again
+IDENTITY_TTL = 7 * 24 * 3600
+# Seconds an unknown username is remembered as unknown
+UNKNOWN_IDENTITY_TTL = 3600
+
+# Usernames looked up per get_identities call
+IDENTITY_BATCH_SIZE = 100
+
+
+def load_identities(filepath=IDENTITY_CACHE_FILE):
+    # Start over rather than fail on a damaged cache
+    cache = load_json(filepath, {})
+    return cache.get('usernames', {}) if isinstance(cache, dict) else {}
+
+
+def save_identities(entries, filepath=IDENTITY_CACHE_FILE):
+    """Add entries to the cache, keeping anything else saved meanwhile."""
+    def add_entries(cache):
+        cache.setdefault('usernames', {}).update(entries)
+
+    update_json(filepath, add_entries)
+
+
+def is_fresh(entry, now):
+    ttl = IDENTITY_TTL if entry['id'] else UNKNOWN_IDENTITY_TTL
+    return entry['resolved_at'] + ttl > now
+
+
+def resolve_usernames(auth_client, usernames, filepath=IDENTITY_CACHE_FILE):
+    """Return {lowercased username: identity ID, or None if there is no such
+    identity} for usernames, only calling auth_client for usernames that
+    aren't cached or have expired."""
+    now = time.time()
+    usernames = sorted(set(username.lower() for username in usernames))
+    cached = load_identities(filepath)
+    resolved = {}
+    missing = []
+    for username in usernames:
+        entry = cached.get(username)
+        if entry is not None and is_fresh(entry, now):
+            resolved[username] = entry['id']
+        else:
+            missing.append(username)
+    if not missing:
+        return resolved
+
+    entries = {}
+    for start in range(0, len(missing), IDENTITY_BATCH_SIZE):
+        batch = missing[start:start + IDENTITY_BATCH_SIZE]
+        found = {}
+        r = auth_client.get_identities(usernames=batch)
+        for identity in r['identities']:
+            found[identity['username'].lower()] = identity['id']
+        for username in batch:
+            entries[username] = {'id': found.get(username),
+                                 'resolved_at': now}
+            resolved[username] = found.get(username)
+    save_identities(entries, filepath)
+    return resolved
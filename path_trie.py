@@ -0,0 +1,108 @@
+"""
+A prefix tree keyed on path components, for answering "what is stored at or
+below this directory" without scanning every path.
+
+Paths are split on "/" and empty components are ignored, so "/a/b",
+"/a/b/" and "a//b" all refer to the same node. Unlike os.path.commonprefix,
+"/data/run1" is never treated as a prefix of "/data/run10".
+"""
+
+
+def split_path(path):
+    """Split a path into its non-empty components."""
+    return [part for part in path.split('/') if part]
+
+
+class PathTrieNode(object):
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+class PathTrie(object):
+    """Map paths to lists of values. Lookups cost time proportional to the
+    depth of the path, not the number of paths stored."""
+
+    def __init__(self):
+        self.root = PathTrieNode()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, path, value):
+        """Store value at path."""
+        node = self.root
+        for part in split_path(path):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = PathTrieNode()
+            node = child
+        node.values.append(value)
+        self._len += 1
+
+    def find(self, path):
+        """Return the node for path, or None if nothing is stored at or below
+        it."""
+        node = self.root
+        for part in split_path(path):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def values_at(self, path):
+        """Return the values stored exactly at path."""
+        node = self.find(path)
+        return list(node.values) if node is not None else []
+
+    def values_at_or_above(self, path):
+        """Return the values stored at path or any of its ancestors, starting
+        from the root."""
+        node = self.root
+        found = list(node.values)
+        for part in split_path(path):
+            node = node.children.get(part)
+            if node is None:
+                break
+            found.extend(node.values)
+        return found
+
+    def values_at_or_below(self, path):
+        """Return the values stored at path or any path beneath it, ordered
+        by path."""
+        node = self.find(path)
+        if node is None:
+            return []
+        found = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            found.extend(node.values)
+            stack.extend(node.children[part]
+                         for part in sorted(node.children, reverse=True))
+        return found
+
+    def remove(self, path, value):
+        """Remove one occurrence of value stored at path, pruning nodes left
+        empty. Returns False if value was not stored there."""
+        parts = split_path(path)
+        trail = [self.root]
+        for part in parts:
+            node = trail[-1].children.get(part)
+            if node is None:
+                return False
+            trail.append(node)
+        try:
+            trail[-1].values.remove(value)
+        except ValueError:
+            return False
+        self._len -= 1
+        for depth in range(len(parts), 0, -1):
+            node = trail[depth]
+            if node.values or node.children:
+                break
+            del trail[depth - 1].children[parts[depth - 1]]
+        return True
@@ -32,7 +32,7 @@ sync='checksum'
 function help_and_exit () {
 
     echo -e 'Usage:' \
-        "$0 --source-endpoint <UUID> --source-path <PATH> --shared-endpoint <UUID> --destination-path <PATH> [-d|--delete] [-h|--help]"
+        "$0 --source-endpoint <UUID> --source-path <PATH> --shared-endpoint <UUID> --destination-path <PATH> [-d|--delete] [-u|--update] [-h|--help]"
     echo ''
     echo 'The following options are available:'
     echo ''
@@ -48,6 +48,9 @@ function help_and_exit () {
     echo '  --group-uuid: Group UUID for a group you want to grant read access'
     echo '  --group-id: Alternative for "--group-uuid"'
     echo '  -d: Delete destination folder if it already exists'
+    echo '  -u: Sync into the destination folder if it already exists,'
+    echo '    keeping its permissions and deleting files no longer in'
+    echo '    "--source-path", instead of deleting it first'
     echo '  -h: Print this help message'
     echo ''
     echo "Example: $0 --source-endpoint ddb59aef-6d04-11e5-ba46-22000b92c6ec --source-path /share/godata --destination-path /shared_folder_example --shared-endpoint <your-shared-endpoint>"
@@ -94,6 +97,9 @@ while [ $# -gt 0 ]; do
         -d|--delete)
             delete='yes'
         ;;
+        -u|--update)
+            update='yes'
+        ;;
         -h|--help)
             help_and_exit
         ;;
@@ -150,8 +156,11 @@ fi
 destination_directory="$destination_path$basename/"
 globus ls "$shared_endpoint:$destination_directory" 1>/dev/null 2>/dev/null
 if [ $? == 0 ]; then
-    # if it was, delete it
-    if [ -n "$delete" ]; then
+    # if it was, sync into it in place, or delete it
+    if [ -n "$update" ]; then
+        echo "Destination directory, $destination_directory, exists and will be updated in place"
+        update_existing='yes'
+    elif [ -n "$delete" ]; then
         echo "Destination directory, $destination_directory, exists and will be deleted"
         task_id=`globus delete --format unix --jmespath 'task_id' --label 'Share Data Example' -r "$shared_endpoint:$destination_directory"`
         globus task wait --timeout 600 $task_id
@@ -160,15 +169,17 @@ if [ $? == 0 ]; then
     else
         >&2 echo \
             "Error: Destination directory, $destination_path$basename, already exists." \
-            "Delete the directory or use --delete option"
+            "Delete the directory or use --delete or --update option"
         exit 1
     fi
 fi
 
-echo "Creating destination directory $destination_directory"
-globus mkdir "$shared_endpoint:$destination_directory"
-rc=$?
-check_rc
+if [ -z "$update_existing" ]; then
+    echo "Creating destination directory $destination_directory"
+    globus mkdir "$shared_endpoint:$destination_directory"
+    rc=$?
+    check_rc
+fi
 
 if [ -n "$user_id" ]; then
     echo "Granting user, $user_id, read access to the destination directory"
@@ -179,5 +190,12 @@ if [ -n "$group_uuid" ]; then
     globus endpoint permission create --group $group_uuid --permissions r "$shared_endpoint:$destination_directory"
 fi
 
+# when updating, only changed files are copied and files no longer in the
+# source are deleted from the share
+update_options=''
+if [ -n "$update" ]; then
+    update_options='--delete --preserve-mtime'
+fi
+
 echo "Submitting a transfer from $source_endpoint:$source_path to $shared_endpoint:$destination_directory"
-exec globus transfer --recursive --sync-level $sync --label 'Share Data Example' "$source_endpoint:$source_path" "$shared_endpoint:$destination_directory"
+exec globus transfer --recursive --sync-level $sync $update_options --label 'Share Data Example' "$source_endpoint:$source_path" "$shared_endpoint:$destination_directory"
@@ -34,16 +34,48 @@ Confidential App [Client Credentials Grant]:
 Tutorial Endpoint IDs
 Globus Tutorial Endpoint 1: ddb59aef-6d04-11e5-ba46-22000b92c6ec
 Globus Tutorial Endpoint 2: ddb59af0-6d04-11e5-ba46-22000b92c6ec
+
+To share many directories in one run, list them in a JSON (or, with PyYAML
+installed, YAML) manifest and pass it with --manifest:
+
+{
+    "shares": [
+        {
+            "source_path": "/share/godata/",
+            "destination_path": "/",
+            "user_uuids": ["c02d881a-d274-11e5-bdf5-d3a88fb071ca"],
+            "usernames": ["johndoe@uchicago.edu"],
+            "group_uuids": []
+        }
+    ]
+}
+
+"destination_path" defaults to --destination-path. Usernames are found in
+the cache kept by identity_cache.py or looked up together, directories and
+access rules are created concurrently, and all the data is copied by as few
+transfer tasks as possible.
 """
 
 from __future__ import print_function
 import os
 import sys
 import argparse
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import globus_sdk
 from globus_sdk.exc import TransferAPIError
-from fair_research_login import NativeClient
+
+from config_file import load_config
+from globus_session import (native_app_tokens, native_app_authorizer,
+                            client_credentials_tokens,
+                            confidential_app_authorizer, setup_client)
+
+from submission_queue import (submit_or_enqueue, native_user, client_user,
+                              release_command, PRIORITY_HIGH)
+from task_monitor import wait_for_tasks
+from endpoint_lister import list_directory
+from identity_cache import resolve_usernames
 
 # Both Native App and Client Credential authentication require Client IDs.
 # Create your app at developers.globus.org. The following id is for testing
@@ -110,6 +142,24 @@ source_path = '/share/godata'
 # stored on Globus Tutorial Endpoint 2 at /~/godata/.
 destination_path = '/'
 
+# How long to wait for an existing destination directory to be deleted
+DELETE_TIMEOUT = 600
+
+# Requests made at the same time: independent steps of a share, or
+# directories and access rules in --manifest mode
+MAX_CONCURRENT_REQUESTS = 8
+# Items per transfer task in --manifest mode
+TRANSFER_BATCH_SIZE = 10000
+
+# With --update, existing destination directories are synced in place: only
+# files that differ at the chosen sync level are copied (see
+# https://docs.globus.org/api/transfer/task_submit/#transfer_and_delete_documents)
+# and, if UPDATE_DELETE_EXTRA is set, files no longer in the source are
+# deleted, so the share mirrors the source.
+SYNC_LEVELS = ('exists', 'size', 'mtime', 'checksum')
+UPDATE_SYNC_LEVEL = 'checksum'
+UPDATE_DELETE_EXTRA = True
+
 get_input = getattr(__builtins__, 'raw_input', input)
 
 
@@ -135,73 +185,25 @@ def eprint(*args, **kwargs):
 
 
 def get_native_app_authorizer(client_id):
-    tokens = None
-    client = NativeClient(client_id=client_id, app_name=APP_NAME)
-    try:
-        # if we already have tokens, load and use them
-        tokens = client.load_tokens(requested_scopes=SCOPES)    
-    except:
-        pass
-
-    if not tokens:
-        tokens = client.login(requested_scopes=SCOPES,
-                              refresh_tokens=True)
-        try:
-            client.save_tokens(tokens)
-        except:
-            pass
-
-    transfer_tokens = tokens['transfer.api.globus.org']
-
-    auth_client = globus_sdk.NativeAppAuthClient(client_id=client_id)
-
-    return globus_sdk.RefreshTokenAuthorizer(
-            transfer_tokens['refresh_token'],
-            auth_client,
-            access_token=transfer_tokens['access_token'],
-            expires_at=transfer_tokens['expires_at_seconds'])
+    tokens = native_app_tokens(client_id, APP_NAME, SCOPES)
+    return native_app_authorizer(client_id, APP_NAME,
+                                 tokens['transfer.api.globus.org'])
 
 
 def do_client_credentials_app_authentication(client_id, client_secret):
     """
     Does a client credential grant authentication and returns a
-    dict of tokens keyed by service name.
+    dict of tokens keyed by service name. Tokens from earlier runs are
+    reused until they are close to expiry.
     """
-    client = globus_sdk.ConfidentialAppAuthClient(
-            client_id=client_id,
-            client_secret=client_secret)
-    token_response = client.oauth2_client_credentials_tokens()
-
-    return token_response.by_resource_server
+    return client_credentials_tokens(client_id, client_secret)
 
 
 def get_confidential_app_authorizer(client_id, client_secret):
-    tokens = do_client_credentials_app_authentication(
-            client_id=client_id,
-            client_secret=client_secret)
-    transfer_tokens = tokens['transfer.api.globus.org']
-    transfer_access_token = transfer_tokens['access_token']
-
-    return globus_sdk.AccessTokenAuthorizer(transfer_access_token)
-
-
-def share_data(args):
+    return confidential_app_authorizer(client_id, client_secret)
 
-    user_source_endpoint = args.source_endpoint or source_endpoint
-    user_shared_endpoint = args.shared_endpoint or shared_endpoint
-    if not user_shared_endpoint:
-        eprint('Invalid shared endpoint')
-        sys.exit(1)
-
-    user_source_path = args.source_path or source_path
-    user_destination_path = args.destination_path or destination_path
-    if not user_source_path.startswith('/'):
-        eprint('Source path must be absolute')
-        sys.exit(1)
-    if not user_destination_path.startswith('/'):
-        eprint('Destination path must be absolute')
-        sys.exit(1)
 
+def get_authorizer(args):
     if args.auth == 'native':
         # get an authorizer if it is a Native App
         authorizer = get_native_app_authorizer(client_id=CLIENT_ID)
@@ -219,42 +221,145 @@ def share_data(args):
     else:
         raise ValueError('Invalid Authenticator, this script only understands '
                          'Native and Client Credential')
+    return authorizer
+
+
+def run_steps(steps, max_workers=MAX_CONCURRENT_REQUESTS):
+    """Run steps, {name: (function, names of the steps it needs)}, each as
+    soon as the steps it needs have finished, and return {name: result}.
+    A function is called with the results of the steps it needs, in order.
+    If a step raises, steps that haven't started are dropped and the
+    exception is raised once running ones finish."""
+    results = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(results) < len(steps):
+            for name, (function, needs) in sorted(steps.items()):
+                if name in results or name in running.values() or \
+                        not all(need in results for need in needs):
+                    continue
+                future = executor.submit(function,
+                                         *[results[need] for need in needs])
+                running[future] = name
+            if not running:
+                raise ValueError('Steps need each other: {}'.format(
+                    ', '.join(sorted(set(steps) - set(results)))))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+
+def destination_directory_for(source, destination):
+    """The directory source is copied to: the last section of source,
+    beneath destination."""
+    dirname, leaf = os.path.split(source)
+    if leaf == '':
+        _, leaf = os.path.split(dirname)
+    return os.path.join(destination, leaf) + '/'
 
-    # look for an identity uuid for the specified identity username
-    username_uuid = None
-    if args.username:
-        ac = globus_sdk.AuthClient(authorizer=authorizer)
-        r = ac.get_identities(usernames=args.username)
-        if not len(r['identities']):
-            eprint('No such identity username \'{}\''.format(args.username))
-            exit(1)
-        username_uuid = r['identities'][0]['id']
 
-    # create a TransferClient object
-    tc = globus_sdk.TransferClient(authorizer=authorizer)
+def access_rule(principal_type, principal, path):
+    """An access rule granting principal read access to path."""
+    return {
+        "DATA_TYPE": "access",
+        "principal_type": principal_type,
+        "principal": principal,
+        "path": path,
+        "permissions": "r",
+    }
 
-    # check if a destination directory exists at all
-    try:
-        tc.operation_ls(user_shared_endpoint, path=user_destination_path)
-    except TransferAPIError as e:
-        eprint(e)
+
+def share_transfer_data(tc, source_ep, shared_ep, args):
+    """A TransferData for copying to the shared endpoint, which with
+    --update syncs onto what is already there."""
+    if not args.update:
+        return globus_sdk.TransferData(tc, source_ep, shared_ep,
+                                       label='Share Data Example')
+    return globus_sdk.TransferData(
+        tc, source_ep, shared_ep, label='Share Data Example',
+        sync_level=args.sync_level, preserve_timestamp=True,
+        delete_destination_extra=UPDATE_DELETE_EXTRA)
+
+
+def queue_user(args):
+    """Whose entries --queue adds to the submission queue."""
+    return (native_user if args.auth == 'native' else client_user)(CLIENT_ID)
+
+
+def submit_share_transfer(tc, tdata, args):
+    """Submit tdata, or queue it with --queue. Returns the task ID, or None
+    if the transfer is still queued."""
+    if args.queue:
+        return submit_or_enqueue(tc, queue_user(args), tdata,
+                                 priority=PRIORITY_HIGH)
+    return tc.submit_transfer(tdata)['task_id']
+
+
+def share_data(args):
+
+    user_source_endpoint = args.source_endpoint or source_endpoint
+    user_shared_endpoint = args.shared_endpoint or shared_endpoint
+    if not user_shared_endpoint:
+        eprint('Invalid shared endpoint')
         sys.exit(1)
 
-    dirname, leaf = os.path.split(user_source_path)
-    if leaf == '':
-        _, leaf = os.path.split(dirname)
-    destination_directory = os.path.join(user_destination_path, leaf) + '/'
+    user_source_path = args.source_path or source_path
+    user_destination_path = args.destination_path or destination_path
+    if not user_source_path.startswith('/'):
+        eprint('Source path must be absolute')
+        sys.exit(1)
+    if not user_destination_path.startswith('/'):
+        eprint('Destination path must be absolute')
+        sys.exit(1)
 
-    """
-    check if a directory with the same name was already transferred to the
-    destination path if it was and --delete option is specified, delete the
-    directory
-    """
-    try:
-        tc.operation_ls(user_shared_endpoint, path=destination_directory)
+    authorizer = get_authorizer(args)
+    tc = setup_client(globus_sdk.TransferClient(authorizer=authorizer))
+    destination_directory = destination_directory_for(user_source_path,
+                                                      user_destination_path)
+
+    def resolve_username():
+        """The identity uuid for --username, if given."""
+        if not args.username:
+            return None
+        # cached from earlier runs, see identity_cache.py
+        ac = setup_client(globus_sdk.AuthClient(authorizer=authorizer))
+        username_uuid = resolve_usernames(
+            ac, [args.username])[args.username.lower()]
+        if username_uuid is None:
+            eprint('No such identity username \'{}\''.format(args.username))
+            sys.exit(1)
+        return username_uuid
+
+    def find_destination():
+        """
+        check if a directory with the same name was already transferred to
+        the destination path. Listing the destination path also checks that
+        it exists at all
+        """
+        try:
+            return bool(existing_directories(tc, user_shared_endpoint,
+                                             [destination_directory]))
+        except TransferAPIError as e:
+            eprint(e)
+            sys.exit(1)
+
+    def clear_destination(destination_exists, username_uuid):
+        """
+        if the directory exists and --delete option is specified, delete the
+        directory. With --update, keep it and its access rules, and sync the
+        data onto it instead. Waits for the username, so nothing is deleted
+        for a share that can't be made
+        """
+        if destination_exists and args.update:
+            print('Destination directory, {}, exists and will be updated in '
+                  'place'.format(destination_directory))
+            return
+        if not destination_exists:
+            return
         if not args.delete:
             eprint('Destination directory exists. Delete the directory or '
-                   'use --delete option')
+                   'use --delete or --update option')
             sys.exit(1)
         print('Destination directory, {}, exists and will be deleted'
               .format(destination_directory))
@@ -265,94 +370,290 @@ def share_data(args):
                 recursive=True)
         ddata.add_item(destination_directory)
         print('Submitting a delete task')
-        task = tc.submit_delete(ddata)
-        print('\ttask_id: {}'.format(task['task_id']))
-        tc.task_wait(task['task_id'])
-    except TransferAPIError as e:
-        if e.code != u'ClientError.NotFound':
+        try:
+            task = tc.submit_delete(ddata)
+            print('\ttask_id: {}'.format(task['task_id']))
+            delete_task, = wait_for_tasks(tc, [task['task_id']],
+                                          timeout=DELETE_TIMEOUT)
+        except TransferAPIError as e:
             eprint(e)
             sys.exit(1)
+        except asyncio.TimeoutError:
+            eprint('Delete task has yet to complete after {} seconds'
+                   .format(DELETE_TIMEOUT))
+            sys.exit(1)
+        if delete_task['status'] != 'SUCCEEDED':
+            eprint('Delete task {}'.format(delete_task['status']))
+            sys.exit(1)
 
-    # create a destination directory
-    try:
-        print('Creating destination directory {}'
-              .format(destination_directory))
-        tc.operation_mkdir(user_shared_endpoint, destination_directory)
-    except TransferAPIError as e:
-        eprint(e)
-        sys.exit(1)
-
-    # grant group/user read access to the destination directory
-    if args.user_uuid:
-        rule_data = {
-            "DATA_TYPE": "access",
-            "principal_type": "identity",
-            "principal": args.user_uuid,
-            "path": destination_directory,
-            "permissions": "r",
-        }
-
+    def make_destination(destination_exists, _):
+        # create a destination directory
+        if destination_exists and args.update:
+            return
         try:
-            print('Granting user, {}, read access to the destination directory'
-                  .format(args.user_uuid))
-            tc.add_endpoint_acl_rule(user_shared_endpoint, rule_data)
+            print('Creating destination directory {}'
+                  .format(destination_directory))
+            tc.operation_mkdir(user_shared_endpoint, destination_directory)
         except TransferAPIError as e:
-            if e.code != u'Exists':
-                eprint(e)
-                sys.exit(1)
-
-    if username_uuid:
-        rule_data = {
-            "DATA_TYPE": "access",
-            "principal_type": "identity",
-            "principal": username_uuid,
-            "path": destination_directory,
-            "permissions": "r",
-        }
+            eprint(e)
+            sys.exit(1)
 
+    def grant(principal_type, principal):
+        """A step granting principal read access to the destination
+        directory. Returns None or the error, so a failed rule doesn't stop
+        the transfer submitted alongside it."""
+        def step(*_):
+            print('Granting {}, {}, read access to the destination directory'
+                  .format('group' if principal_type == 'group' else 'user',
+                          principal))
+            return add_access_rule(tc, user_shared_endpoint, access_rule(
+                principal_type, principal, destination_directory))
+        return step
+
+    def submit_transfer(_):
+        # transfer data - source directory recursively
+        tdata = share_transfer_data(tc, user_source_endpoint,
+                                    user_shared_endpoint, args)
+        tdata.add_item(user_source_path, destination_directory,
+                       recursive=True)
         try:
-            print('Granting user, {}, read access to the destination directory'
-                  .format(username_uuid))
-            tc.add_endpoint_acl_rule(user_shared_endpoint, rule_data)
+            print('Submitting a transfer task')
+            return submit_share_transfer(tc, tdata, args)
         except TransferAPIError as e:
-            if e.code != u'Exists':
-                eprint(e)
-                sys.exit(1)
+            eprint(e)
+            sys.exit(1)
 
+    # Each step runs as soon as the steps it needs have finished: the
+    # username is resolved while the destination is listed, and the access
+    # rules are created while the transfer is submitted
+    steps = {
+        'username': (resolve_username, ()),
+        'destination': (find_destination, ()),
+        'clear': (clear_destination, ('destination', 'username')),
+        'mkdir': (make_destination, ('destination', 'clear')),
+        'transfer': (submit_transfer, ('mkdir',)),
+    }
+    if args.user_uuid:
+        steps['user rule'] = (grant('identity', args.user_uuid), ('mkdir',))
     if args.group_uuid:
-        rule_data = {
-            "DATA_TYPE": "access",
-            "principal_type": "group",
-            "principal": args.group_uuid,
-            "path": destination_directory,
-            "permissions": "r",
-        }
+        steps['group rule'] = (grant('group', args.group_uuid), ('mkdir',))
+    if args.username:
+        steps['username rule'] = (
+            lambda username_uuid, _: grant('identity', username_uuid)(),
+            ('username', 'mkdir'))
+    results = run_steps(steps)
+
+    task_id = results['transfer']
+    if task_id is None:
+        print('The transfer has been queued ahead of bulk transfers, run '
+              '"{}" to submit it once the service has room'.format(
+                  release_command(queue_user(args))))
+    else:
+        print('\ttask_id: {}'.format(task_id))
+        print('You can monitor the transfer task programmatically using '
+              'Globus SDK, or go to the Web UI, '
+              'https://app.globus.org/activity/{}.'.format(task_id))
+    errors = [results[name] for name in sorted(steps)
+              if name.endswith(' rule') and results[name] is not None]
+    for error in errors:
+        eprint(error)
+    if errors:
+        sys.exit(1)
 
-        try:
-            print('Granting group, {}, read access to '
-                  .format(args.group_uuid))
-            tc.add_endpoint_acl_rule(user_shared_endpoint, rule_data)
-        except TransferAPIError as e:
-            if e.code != u'Exists':
-                eprint(e)
+
+def load_manifest(filepath):
+    """Load and validate the list of shares from a JSON or YAML file."""
+    manifest = load_config(filepath)
+
+    shares = manifest.get('shares', [])
+    for number, share in enumerate(shares, 1):
+        for field in ('source_path', 'destination_path'):
+            path = share.get(field)
+            if path is not None and not path.startswith('/'):
+                eprint('Share {}: {} must be absolute'.format(number, field))
                 sys.exit(1)
+        if not share.get('source_path'):
+            eprint('Share {} is missing source_path'.format(number))
+            sys.exit(1)
+    return shares
+
+
+def existing_directories(tc, endpoint, directories):
+    """Return the directories that already exist on endpoint, listing each
+    parent directory once rather than each directory."""
+    names_by_parent = {}
+    for directory in directories:
+        parent, name = os.path.split(directory.rstrip('/'))
+        names_by_parent.setdefault(parent, set()).add(name)
+    existing = set()
+    for parent, names in sorted(names_by_parent.items()):
+        for entry in list_directory(tc, endpoint, parent):
+            if entry['type'] == 'dir' and entry['name'] in names:
+                existing.add(os.path.join(parent, entry['name']) + '/')
+    return existing
+
+
+def create_directory(tc, endpoint, directory):
+    """Create directory, and return None or the error."""
+    try:
+        tc.operation_mkdir(endpoint, directory)
+    except TransferAPIError as e:
+        return e
+
+
+def add_access_rule(tc, endpoint, rule):
+    """Create rule, and return None or the error. A rule that already
+    exists is not an error."""
+    try:
+        tc.add_endpoint_acl_rule(endpoint, rule)
+    except TransferAPIError as e:
+        if e.code != u'Exists':
+            return e
+
+
+def share_many(args):
+    """Share every directory listed in the --manifest file."""
+    user_source_endpoint = args.source_endpoint or source_endpoint
+    user_shared_endpoint = args.shared_endpoint or shared_endpoint
+    if not user_shared_endpoint:
+        eprint('Invalid shared endpoint')
+        sys.exit(1)
+    user_destination_path = args.destination_path or destination_path
+    if not user_destination_path.startswith('/'):
+        eprint('Destination path must be absolute')
+        sys.exit(1)
 
-    # transfer data - source directory recursively
-    tdata = globus_sdk.TransferData(tc,
-                                    user_source_endpoint,
-                                    user_shared_endpoint,
-                                    label='Share Data Example')
-    tdata.add_item(user_source_path, destination_directory, recursive=True)
+    shares = load_manifest(args.manifest)
+    directories = []
+    for share in shares:
+        directory = destination_directory_for(
+            share['source_path'],
+            share.get('destination_path') or user_destination_path)
+        if directory in directories:
+            eprint('More than one share is copied to {}'.format(directory))
+            sys.exit(1)
+        directories.append(directory)
+
+    authorizer = get_authorizer(args)
+
+    # look up every username in the manifest that isn't cached at once
+    usernames = [username for share in shares
+                 for username in share.get('usernames', [])]
+    identities = {}
+    if usernames:
+        ac = setup_client(globus_sdk.AuthClient(authorizer=authorizer))
+        identities = resolve_usernames(ac, usernames)
+        unknown = sorted(set(username for username in usernames
+                             if identities[username.lower()] is None))
+        if unknown:
+            eprint('No such identity usernames: {}'.format(
+                ', '.join(unknown)))
+            sys.exit(1)
+
+    tc = setup_client(globus_sdk.TransferClient(authorizer=authorizer))
+
+    # one listing per destination path tells which directories exist
     try:
-        print('Submitting a transfer task')
-        task = tc.submit_transfer(tdata)
+        existing = existing_directories(tc, user_shared_endpoint,
+                                        directories)
     except TransferAPIError as e:
         eprint(e)
         sys.exit(1)
-    print('\ttask_id: {}'.format(task['task_id']))
-    print('You can monitor the transfer task programmatically using Globus SDK'
-          ', or go to the Web UI, https://app.globus.org/activity/{}.'
-          .format(task['task_id']))
+    if existing and not (args.delete or args.update):
+        eprint('Destination directories exist. Delete them or use --delete '
+               'or --update option: {}'.format(', '.join(sorted(existing))))
+        sys.exit(1)
+    if existing and args.update:
+        print('{} destination directories exist and will be updated in place'
+              .format(len(existing)))
+    elif existing:
+        print('{} destination directories exist and will be deleted'.format(
+            len(existing)))
+        ddata = globus_sdk.DeleteData(tc, user_shared_endpoint,
+                                      label='Share Data Example',
+                                      recursive=True)
+        for directory in sorted(existing):
+            ddata.add_item(directory)
+        print('Submitting a delete task')
+        try:
+            task = tc.submit_delete(ddata)
+            print('\ttask_id: {}'.format(task['task_id']))
+            delete_task, = wait_for_tasks(tc, [task['task_id']],
+                                          timeout=DELETE_TIMEOUT)
+        except TransferAPIError as e:
+            eprint(e)
+            sys.exit(1)
+        except asyncio.TimeoutError:
+            eprint('Delete task has yet to complete after {} seconds'
+                   .format(DELETE_TIMEOUT))
+            sys.exit(1)
+        if delete_task['status'] != 'SUCCEEDED':
+            eprint('Delete task {}'.format(delete_task['status']))
+            sys.exit(1)
+
+    failed = set()
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        # directories updated in place are kept, along with their rules
+        missing = [directory for directory in directories
+                   if not (args.update and directory in existing)]
+        print('Creating {} destination directories'.format(len(missing)))
+        errors = executor.map(
+            lambda directory: create_directory(tc, user_shared_endpoint,
+                                               directory), missing)
+        for directory, error in zip(missing, list(errors)):
+            if error is not None:
+                eprint('Could not create {}: {}'.format(directory, error))
+                failed.add(directory)
+
+        rules = []
+        for share, directory in zip(shares, directories):
+            principals = [('identity', user_uuid)
+                          for user_uuid in share.get('user_uuids', [])]
+            principals += [('identity', identities[username.lower()])
+                           for username in share.get('usernames', [])]
+            principals += [('group', group_uuid)
+                           for group_uuid in share.get('group_uuids', [])]
+            if directory not in failed:
+                rules += [access_rule(principal_type, principal, directory)
+                          for principal_type, principal in
+                          sorted(set(principals))]
+        print('Granting read access with {} access rules'.format(len(rules)))
+        errors = executor.map(
+            lambda rule: add_access_rule(tc, user_shared_endpoint, rule),
+            rules)
+        for rule, error in zip(rules, list(errors)):
+            if error is not None:
+                eprint('Could not grant {} {} access to {}: {}'.format(
+                    rule['principal_type'], rule['principal'], rule['path'],
+                    error))
+                failed.add(rule['path'])
+
+    # copy everything that is shared, TRANSFER_BATCH_SIZE items per task
+    items = [(share['source_path'], directory)
+             for share, directory in zip(shares, directories)
+             if directory not in failed]
+    for start in range(0, len(items), TRANSFER_BATCH_SIZE):
+        tdata = share_transfer_data(tc, user_source_endpoint,
+                                    user_shared_endpoint, args)
+        for source, directory in items[start:start + TRANSFER_BATCH_SIZE]:
+            tdata.add_item(source, directory, recursive=True)
+        try:
+            task_id = submit_share_transfer(tc, tdata, args)
+        except TransferAPIError as e:
+            eprint(e)
+            sys.exit(1)
+        if task_id is None:
+            print('A transfer of {} directories has been queued, run "{}" '
+                  'to submit it once the service has room'.format(
+                      len(tdata['DATA']), release_command(queue_user(args))))
+        else:
+            print('Transfer of {} directories submitted\n\ttask_id: {}'
+                  .format(len(tdata['DATA']), task_id))
+
+    if failed:
+        eprint('{} of {} shares failed and were not copied'.format(
+            len(failed), len(shares)))
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -388,13 +689,34 @@ if __name__ == '__main__':
             '--username',
             help='Identity username of a user transferred data will be shared '
             'with, e.g. johndoe@uchicago.edu')
-    parser.add_argument(
+    existing = parser.add_mutually_exclusive_group()
+    existing.add_argument(
             '--delete', action='store_true',
             help='Delete a destination directory if already exists before '
             'transferring data')
+    existing.add_argument(
+            '--update', action='store_true',
+            help='Sync data onto a destination directory that already '
+            'exists, keeping its access rules, instead of deleting it')
+    parser.add_argument(
+            '--sync-level', choices=SYNC_LEVELS, default=UPDATE_SYNC_LEVEL,
+            help='How --update decides which files to copy (default: '
+            '%(default)s)')
     parser.add_argument('--auth', choices=APP_AUTHENTICATORS,
                         default=AUTHENTICATION)
     parser.add_argument('--client-secret')
+    parser.add_argument(
+            '--queue', action='store_true',
+            help='Submit the transfer through the local submission queue, '
+            'ahead of queued bulk transfers')
+    parser.add_argument(
+            '--manifest',
+            help='JSON or YAML file listing many directories to share, see '
+            'the top of this script. --source-path, --user-uuid, --username '
+            'and --group-uuid are ignored')
     args = parser.parse_args()
 
-    share_data(args)
+    if args.manifest:
+        share_many(args)
+    else:
+        share_data(args)
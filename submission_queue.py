@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+"""
+A local, persistent queue of transfer and delete submissions, released only
+when the Transfer service has room for them.
+
+When many scheduled scripts fire together, submitting everything at once
+runs into the service's limits on concurrently active tasks, and the extra
+submissions fail or queue unpredictably. Instead, scripts can enqueue their
+TransferData or DeleteData documents here. Each call to release() counts the
+user's active tasks, overall and per endpoint, and submits queued documents
+in priority order only while both counts are under their limits. Entries
+whose deadline passes before a slot frees up are expired rather than
+submitted late.
+
+The queue lives in a SQLite file shared by every script, so documents queued
+by one run are released by the next run of any script for the same user.
+Users are identified by strings such as "native:<client id>" for Native App
+logins or "client:<client id>" for Client Credential apps; see native_user()
+and client_user().
+Documents keep their submission_id, so a document submitted twice after a
+crash still creates only one task.
+
+Run as a script to list the queue or release what fits:
+
+    ./submission_queue.py list
+    ./submission_queue.py release
+
+release logs in like globus_folder_sync.py, see that script for details,
+and releases the entries of its Native App user. Entries queued by a
+Client Credential app, such as cleanup_cache.py's, are released by logging
+in as that app:
+
+    ./submission_queue.py release --auth client-credentials \
+        --client-id <client id> --client-secret <client secret>
+
+release_command() gives the right command for a user.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sqlite3
+import time
+
+from globus_sdk.exc import TransferAPIError
+
+QUEUE_FILE = 'submission-queue.db'
+
+# Shares people are waiting on go ahead of bulk syncs and cleanups
+PRIORITY_HIGH = 10
+PRIORITY_BULK = 0
+
+# Local limits on active (ACTIVE or INACTIVE) tasks, kept below the
+# service's own limits
+MAX_ACTIVE_TASKS_PER_USER = 10
+MAX_ACTIVE_TASKS_PER_ENDPOINT = 3
+
+QUEUED = 'queued'
+SUBMITTED = 'submitted'
+EXPIRED = 'expired'
+FAILED = 'failed'
+
+
+def native_user(client_id):
+    return 'native:' + client_id
+
+
+def client_user(client_id):
+    return 'client:' + client_id
+
+
+def release_command(user):
+    """The command that releases user's queued entries."""
+    kind, client_id = user.split(':', 1)
+    if kind == 'native':
+        return './submission_queue.py release --client-id {}'.format(
+            client_id)
+    return ('./submission_queue.py release --auth client-credentials '
+            '--client-id {} --client-secret <client secret>'.format(
+                client_id))
+
+
+def document_endpoints(document):
+    """Return the endpoints a TransferData or DeleteData document uses."""
+    if document['DATA_TYPE'] == 'delete':
+        return [document['endpoint']]
+    return [document['source_endpoint'], document['destination_endpoint']]
+
+
+def count_active_tasks(transfer_client):
+    """Return (number of active tasks, {endpoint: number of active tasks})
+    for the user of transfer_client."""
+    tasks = transfer_client.task_list(
+        num_results=None, filter='status:ACTIVE,INACTIVE',
+        fields='task_id,source_endpoint_id,destination_endpoint_id')
+    total, per_endpoint = 0, {}
+    for task in tasks:
+        total += 1
+        for field in ('source_endpoint_id', 'destination_endpoint_id'):
+            if task[field]:
+                per_endpoint[task[field]] = \
+                    per_endpoint.get(task[field], 0) + 1
+    return total, per_endpoint
+
+
+class SubmissionQueue(object):
+
+    def __init__(self, filepath=QUEUE_FILE,
+                 max_active_per_user=MAX_ACTIVE_TASKS_PER_USER,
+                 max_active_per_endpoint=MAX_ACTIVE_TASKS_PER_ENDPOINT):
+        self.max_active_per_user = max_active_per_user
+        self.max_active_per_endpoint = max_active_per_endpoint
+        self.conn = sqlite3.connect(filepath, timeout=30)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS submissions ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT, key TEXT, '
+                'priority INTEGER, deadline REAL, enqueued_at REAL, '
+                'document TEXT, state TEXT, task_id TEXT, message TEXT)')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS submissions_by_state '
+                'ON submissions (user, state, priority)')
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, user, document, priority=PRIORITY_BULK, deadline=None,
+                key=None):
+        """Queue a TransferData or DeleteData document for user, who must
+        match the user of the TransferClient later passed to release().
+        deadline is a time.time() value after which the document is dropped
+        instead of submitted. A document with the same key as one still
+        queued for user replaces it. Returns the queue entry ID."""
+        with self.conn:
+            if key is not None:
+                self.conn.execute(
+                    'DELETE FROM submissions '
+                    'WHERE user = ? AND key = ? AND state = ?',
+                    (user, key, QUEUED))
+            cursor = self.conn.execute(
+                'INSERT INTO submissions (user, key, priority, deadline, '
+                'enqueued_at, document, state) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (user, key, priority, deadline, time.time(),
+                 json.dumps(dict(document)), QUEUED))
+        return cursor.lastrowid
+
+    def entries(self, user=None, state=QUEUED):
+        """Return the entries in state, in the order they would be
+        released."""
+        query = ('SELECT id, user, key, priority, deadline, document, state, '
+                 'task_id, message FROM submissions WHERE state = ?')
+        params = [state]
+        if user is not None:
+            query += ' AND user = ?'
+            params.append(user)
+        query += (' ORDER BY priority DESC, deadline IS NULL, deadline, id')
+        fields = ('id', 'user', 'key', 'priority', 'deadline', 'document',
+                  'state', 'task_id', 'message')
+        entries = []
+        for row in self.conn.execute(query, params):
+            entry = dict(zip(fields, row))
+            entry['document'] = json.loads(entry['document'])
+            entries.append(entry)
+        return entries
+
+    def release(self, transfer_client, user, now=None):
+        """Submit as many of user's queued documents as the active task
+        limits allow, highest priority first. Returns the entries submitted
+        in this call."""
+        now = time.time() if now is None else now
+        active, per_endpoint = count_active_tasks(transfer_client)
+        submitted = []
+        for entry in self.entries(user=user):
+            if entry['deadline'] is not None and entry['deadline'] < now:
+                self._finish(entry, EXPIRED, message='Deadline passed')
+                continue
+            if active >= self.max_active_per_user:
+                break
+            endpoints = set(document_endpoints(entry['document']))
+            if any(per_endpoint.get(endpoint, 0) >=
+                   self.max_active_per_endpoint for endpoint in endpoints):
+                continue
+            try:
+                if entry['document']['DATA_TYPE'] == 'delete':
+                    task = transfer_client.submit_delete(entry['document'])
+                else:
+                    task = transfer_client.submit_transfer(entry['document'])
+            except TransferAPIError as tapie:
+                if tapie.http_status in (409, 429, 503):
+                    # The service is full after all, try again later
+                    break
+                self._finish(entry, FAILED, message=tapie.message)
+                continue
+            active += 1
+            for endpoint in endpoints:
+                per_endpoint[endpoint] = per_endpoint.get(endpoint, 0) + 1
+            self._finish(entry, SUBMITTED, task_id=task['task_id'])
+            entry.update(state=SUBMITTED, task_id=task['task_id'])
+            submitted.append(entry)
+        return submitted
+
+    def _finish(self, entry, state, task_id=None, message=None):
+        with self.conn:
+            self.conn.execute(
+                'UPDATE submissions SET state = ?, task_id = ?, message = ? '
+                'WHERE id = ?', (state, task_id, message, entry['id']))
+
+
+def submit_or_enqueue(transfer_client, user, document, priority=PRIORITY_BULK,
+                      deadline=None, key=None, filepath=QUEUE_FILE):
+    """Queue document and release whatever fits for user right away.
+    Returns the task ID if document was submitted now, otherwise None, in
+    which case a later release() submits it."""
+    queue = SubmissionQueue(filepath)
+    try:
+        entry_id = queue.enqueue(user, document, priority, deadline, key)
+        for entry in queue.release(transfer_client, user):
+            if entry['id'] == entry_id:
+                return entry['task_id']
+        return None
+    finally:
+        queue.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='List or release queued Transfer submissions.')
+    parser.add_argument('action', choices=('list', 'release'))
+    parser.add_argument('--auth', choices=('native', 'client-credentials'),
+                        default='native',
+                        help='How release logs in, which decides whose '
+                        'entries it releases (default: %(default)s)')
+    parser.add_argument('--client-id',
+                        help='Client ID of the app to log in as (default: '
+                        'the one in globus_folder_sync.py)')
+    parser.add_argument('--client-secret',
+                        help='Secret of a Client Credential app')
+    args = parser.parse_args()
+
+    queue = SubmissionQueue()
+    if args.action == 'list':
+        for entry in queue.entries():
+            print('{id}: priority {priority}, {user}, {key}'.format(**entry))
+        return
+
+    if args.auth == 'native':
+        import globus_folder_sync
+
+        client_id = args.client_id or globus_folder_sync.CLIENT_ID
+        globus_folder_sync.CLIENT_ID = client_id
+        transfer = globus_folder_sync.setup_transfer_client(
+            globus_folder_sync.get_transfer_tokens(), endpoints=[])
+        user = native_user(client_id)
+    else:
+        from globus_sdk import TransferClient
+        from globus_session import confidential_app_authorizer, setup_client
+
+        if not (args.client_id and args.client_secret):
+            parser.error('--auth client-credentials needs --client-id and '
+                         '--client-secret')
+        transfer = setup_client(TransferClient(
+            authorizer=confidential_app_authorizer(args.client_id,
+                                                   args.client_secret)))
+        user = client_user(args.client_id)
+    for entry in queue.release(transfer, user):
+        print('{}: submitted task {}'.format(entry['id'], entry['task_id']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+A local SQLite manifest of the files seen on both sides of a sync, used by
+globus_folder_sync.py to transfer only what changed since the last
+successful sync.
+
+Each side (source and destination) is stored as a set of
+(path, size, mtime) rows, with paths relative to the synced directory. A
+listing taken when a task is submitted is kept as "pending" until that task
+is known to have succeeded, at which point it replaces the "synced" listing.
+The destination side is then replaced by a fresh listing of the destination,
+since files the task skipped as already in sync keep their own size and
+mtime rather than the source's. If the task fails, the pending listing is
+discarded and the next run diffs against the last successful sync again.
+"""
+
+import sqlite3
+
+SOURCE = 'source'
+DESTINATION = 'destination'
+
+SYNCED = 'synced'
+PENDING = 'pending'
+
+
+class SyncManifest(object):
+
+    def __init__(self, filepath):
+        self.conn = sqlite3.connect(filepath)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'generation TEXT, side TEXT, path TEXT, size INTEGER, '
+                'mtime TEXT, PRIMARY KEY (generation, side, path))')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS meta ('
+                'key TEXT PRIMARY KEY, value TEXT)')
+
+    def close(self):
+        self.conn.close()
+
+    def has_synced(self):
+        """True if a successful sync has been recorded."""
+        return self._get_meta('synced_task_id') is not None
+
+    def pending_task_id(self):
+        return self._get_meta('pending_task_id')
+
+    def load(self, side, generation=SYNCED):
+        """Return {path: (size, mtime)} for one side of the manifest."""
+        rows = self.conn.execute(
+            'SELECT path, size, mtime FROM entries '
+            'WHERE generation = ? AND side = ?', (generation, side))
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def save_pending(self, task_id, source_files, destination_files):
+        """Record the listings expected once task_id has succeeded."""
+        with self.conn:
+            self.conn.execute('DELETE FROM entries WHERE generation = ?',
+                              (PENDING,))
+            for side, files in ((SOURCE, source_files),
+                                (DESTINATION, destination_files)):
+                self.conn.executemany(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                    ((PENDING, side, path, size, mtime)
+                     for path, (size, mtime) in files.items()))
+            self._set_meta('pending_task_id', task_id)
+
+    def promote_pending(self, destination_files=None):
+        """The pending task succeeded, make its listings the synced ones.
+        destination_files, if given, is what the destination holds now, and
+        replaces the destination listing expected when it was submitted."""
+        with self.conn:
+            self.conn.execute('DELETE FROM entries WHERE generation = ?',
+                              (SYNCED,))
+            if destination_files is not None:
+                self.conn.execute(
+                    'DELETE FROM entries WHERE generation = ? AND side = ?',
+                    (PENDING, DESTINATION))
+                self.conn.executemany(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?, ?)',
+                    ((PENDING, DESTINATION, path, size, mtime)
+                     for path, (size, mtime) in destination_files.items()))
+            self.conn.execute(
+                'UPDATE entries SET generation = ? WHERE generation = ?',
+                (SYNCED, PENDING))
+            self._set_meta('synced_task_id', self.pending_task_id())
+            self._set_meta('pending_task_id', None)
+
+    def discard_pending(self):
+        """The pending task failed, keep diffing against the last sync."""
+        with self.conn:
+            self.conn.execute('DELETE FROM entries WHERE generation = ?',
+                              (PENDING,))
+            self._set_meta('pending_task_id', None)
+
+    def _get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?',
+                                (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                          (key, value))
+
+
+def changed_files(source_files, destination_files,
+                  synced_source, synced_destination):
+    """Return the sorted paths that need transferring: files that are new or
+    changed on the source since the last sync, and files that have gone
+    missing or been modified on the destination since then."""
+    changed = []
+    for path, entry in source_files.items():
+        if entry != synced_source.get(path) or \
+                path not in destination_files or \
+                destination_files[path] != synced_destination.get(path):
+            changed.append(path)
+    return sorted(changed)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""
+Sync many directory pairs in one run. Each pair works like
+globus_folder_sync.py: a new recursive sync is only submitted if the pair's
+previous task has finished. All pairs share a single login and
+TransferClient, each distinct endpoint is autoactivated once, and pairs are
+checked and submitted concurrently.
+
+The pairs are read from a JSON (or, with PyYAML installed, YAML) file:
+
+{
+    "pairs": [
+        {
+            "name": "godata",
+            "source_endpoint": "ddb59aef-6d04-11e5-ba46-22000b92c6ec",
+            "source_path": "/share/godata/",
+            "destination_endpoint": "ddb59af0-6d04-11e5-ba46-22000b92c6ec",
+            "destination_path": "/~/sync-demo/"
+        }
+    ]
+}
+
+Each pair may also set "sync_level" (default "checksum") and "label". Every
+task submitted is recorded in the task store (see task_store.py) under the
+pair's name.
+
+Authorization is shared with globus_folder_sync.py, see that script for
+details.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from globus_sdk import TransferData
+from globus_sdk.exc import GlobusError, TransferAPIError
+
+from config_file import load_config
+from globus_folder_sync import (get_transfer_tokens, setup_transfer_client,
+                                PREVIOUS_TASK_RUN_CASES)
+from task_store import TaskStore
+
+TASK_STORE_FILE = 'sync-runner-tasks.db'
+
+# Number of pairs checked and submitted at the same time
+MAX_CONCURRENT_PAIRS = 4
+
+REQUIRED_PAIR_FIELDS = ('name', 'source_endpoint', 'source_path',
+                        'destination_endpoint', 'destination_path')
+
+
+def eprint(*args, **kwargs):
+    """Same as print, but to standard error"""
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def load_pairs(filepath):
+    """Load and validate the list of sync pairs from a JSON or YAML file."""
+    config = load_config(filepath)
+
+    pairs = config.get('pairs', [])
+    names = set()
+    for pair in pairs:
+        missing = [field for field in REQUIRED_PAIR_FIELDS
+                   if not pair.get(field)]
+        if missing:
+            eprint('Sync pair {} is missing {}'.format(
+                pair.get('name', '?'), ', '.join(missing)))
+            sys.exit(1)
+        if pair['name'] in names:
+            eprint('Duplicate sync pair name {}'.format(pair['name']))
+            sys.exit(1)
+        names.add(pair['name'])
+    return pairs
+
+
+def sync_pair(transfer_client, pair, previous_task_id):
+    """Submit a sync for one pair unless its previous task is still going.
+    Returns a result dict with the pair's 'name', an 'outcome' of
+    'submitted', 'skipped' or 'failed', and a 'message'. Submitted results
+    also carry the new 'task', and results for pairs with a previous task
+    carry its current document as 'previous_task'."""
+    result = {'name': pair['name']}
+    try:
+        if previous_task_id:
+            previous_task = transfer_client.get_task(previous_task_id).data
+            result['previous_task'] = previous_task
+            status = previous_task['status']
+            if status not in PREVIOUS_TASK_RUN_CASES:
+                result.update(outcome='skipped', message='The last transfer '
+                              'status is {}'.format(status))
+                return result
+
+        transfer_client.operation_ls(pair['source_endpoint'],
+                                     path=pair['source_path'])
+        try:
+            transfer_client.operation_ls(pair['destination_endpoint'],
+                                         path=pair['destination_path'])
+        except TransferAPIError as tapie:
+            if tapie.code != 'ClientError.NotFound':
+                raise
+            transfer_client.operation_mkdir(pair['destination_endpoint'],
+                                            pair['destination_path'])
+
+        tdata = TransferData(
+            transfer_client,
+            pair['source_endpoint'],
+            pair['destination_endpoint'],
+            label=pair.get('label', 'Folder Sync {}'.format(pair['name'])),
+            sync_level=pair.get('sync_level', 'checksum')
+        )
+        tdata.add_item(pair['source_path'], pair['destination_path'],
+                       recursive=True)
+        task = transfer_client.submit_transfer(tdata)
+    except GlobusError as error:
+        result.update(outcome='failed',
+                      message=getattr(error, 'message', str(error)))
+        return result
+    result.update(outcome='submitted', task=task.data,
+                  message='Submitted task {}'.format(task['task_id']))
+    return result
+
+
+def run(transfer_client, pairs, store, max_concurrent=MAX_CONCURRENT_PAIRS):
+    """Sync every pair, at most max_concurrent at a time. Records tasks in
+    store as they are checked and submitted, and returns the results in the
+    order of pairs."""
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        futures = {}
+        for pair in pairs:
+            previous_task = store.latest_task(pair['name']) or {}
+            futures[executor.submit(sync_pair, transfer_client, pair,
+                                    previous_task.get('task_id'))] = \
+                pair['name']
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if result.get('previous_task'):
+                store.record_status(result['previous_task'])
+            if result['outcome'] == 'submitted':
+                store.record_submission(result['name'], result['task'])
+    return [results[pair['name']] for pair in pairs]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Sync many directory pairs between Globus endpoints in '
+        'one run.'
+    )
+    parser.add_argument(
+        'config',
+        help='JSON or YAML file listing the pairs to sync')
+    parser.add_argument(
+        '--max-concurrent', type=int, default=MAX_CONCURRENT_PAIRS,
+        help='Number of pairs to check and submit at the same time')
+    args = parser.parse_args()
+
+    pairs = load_pairs(args.config)
+    if not pairs:
+        eprint('No sync pairs found in {}'.format(args.config))
+        sys.exit(1)
+
+    endpoints = set()
+    for pair in pairs:
+        endpoints.update([pair['source_endpoint'],
+                          pair['destination_endpoint']])
+    transfer = setup_transfer_client(get_transfer_tokens(), endpoints)
+
+    store = TaskStore(TASK_STORE_FILE)
+    results = run(transfer, pairs, store, args.max_concurrent)
+    store.close()
+    for result in results:
+        print('{}: {}, {}'.format(result['name'], result['outcome'],
+                                  result['message']))
+    if any(result['outcome'] == 'failed' for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
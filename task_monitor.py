@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""
+Watch many Transfer tasks at once from a single asyncio event loop.
+
+Each task is polled on its own schedule. While a task makes no visible
+progress its polling interval backs off exponentially, up to
+MAX_POLL_INTERVAL. Once it makes progress, the next poll is planned from the
+estimated time to completion, so tasks that are nearly done are polled more
+often. All polls share a global rate limit, so one process can supervise
+hundreds of tasks with a few requests per second.
+
+Callers can register a callback for status changes, await individual tasks
+with TaskMonitor.wait(), or block on a set of tasks with wait_for_tasks().
+
+Run as a script to watch tasks until they finish:
+
+    ./task_monitor.py <task id> [<task id> ...]
+
+Authorization is shared with globus_folder_sync.py, see that script for
+details.
+"""
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import heapq
+import sys
+
+from globus_sdk.exc import GlobusError
+
+FINISHED_STATUSES = ('SUCCEEDED', 'FAILED')
+
+MIN_POLL_INTERVAL = 2
+MAX_POLL_INTERVAL = 300
+BACKOFF_FACTOR = 2
+# Upper bound on get_task calls per second across all watched tasks
+MAX_REQUESTS_PER_SECOND = 4
+
+
+def print_status_change(task_id, old_status, task):
+    print('Task {}: {} -> {}'.format(task_id, old_status or 'watching',
+                                     task['status']))
+
+
+def task_fraction_done(task):
+    """Return the fraction of the task's subtasks that are finished, or
+    None if the task doesn't say."""
+    total = task.get('subtasks_total')
+    if not total:
+        return None
+    done = sum(task.get(field) or 0 for field in (
+        'subtasks_succeeded', 'subtasks_failed', 'subtasks_canceled',
+        'subtasks_expired'))
+    return float(done) / total
+
+
+class WatchedTask(object):
+    __slots__ = ('task_id', 'status', 'interval', 'fraction', 'polled_at',
+                 'waiters', 'callbacks')
+
+    def __init__(self, task_id, interval):
+        self.task_id = task_id
+        self.status = None
+        self.interval = interval
+        self.fraction = None
+        self.polled_at = None
+        self.waiters = []
+        self.callbacks = []
+
+
+class TaskMonitor(object):
+
+    def __init__(self, transfer_client, on_change=print_status_change,
+                 min_interval=MIN_POLL_INTERVAL,
+                 max_interval=MAX_POLL_INTERVAL,
+                 max_requests_per_second=MAX_REQUESTS_PER_SECOND):
+        self.transfer_client = transfer_client
+        self.on_change = on_change
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.request_spacing = 1.0 / max_requests_per_second
+        self.tasks = {}
+        self._schedule = []
+        self._wakeup = None
+
+    def watch(self, task_id, callback=None):
+        """Start watching task_id. callback, if given, is called with
+        (task_id, old status, task document) on every status change."""
+        watched = self.tasks.get(task_id)
+        if watched is None:
+            watched = self.tasks[task_id] = WatchedTask(task_id,
+                                                        self.min_interval)
+            heapq.heappush(self._schedule, (0, task_id))
+            if self._wakeup is not None:
+                self._wakeup.set()
+        if callback is not None:
+            watched.callbacks.append(callback)
+        return watched
+
+    async def wait(self, task_id):
+        """Watch task_id if needed and return its task document once it has
+        finished. run() must be running for this to complete."""
+        future = asyncio.get_running_loop().create_future()
+        self.watch(task_id).waiters.append(future)
+        return await future
+
+    async def run(self):
+        """Poll watched tasks until none are left."""
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        polls = set()
+        while self.tasks:
+            if self._schedule and self._schedule[0][0] <= loop.time():
+                _, task_id = heapq.heappop(self._schedule)
+                poll = loop.create_task(self._poll(task_id))
+                polls.add(poll)
+                poll.add_done_callback(polls.discard)
+                await asyncio.sleep(self.request_spacing)
+                continue
+            self._wakeup.clear()
+            timeout = None
+            if self._schedule:
+                timeout = max(0, self._schedule[0][0] - loop.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wakeup = None
+
+    async def _poll(self, task_id):
+        loop = asyncio.get_running_loop()
+        watched = self.tasks[task_id]
+        try:
+            task = await loop.run_in_executor(
+                None, self.transfer_client.get_task, task_id)
+        except GlobusError as error:
+            print('Could not get the status of task {}: {}'.format(
+                task_id, getattr(error, 'message', error)))
+            self._reschedule(watched, self._backoff(watched))
+            return
+
+        task = task.data if hasattr(task, 'data') else task
+        if task['status'] != watched.status:
+            old_status, watched.status = watched.status, task['status']
+            for callback in [self.on_change] + watched.callbacks:
+                if callback is not None:
+                    callback(task_id, old_status, task)
+
+        if task['status'] in FINISHED_STATUSES:
+            del self.tasks[task_id]
+            for future in watched.waiters:
+                if not future.done():
+                    future.set_result(task)
+            self._wakeup.set()
+            return
+        self._reschedule(watched, self._next_interval(watched, task,
+                                                      loop.time()))
+
+    def _backoff(self, watched):
+        return min(self.max_interval, watched.interval * BACKOFF_FACTOR)
+
+    def _next_interval(self, watched, task, now):
+        """Back off while the task shows no progress; otherwise aim to poll
+        again about halfway to its estimated completion."""
+        fraction = task_fraction_done(task)
+        interval = self._backoff(watched)
+        if task['status'] == 'ACTIVE' and fraction is not None and \
+                watched.fraction is not None and fraction > watched.fraction:
+            rate = (fraction - watched.fraction) / (now - watched.polled_at)
+            remaining = (1 - fraction) / rate
+            interval = min(interval, remaining / 2)
+        watched.fraction = fraction
+        watched.polled_at = now
+        return max(self.min_interval, interval)
+
+    def _reschedule(self, watched, interval):
+        watched.interval = interval
+        loop = asyncio.get_running_loop()
+        heapq.heappush(self._schedule, (loop.time() + interval,
+                                        watched.task_id))
+        self._wakeup.set()
+
+
+def wait_for_tasks(transfer_client, task_ids, timeout=None,
+                   on_change=print_status_change):
+    """Block until every task in task_ids has finished, and return their
+    task documents in the same order. Raises asyncio.TimeoutError if they
+    haven't all finished after timeout seconds."""
+    monitor = TaskMonitor(transfer_client, on_change=on_change)
+    for task_id in task_ids:
+        monitor.watch(task_id)
+
+    async def watch_all():
+        waits = asyncio.gather(*[monitor.wait(task_id)
+                                 for task_id in task_ids])
+        runner = asyncio.ensure_future(monitor.run())
+        try:
+            return await asyncio.wait_for(waits, timeout)
+        finally:
+            runner.cancel()
+
+    return asyncio.run(watch_all())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Watch Transfer tasks until they finish.')
+    parser.add_argument('task_ids', nargs='+', metavar='task_id')
+    parser.add_argument('--timeout', type=float,
+                        help='Give up after this many seconds')
+    args = parser.parse_args()
+
+    from globus_folder_sync import get_transfer_tokens, setup_transfer_client
+    transfer = setup_transfer_client(get_transfer_tokens(), endpoints=[])
+    try:
+        tasks = wait_for_tasks(transfer, args.task_ids, args.timeout)
+    except asyncio.TimeoutError:
+        print('Tasks have yet to complete after {} seconds'.format(
+            args.timeout), file=sys.stderr)
+        sys.exit(1)
+    if any(task['status'] != 'SUCCEEDED' for task in tasks):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
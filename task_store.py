@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""
+An append-only history of submitted Transfer tasks, kept in SQLite.
+
+Every submission is appended as a row keyed by its sync pair, together with
+a run ID shared by all tasks submitted in the same run (a sharded sync
+submits several). Status checks append an observation instead of rewriting
+earlier rows, so nothing already recorded is ever rewritten and the full
+history stays available for reporting. The database runs in WAL mode and
+each append is its own transaction, so a process killed part way through a
+write leaves the earlier history intact, and appends cost the same however
+long the history grows.
+
+Run as a script to look up or record tasks from shell scripts, or to print
+the history of a pair:
+
+    ./task_store.py latest <pair>
+    ./task_store.py record <pair> <task id> [<status>]
+    ./task_store.py history [<pair>]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sqlite3
+import time
+
+TASK_STORE_FILE = 'transfer-tasks.db'
+
+# Task fields kept with each status observation
+STATUS_FIELDS = ('status', 'bytes_transferred', 'files_transferred', 'files',
+                 'completion_time')
+
+
+class TaskStore(object):
+
+    def __init__(self, filepath=TASK_STORE_FILE):
+        self.conn = sqlite3.connect(filepath, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS tasks ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, pair TEXT, run TEXT, '
+                'submitted_at REAL, task_id TEXT, document TEXT)')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS tasks_by_pair '
+                'ON tasks (pair, submitted_at)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS observations ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT, '
+                'observed_at REAL, status TEXT, document TEXT)')
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS observations_by_task '
+                'ON observations (task_id, id)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS polls ('
+                'pair TEXT PRIMARY KEY, not_before REAL, interval REAL)')
+
+    def close(self):
+        self.conn.close()
+
+    def record_submission(self, pair, task, run=None):
+        """Append a submitted task document for pair. Tasks submitted in
+        the same run should share run, which defaults to the task ID."""
+        task = dict(task)
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO tasks (pair, run, submitted_at, task_id, '
+                'document) VALUES (?, ?, ?, ?, ?)',
+                (pair, run or task['task_id'], time.time(), task['task_id'],
+                 json.dumps(task)))
+            if task.get('status'):
+                self._observe(task)
+
+    def record_status(self, task):
+        """Append the current status and progress of a task document."""
+        with self.conn:
+            self._observe(task)
+
+    def latest_run(self, pair):
+        """Return the tasks of the most recent run for pair, each updated
+        with its last recorded status, or [] if pair has no tasks."""
+        row = self.conn.execute(
+            'SELECT run FROM tasks WHERE pair = ? '
+            'ORDER BY submitted_at DESC, id DESC LIMIT 1', (pair,)).fetchone()
+        if row is None:
+            return []
+        rows = self.conn.execute(
+            'SELECT document FROM tasks WHERE pair = ? AND run = ? '
+            'ORDER BY id', (pair, row[0]))
+        return [self._with_status(json.loads(document))
+                for document, in rows]
+
+    def has_task(self, task_id):
+        """Return True if task_id has been recorded for any pair."""
+        return self.conn.execute(
+            'SELECT 1 FROM tasks WHERE task_id = ? LIMIT 1',
+            (task_id,)).fetchone() is not None
+
+    def latest_task(self, pair):
+        """Return the last task submitted for pair, or None."""
+        tasks = self.latest_run(pair)
+        return tasks[-1] if tasks else None
+
+    def next_poll(self, pair):
+        """Return (not_before, interval) as last set for pair, or
+        (None, None)."""
+        row = self.conn.execute(
+            'SELECT not_before, interval FROM polls WHERE pair = ?',
+            (pair,)).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def set_next_poll(self, pair, not_before, interval):
+        """Note that the tasks of pair need not be checked again before the
+        time.time() value not_before. Only the latest value is kept."""
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO polls VALUES (?, ?, ?)',
+                              (pair, not_before, interval))
+
+    def history(self, pair=None):
+        """Yield (pair, submitted_at, task) for every task recorded, oldest
+        first, with each task's last recorded status."""
+        query = 'SELECT pair, submitted_at, document FROM tasks'
+        params = ()
+        if pair is not None:
+            query += ' WHERE pair = ?'
+            params = (pair,)
+        query += ' ORDER BY submitted_at, id'
+        for pair, submitted_at, document in self.conn.execute(query, params):
+            yield pair, submitted_at, self._with_status(json.loads(document))
+
+    def _observe(self, task):
+        fields = {field: task[field] for field in STATUS_FIELDS
+                  if task.get(field) is not None}
+        self.conn.execute(
+            'INSERT INTO observations (task_id, observed_at, status, '
+            'document) VALUES (?, ?, ?, ?)',
+            (task['task_id'], time.time(), task['status'],
+             json.dumps(fields)))
+
+    def _with_status(self, task):
+        row = self.conn.execute(
+            'SELECT document FROM observations WHERE task_id = ? '
+            'ORDER BY id DESC LIMIT 1', (task['task_id'],)).fetchone()
+        if row is not None:
+            task.update(json.loads(row[0]))
+        return task
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Look up or record Transfer tasks in the task store.')
+    parser.add_argument('--store', default=TASK_STORE_FILE)
+    subparsers = parser.add_subparsers(dest='action')
+    subparsers.required = True
+    latest = subparsers.add_parser(
+        'latest', help='Print the ID and last known status of the latest '
+        'task for a pair')
+    latest.add_argument('pair')
+    record = subparsers.add_parser(
+        'record', help='Record a submitted task, or a new status for it')
+    record.add_argument('pair')
+    record.add_argument('task_id')
+    record.add_argument('status', nargs='?')
+    history = subparsers.add_parser('history',
+                                    help='Print every task recorded')
+    history.add_argument('pair', nargs='?')
+    args = parser.parse_args()
+
+    store = TaskStore(args.store)
+    if args.action == 'latest':
+        task = store.latest_task(args.pair)
+        if task is not None:
+            print(task['task_id'], task.get('status', ''))
+    elif args.action == 'record':
+        task = {'task_id': args.task_id, 'status': args.status}
+        latest = store.latest_task(args.pair)
+        if latest is not None and latest['task_id'] == args.task_id:
+            if args.status:
+                store.record_status(task)
+        else:
+            store.record_submission(args.pair, task)
+    else:
+        for pair, submitted_at, task in store.history(args.pair):
+            print('{} {} {} {}'.format(
+                time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(submitted_at)),
+                pair, task['task_id'], task.get('status', '')))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+cleanup_cache.main() against a stub Transfer client, checking that a task
+whose source directories can't be listed is retried rather than handled.
+"""
+
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+import cleanup_cache
+from api_retry import CircuitOpenError
+
+TASK = {
+    'task_id': 'task-1',
+    'type': 'TRANSFER',
+    'source_endpoint_id': cleanup_cache.SOURCE_ENDPOINT_ID,
+    'source_endpoint': 'source',
+    'destination_endpoint': 'destination',
+    'owner_string': 'someone@example.org',
+}
+
+
+class NotFound(cleanup_cache.TransferAPIError):
+
+    def __init__(self):
+        self.code = 'ClientError.NotFound'
+        self.message = 'Directory not found'
+        self.http_status = 404
+
+
+class StubTransferClient(object):
+    """Lists every directory with ls_error, and records deletions."""
+
+    def __init__(self, ls_error):
+        self.ls_error = ls_error
+        self.deletions = []
+
+    def operation_ls(self, endpoint, **params):
+        raise self.ls_error
+
+    def submit_delete(self, data):
+        self.deletions.append(data)
+        return {'task_id': 'delete-1', 'code': 'Accepted'}
+
+
+def run_cleanup(monkeypatch, tmp_path, tc):
+    # recent, so the handled task isn't pruned at the end of the run
+    task = dict(TASK, completion_time=datetime.utcnow().strftime(
+        cleanup_cache.TIME_FORMAT))
+    tree = cleanup_cache.TransferredTree()
+    tree.add('/data/run1/output.nc')
+    state_file = str(tmp_path / 'cleanup-state.json')
+    monkeypatch.setattr(cleanup_cache, 'STATE_FILE', state_file)
+    monkeypatch.setattr(cleanup_cache, 'do_client_authentication',
+                        lambda *args: 'token')
+    monkeypatch.setattr(cleanup_cache, 'setup_client', lambda client: tc)
+    monkeypatch.setattr(cleanup_cache, 'autoactivate_endpoints',
+                        lambda *args: None)
+    monkeypatch.setattr(cleanup_cache, 'iter_completed_tasks',
+                        lambda tc, completion_range: iter([task]))
+    monkeypatch.setattr(
+        cleanup_cache, 'iter_task_summaries',
+        lambda tc, tasks: ((task, tree, None) for task in tasks))
+    cleanup_cache.main()
+    with open(state_file) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('ls_error', [
+    CircuitOpenError(cleanup_cache.SOURCE_ENDPOINT_ID, time.time() + 60),
+])
+def test_listing_error_retries_task(monkeypatch, tmp_path, ls_error):
+    tc = StubTransferClient(ls_error)
+    state = run_cleanup(monkeypatch, tmp_path, tc)
+    assert 'task-1' not in state['handled']
+    assert state['retry']['task-1']['attempts'] == 1
+    assert tc.deletions == []
+
+
+def test_missing_directory_handles_task(monkeypatch, tmp_path):
+    tc = StubTransferClient(NotFound())
+    state = run_cleanup(monkeypatch, tmp_path, tc)
+    assert 'task-1' in state['handled']
+    assert state['retry'] == {}
+    assert tc.deletions == []